@@ -2,23 +2,307 @@ import sqlite3
 import threading
 import re
 import time
-import random
+from concurrent.futures import ThreadPoolExecutor
 from urllib import parse
 from string import ascii_uppercase
 import requests
 from bs4 import BeautifulSoup
 from parse_app_page import ParseAppStorePage
+from stream_parse import StreamingParseAppStorePage
+from db_shards import open_writer, read_shard_paths, shard_index
+from migrations import migrate
+from frontier import CrawlFrontier
+from url_dedup import LinkDeduper, app_id_from_url
+from metrics import registry, TimedLock
+from rate_limiter import (
+    AdaptiveRateLimiter, RETRYABLE, THROTTLED, TIMEOUT, classify_status, parse_retry_after
+)
+
+fetch_seconds = registry.histogram(
+    'app_store_fetch_seconds', 'Time taken by each request, by status code', ['status']
+)
+fetch_bytes = registry.counter(
+    'app_store_fetch_bytes_total', 'Bytes of response bodies downloaded'
+)
+parse_seconds = registry.histogram(
+    'app_store_parse_seconds', 'Time taken to parse each app page'
+)
+pages_total = registry.counter(
+    'app_store_pages_total', 'App pages searched, by outcome', ['outcome']
+)
+read_lock_wait_seconds = registry.histogram(
+    'app_store_read_lock_wait_seconds',
+    'Time spent waiting for the crawler db_lock to read from the db'
+)
+
+# links on the category pages, compiled once instead of per page
+genre_href_regex = re.compile(r'https://itunes\.apple\.com/us/genre/[^/]+/id[0-9]+')
+app_href_regex = re.compile(r'https://itunes\.apple\.com/us/app/.*/id[0-9]*\?mt=8')
+
+
+class FetchAppStore:
+
+    headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_1) '
+                             'AppleWebKit/537.36 (KHTML, like Gecko) '
+                             'Chrome/62.0.3202.75 Safari/537.36'}
+
+    def __init__(self, pool_size=10, parser_backend='html.parser',
+                 rate_limiter=None, max_retries=3, archive=None,
+                 streaming=False, profile='full', http_cache=None):
+        """Fetches and parses app store pages, without a db.
+        CrawlAppStore adds the db on top, and a
+        distributed.CrawlWorker sends what it parses to
+        its coordinator instead.
+
+        :param pool_size: connections kept open per host
+        :type pool_size: int
+        :param parser_backend: see ParseAppStorePage.backends
+        :type parser_backend: str
+        :param rate_limiter:
+        :type rate_limiter: rate_limiter.AdaptiveRateLimiter
+        :param max_retries:
+        :type max_retries: int
+        :param archive: keeps the raw html if given
+        :type archive: page_archive.PageArchive
+        :param streaming: parse app pages as they download,
+            see stream_app_page
+        :type streaming: bool
+        :param profile: the fields to extract, see
+            ParseAppStorePage.profiles
+        :type profile: str
+        :param http_cache: pages are read from it before
+            being fetched, if given
+        :type http_cache: http_cache.HTTPCache
+        """
+        self.parser_backend = parser_backend
+        # the fields to extract, see ParseAppStorePage.profiles
+        self.profile = profile
+        # parse app pages as they download, see stream_app_page
+        self.streaming = streaming
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(max_concurrency=pool_size)
+        self.max_retries = max_retries
+        self.session = self.create_session(pool_size)
+        # a page_archive.PageArchive to keep the raw html in
+        self.archive = archive
+        # an http_cache.HTTPCache to read pages from before fetching them
+        self.http_cache = http_cache
+        registry.gauge(
+            'app_store_requests_in_flight', 'Requests sent and not yet answered',
+            function=lambda: sum(
+                x['in_flight'] for x in self.rate_limiter.rates().values()
+            )
+        )
+
+    @classmethod
+    def create_session(cls, pool_size):
+        """Creates a requests session that keeps connections
+        alive and pools up to pool_size of them per host.
+
+        :param pool_size:
+        :type pool_size: int
+        :rtype: requests.Session
+        """
+        session = requests.Session()
+        session.headers.update(cls.headers)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get_response(self, url, headers=None, stream=False):
+        """Sends a request to the url through the
+        crawler's session, reusing its connections.
+
+        The rate limiter decides when the request goes out.
+        Throttled requests, server errors and timeouts are
+        retried up to max_retries times with a jittered,
+        growing delay.
+
+        :param url:
+        :type url: str
+        :param headers: extra headers for this request
+        :type headers: dict
+        :param stream: return before the body is read, see
+            iter_body
+        :type stream: bool
+        :rtype: requests.Response
+        """
+        attempt = 0
+        while 1:
+            attempt += 1
+            self.rate_limiter.acquire(url)
+            r = None
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                r = self.session.get(url, headers=headers, timeout=10, stream=stream)
+            except (requests.Timeout, requests.ConnectionError):
+                fetch_seconds.observe(time.perf_counter() - start, 'error')
+                self.rate_limiter.release(url, TIMEOUT)
+                if attempt > self.max_retries:
+                    raise
+                outcome = TIMEOUT
+            except Exception:
+                fetch_seconds.observe(time.perf_counter() - start, 'error')
+                self.rate_limiter.release(url, None)
+                raise
+            else:
+                fetch_seconds.observe(time.perf_counter() - start, str(r.status_code))
+                if not stream:
+                    fetch_bytes.inc(amount=len(r.content))
+                outcome = classify_status(r.status_code)
+                retry_after = parse_retry_after(r.headers.get('Retry-After'))
+                self.rate_limiter.release(url, outcome, retry_after)
+
+            if outcome not in RETRYABLE:
+                return r
+            if attempt > self.max_retries:
+                r.raise_for_status()
+                return r
+            # timeouts and connection errors leave no response to close
+            if stream and r is not None:
+                r.close()
+            # a throttled host is already held back by the
+            # rate limiter until its Retry-After is up
+            if outcome != THROTTLED:
+                time.sleep(self.rate_limiter.backoff(attempt))
+
+    def get_request(self, url):
+        """Sends a request to the url and returns
+        the html, or reads it from the http cache if
+        there is one and it has the page.
+
+        :param url:
+        :type url: str
+        :rtype: str
+        """
+        if self.http_cache is not None:
+            source = self.http_cache.get(url)
+            if source is not None:
+                return source
+        r = self.get_response(url)
+        if self.http_cache is not None and r.status_code == 200:
+            self.http_cache.put(url, r.text)
+        return r.text
+
+    @staticmethod
+    def iter_body(r, chunk_size=16384):
+        """Reads a streamed response's body a chunk at a time.
+
+        :param r:
+        :type r: requests.Response
+        :param chunk_size:
+        :type chunk_size: int
+        :rtype: collections.Iterable[bytes]
+        """
+        for chunk in r.iter_content(chunk_size):
+            fetch_bytes.inc(amount=len(chunk))
+            yield chunk
+
+    def stream_app_page(self, url):
+        """Fetch a single url and parse it as it downloads.
+        The download stops as soon as every field has been
+        found, which drops the connection rather than handing
+        it back to the pool.
+
+        :param url:
+        :type url: str
+        :rtype: StreamingParseAppStorePage
+        """
+        r = self.get_response(url, stream=True)
+        try:
+            parsed = StreamingParseAppStorePage(profile=self.profile)
+            parsed.parse_stream(self.iter_body(r), r.encoding)
+        finally:
+            r.close()
+        return parsed
+
+    def archive_page(self, url, source):
+        """Keep the raw html of an app page, if there's an
+        archive, so it can be parsed again later.
+
+        :param url:
+        :type url: str
+        :param source:
+        :type source: str
+        """
+        if self.archive is not None:
+            self.archive.add(app_id_from_url(url), url, source)
+
+    def parse_page(self, source):
+        """Parse an app page, timing how long it takes.
+
+        :param source:
+        :type source: str
+        :rtype: ParseAppStorePage
+        """
+        with parse_seconds.time():
+            parsed = ParseAppStorePage(source, self.parser_backend, self.profile)
+            parsed.parse()
+        return parsed
+
+    def close(self):
+        """Closes the archive, the http cache and
+        the session."""
+        registry.remove('app_store_requests_in_flight')
+        if self.archive is not None:
+            self.archive.close()
+        if self.http_cache is not None:
+            self.http_cache.close()
+        self.session.close()
 
 
 # noinspection SqlDialectInspection
-class CrawlAppStore:
+class CrawlAppStore(FetchAppStore):
 
     db = 'app_store_db'
+    # the letters a category is listed under
+    letters = [x for x in ascii_uppercase] + ['*']
 
-    def __init__(self):
-        self.db_lock = threading.Lock()
-        self.search_semaphore = threading.BoundedSemaphore(1)
+    def __init__(self, pool_size=10, parser_backend='html.parser',
+                 rate_limiter=None, max_retries=3, link_deduper=None,
+                 archive=None, streaming=False, profile='full', db_shards=None,
+                 http_cache=None):
+        super().__init__(
+            pool_size=pool_size, parser_backend=parser_backend,
+            rate_limiter=rate_limiter, max_retries=max_retries, archive=archive,
+            streaming=streaming, profile=profile, http_cache=http_cache
+        )
+        self.db_lock = TimedLock(read_lock_wait_seconds)
+        # the rate limiter decides how many of these
+        # threads actually have a request out at once
+        self.search_semaphore = threading.BoundedSemaphore(pool_size)
         self.last_found_links = []
+        migrate(self.db)
+        # the app tables go to the db's shards if it has them,
+        # or to db_shards new ones, see db_shards.open_writer
+        self.writer = open_writer(self.db, db_shards).start()
+        self.read_conn = sqlite3.connect(self.db, check_same_thread=False)
+        self.app_read_conns = [
+            sqlite3.connect(x, check_same_thread=False) for x in read_shard_paths(self.db)
+        ]
+        self.frontier = CrawlFrontier(self.db, self.writer)
+        self.link_deduper = link_deduper or LinkDeduper(self.db)
+        registry.gauge(
+            'app_store_frontier_urls', 'Urls in the crawl frontier, by state',
+            ['state'], self.frontier_sizes
+        )
+
+    def app_read_conn(self, app_id):
+        """The connection to read an app's rows with, the
+        one to its shard if the db is sharded. Use it while
+        holding db_lock.
+
+        :param app_id:
+        :type app_id: str
+        :rtype: sqlite3.Connection
+        """
+        if not self.app_read_conns:
+            return self.read_conn
+        return self.app_read_conns[shard_index(app_id, len(self.app_read_conns))]
 
     def fetch_category_crawl_prog(self, url):
         """Gets the current progress of the crawl for
@@ -28,20 +312,20 @@ class CrawlAppStore:
         :type url: str
         :rtype: tuple
         """
+        self.writer.flush()
         with self.db_lock:
-            with sqlite3.connect(self.db) as conn:
-                cursor = conn.cursor()
+            cursor = self.read_conn.cursor()
 
-                select_statement = """
-                SELECT * FROM app_store_crawl_categories_prog
-                WHERE url = ?
-                """
-                cursor.execute(select_statement, (url,))
-                result = cursor.fetchall()
-                if len(result) == 0:
-                    return 1, 'A'
-                else:
-                    return int(result[0][1]), result[0][2]
+            select_statement = """
+            SELECT * FROM app_store_crawl_categories_prog
+            WHERE url = ?
+            """
+            cursor.execute(select_statement, (url,))
+            result = cursor.fetchall()
+            if len(result) == 0:
+                return 1, 'A'
+            else:
+                return int(result[0][1]), result[0][2]
 
     def crawl_category_page(self, start_url):
         """Given a category/sub-category page,
@@ -56,14 +340,10 @@ class CrawlAppStore:
         page_count, letter = self.fetch_category_crawl_prog(start_url)
 
         # clean the start url
-        start_url_parse = parse.urlparse(start_url)
-        cleaned_start_url = parse.urlunparse((
-            start_url_parse.scheme, start_url_parse.netloc,
-            start_url_parse.path, start_url_parse.params, '', ''
-        ))
+        cleaned_start_url = self.clean_url(start_url)
 
         # create a duplicate list of uppercase letters, plus *
-        letters = [x for x in ascii_uppercase] + ['*']
+        letters = list(self.letters)
 
         # loop through the letters and take out those we've already
         # searched, based on the last starting position
@@ -94,24 +374,213 @@ class CrawlAppStore:
                 self.save_category_crawl_prog(start_url, letter, page_count)
             page_count = 1
 
+    @staticmethod
+    def clean_url(url):
+        """Strips the query string and fragment off a url.
+
+        :param url:
+        :type url: str
+        :rtype: str
+        """
+        url_parse = parse.urlparse(url)
+        return parse.urlunparse((
+            url_parse.scheme, url_parse.netloc,
+            url_parse.path, url_parse.params, '', ''
+        ))
+
+    @staticmethod
+    def parse_genre_links(source):
+        """Parses the html from a categories page and
+        looks for links to other genres, i.e. its subgenres.
+
+        :param source:
+        :type source: str
+        :rtype: list
+        """
+        soup = BeautifulSoup(source, 'html.parser')
+        all_links = soup.find_all('a', {'href': genre_href_regex})
+        return [CrawlAppStore.clean_url(x['href']) for x in all_links]
+
+    def discover_genres(self, genre_urls):
+        """Finds every genre reachable from genre_urls by
+        following the genre links on their first pages.
+
+        :param genre_urls:
+        :type genre_urls: list
+        :return: genre_urls plus all the subgenres found,
+            with their query strings removed
+        :rtype: list
+        """
+        found = [self.clean_url(x) for x in genre_urls]
+        seen = set(found)
+        to_visit = list(found)
+        while to_visit:
+            source_page = self.get_request(to_visit.pop(0))
+            for link in self.parse_genre_links(source_page):
+                if link not in seen:
+                    seen.add(link)
+                    found.append(link)
+                    to_visit.append(link)
+        return found
+
+    def fetch_shard_progress(self):
+        """Gets the checkpoints of every (genre, letter)
+        shard crawl_categories has started.
+
+        :return: (genre url, letter) mapped to (page, done)
+        :rtype: dict
+        """
+        self.writer.flush()
+        with self.db_lock:
+            rows = self.read_conn.execute(
+                'SELECT genre_url, letter, page, done FROM app_store_crawl_shards'
+            ).fetchall()
+        return {(x[0], x[1]): (x[2], bool(x[3])) for x in rows}
+
+    def fetch_failed_shards(self):
+        """
+        :return: (genre url, letter) mapped to the error of
+            every shard whose last run failed
+        :rtype: dict
+        """
+        self.writer.flush()
+        with self.db_lock:
+            rows = self.read_conn.execute(
+                """
+                SELECT genre_url, letter, last_error FROM app_store_crawl_shards
+                WHERE last_error IS NOT NULL
+                """
+            ).fetchall()
+        return {(x[0], x[1]): x[2] for x in rows}
+
+    def save_shard_progress(self, genre_url, letter, page, done=False):
+        """Writes out the checkpoint of a (genre, letter) shard.
+
+        :param genre_url:
+        :type genre_url: str
+        :param letter:
+        :type letter: str
+        :param page: the next page to fetch
+        :type page: int
+        :param done:
+        :type done: bool
+        """
+        insert_statement = """
+        INSERT OR REPLACE INTO app_store_crawl_shards (genre_url, letter, page, done)
+        VALUES (?, ?, ?, ?)
+        """
+        self.writer.put(insert_statement, [(genre_url, letter, page, int(done))])
+
+    def save_shard_failure(self, genre_url, letter, page, error):
+        """Records the error a (genre, letter) shard failed
+        with. Its checkpoint is kept, so the next run carries
+        on from the last page it got through.
+
+        :param genre_url:
+        :type genre_url: str
+        :param letter:
+        :type letter: str
+        :param page: the page it started at, for a shard
+            that hasn't checkpointed yet
+        :type page: int
+        :param error:
+        :type error: Exception
+        """
+        insert_statement = """
+        INSERT INTO app_store_crawl_shards (genre_url, letter, page, last_error)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (genre_url, letter) DO UPDATE SET last_error = excluded.last_error
+        """
+        self.writer.put(insert_statement, [(genre_url, letter, page, str(error))])
+
+    def crawl_category_shard(self, genre_url, letter, page_count=1):
+        """Goes through the pages of one letter of one genre,
+        writing out the links and checkpointing after every page.
+
+        :param genre_url: a cleaned genre url
+        :type genre_url: str
+        :param letter:
+        :type letter: str
+        :param page_count: the page to start at
+        :type page_count: int
+        """
+        last_found_links = []
+        while 1:
+            new_url = genre_url + '?letter={}&page={}'.format(letter, page_count)
+            source_page = self.get_request(new_url)
+            links = self.parse_category_page(source_page)
+            if not links or links == last_found_links:
+                break
+            last_found_links = links
+            self.write_out_links(links)
+            page_count += 1
+            self.save_shard_progress(genre_url, letter, page_count)
+        self.save_shard_progress(genre_url, letter, page_count, done=True)
+
+    def crawl_categories(self, genre_urls, workers=8, discover_subgenres=True):
+        """Crawls many genres at once, splitting them up into
+        one shard per (genre, letter) and running the shards
+        on a pool of workers. The rate limiter decides how
+        many requests are really out at once.
+
+        Every shard keeps its own checkpoint, so running this
+        again carries on where each shard left off. A shard
+        that raises is printed and its error is kept in
+        app_store_crawl_shards until it's checkpointed again,
+        see fetch_failed_shards.
+
+        :param genre_urls:
+        :type genre_urls: list
+        :param workers:
+        :type workers: int
+        :param discover_subgenres: also crawl every subgenre
+            linked from the genre pages
+        :type discover_subgenres: bool
+        :return: the number of shards that failed
+        :rtype: int
+        """
+        if discover_subgenres:
+            genre_urls = self.discover_genres(genre_urls)
+        else:
+            genre_urls = [self.clean_url(x) for x in genre_urls]
+        progress = self.fetch_shard_progress()
+
+        shards = []
+        for genre_url in genre_urls:
+            for letter in self.letters:
+                page, done = progress.get((genre_url, letter), (1, False))
+                if not done:
+                    shards.append((genre_url, letter, page))
+
+        def crawl_shard(shard):
+            try:
+                self.crawl_category_shard(*shard)
+            except Exception as e:
+                print(shard)
+                print(e)
+                self.save_shard_failure(*shard, e)
+                return False
+            return True
+
+        with ThreadPoolExecutor(workers) as executor:
+            failed = list(executor.map(crawl_shard, shards)).count(False)
+        self.writer.flush()
+        return failed
+
     def write_out_links(self, links):
         """Write out a list of links to the db
         which will get used later for searching and parsing.
+        Links to apps that are already in the db are dropped.
 
         :param links:
         :type links: list
         :return:
         """
-        with self.db_lock:
-            with sqlite3.connect(self.db) as conn:
-                cursor = conn.cursor()
-                insert_statement = """
-                INSERT INTO app_store_app_urls
-                VALUES (?)
-                """
-                for link in links:
-                    cursor.execute(insert_statement, (link,))
-                conn.commit()
+        insert_statement = """
+        INSERT OR IGNORE INTO app_store_app_urls (url, app_id)
+        VALUES (?, ?)
+        """
+        self.writer.put(insert_statement, self.link_deduper.filter_new(links))
 
     @staticmethod
     def parse_category_page(source):
@@ -124,8 +593,7 @@ class CrawlAppStore:
         :rtype: list
         """
         soup = BeautifulSoup(source, 'html.parser')
-        href_regex = r'https://itunes\.apple\.com/us/app/.*/id[0-9]*\?mt=8'
-        all_links = soup.find_all('a', {'href': re.compile(href_regex)})
+        all_links = soup.find_all('a', {'href': app_href_regex})
         return [x['href'] for x in all_links]
 
     def save_category_crawl_prog(self, url, letter, page):
@@ -139,62 +607,63 @@ class CrawlAppStore:
         :param page:
         :type page: int
         """
-        with self.db_lock:
-            with sqlite3.connect(self.db) as conn:
-                cursor = conn.cursor()
-                delete_statement = """
-                DELETE FROM app_store_crawl_categories_prog
-                WHERE url = ?
-                """
-                cursor.execute(delete_statement, (url,))
-                insert_statement = """
-                INSERT INTO app_store_crawl_categories_prog
-                VALUES (?, ?, ?)
-                """
-                cursor.execute(
-                    insert_statement,
-                    (url, page, letter)
-                )
-                conn.commit()
+        insert_statement = """
+        INSERT OR REPLACE INTO app_store_crawl_categories_prog (url, page, letter)
+        VALUES (?, ?, ?)
+        """
+        self.writer.put(insert_statement, [(url, page, letter)])
 
-    @staticmethod
-    def get_request(url):
-        """Sends a request to the url and returns
-        the html.
+    def crawl_app_pages_from_db(self, batch_size=10):
+        """Claim urls from the frontier in batches and search
+        them until there are none left pending.
+
+        :param batch_size:
+        :type batch_size: int
+        """
+        self.writer.flush()
+        try:
+            self.crawl_app_pages(self.frontier.iter_claims(batch_size))
+        finally:
+            # hand back anything claimed but not searched
+            self.writer.flush()
+            self.frontier.release()
+
+    def remove_searched_url(self, url):
+        """Mark a url as done in the frontier.
 
         :param url:
         :type url: str
-        :rtype: str
         """
-        headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_1) '
-                                 'AppleWebKit/537.36 (KHTML, like Gecko) '
-                                 'Chrome/62.0.3202.75 Safari/537.36'}
-        r = requests.get(url, headers=headers, timeout=10)
-        return r.text
+        pages_total.inc('done')
+        self.frontier.complete(url)
 
-    def crawl_app_pages_from_db(self):
-        """Fetch the list of urls from the db and search."""
-        with self.db_lock:
-            with sqlite3.connect(self.db) as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM app_store_app_urls')
-                results = [x[0] for x in cursor.fetchall()]
-        self.crawl_app_pages(results)
+    def fail_searched_url(self, url, error):
+        """Record a failed search of a url in the frontier.
 
-    def remove_searched_url(self, url):
-        """Remove a url from the app_urls table.
+        :param url:
+        :type url: str
+        :param error:
+        :type error: Exception
+        """
+        print(url)
+        print(error)
+        pages_total.inc('failed')
+        self.frontier.fail(url, error)
+
+    def scrape_app_page(self, url):
+        """Fetch a single url, parse and write out.
 
         :param url:
         :type url: str
         """
-        with self.db_lock:
-            with sqlite3.connect(self.db) as conn:
-                cursor = conn.cursor()
-                delete_statement = """
-                DELETE FROM app_store_app_urls WHERE url = ?
-                """
-                cursor.execute(delete_statement, (url,))
-                conn.commit()
+        # archived and cached pages have to be downloaded in full
+        if self.streaming and self.archive is None and self.http_cache is None:
+            self.stream_app_page(url).write_out(self.writer)
+            return
+        source = self.get_request(url)
+        self.archive_page(url, source)
+        parsed = self.parse_page(source)
+        parsed.write_out(self.writer)
 
     def search_app_page(self, url):
         """Search a single url, parse and write out.
@@ -203,18 +672,11 @@ class CrawlAppStore:
         :type url: str
         """
         try:
-            source = self.get_request(url)
-            parsed = ParseAppStorePage(source)
-            parsed.parse()
-            with self.db_lock:
-                parsed.write_out()
+            self.scrape_app_page(url)
             self.remove_searched_url(url)
         except Exception as e:
-            print(url)
-            print(e)
-            time.sleep(3)
+            self.fail_searched_url(url, e)
         finally:
-            time.sleep(random.randint(3, 8))
             self.search_semaphore.release()
 
     def crawl_app_pages(self, url_list):
@@ -230,6 +692,38 @@ class CrawlAppStore:
                 target=self.search_app_page, daemon=1,
                 args=(url,)
             ).start()
+        # wait for the last searches to finish and
+        # for their rows to be committed
+        for _ in range(self.pool_size):
+            self.search_semaphore.acquire()
+        for _ in range(self.pool_size):
+            self.search_semaphore.release()
+        self.writer.flush()
+
+    def frontier_sizes(self):
+        """
+        :return: the number of urls in each frontier state,
+            keyed the way the frontier gauge wants them
+        :rtype: dict
+        """
+        with self.db_lock:
+            return {
+                (state,): count for state, count in self.read_conn.execute(
+                    'SELECT state, urls FROM app_store_url_counts'
+                )
+            }
+
+    def close(self):
+        """Commits anything still waiting to be written
+        and closes the db connections."""
+        registry.remove('app_store_frontier_urls')
+        self.link_deduper.save()
+        self.writer.close()
+        self.frontier.close()
+        self.read_conn.close()
+        for conn in self.app_read_conns:
+            conn.close()
+        super().close()
 
 
 if __name__ == '__main__':
@@ -237,4 +731,6 @@ if __name__ == '__main__':
     category = 'https://itunes.apple.com/us/genre/ios-games/id6014?mt=8'
     c = CrawlAppStore()
     c.crawl_category_page(category)
+    # c.crawl_categories([category])
     # c.crawl_app_pages_from_db()
+    c.close()
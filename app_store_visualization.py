@@ -1,28 +1,41 @@
-import sqlite3
-from flask import Flask, render_template_string, jsonify, request
+import heapq
+import json
+import re
+from flask import Flask, Response, jsonify, request
+import metrics
+from db_shards import ShardedChangeWatcher, ShardedConnectionPool, read_shard_paths, sum_rows
+from export import AppExporter
+from parse_app_page import ParseAppStorePage
+from web_cache import ChangeWatcher, ConnectionPool, TTLCache
 
 
 app = Flask(__name__)
 db = 'app_store_db'
+results_per_page = 25
+# the most apps /api/apps returns at once
+max_api_apps = 200
+# the groups there are dashboards for, see migrations.migration_9
+rollup_dimensions = {'category': 'categories', 'seller': 'sellers'}
+# the most languages a dashboard lists
+max_rollup_languages = 20
 
-
-@app.route('/ajax_apps', methods=["POST"])
-def ajax_apps():
-    string = request.form['string']
-    with sqlite3.connect(db) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """select app_id, app_name from app_store_main
-            WHERE app_name like ?
-            """, ('%'+string+'%',)
-        )
-        r = cursor.fetchall()
-    return jsonify(r)
+# rendered app pages and json, keyed by app id
+app_cache = TTLCache(max_size=5000, ttl=300)
+search_cache = TTLCache(max_size=1000, ttl=60)
+# dashboards and the lists of categories and sellers
+rollup_cache = TTLCache(max_size=1000, ttl=60)
+# the apps are in the shards if the crawler split them up,
+# see db_shards, and the pools are read the same way either way
+shard_paths = read_shard_paths(db)
+if shard_paths:
+    pool = ShardedConnectionPool(db, shard_paths, size=8)
+    watcher = ShardedChangeWatcher(shard_paths, app_cache, (search_cache, rollup_cache))
+else:
+    pool = ConnectionPool(db, size=8)
+    watcher = ChangeWatcher(db, app_cache, (search_cache, rollup_cache))
 
 
-@app.route('/app_id/<id>')
-def app_id(id):
-    html = """
+app_page_html = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -125,25 +138,8 @@ def app_id(id):
         </div>
     </html>
     """
-    with sqlite3.connect(db) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""SELECT * FROM app_store_main WHERE app_id = ?""", (id,))
-        main_results = cursor.fetchone()
-        cursor.execute("""SELECT * FROM app_store_languages WHERE app_id = ?""", (id,))
-        language_results = cursor.fetchall()
-        cursor.execute("""SELECT * FROM app_store_customer_reviews WHERE app_id = ?""", (id,))
-        customer_review_results = cursor.fetchall()
-        cursor.execute("""SELECT * FROM app_store_top_in_app_purchases WHERE app_id = ?""", (id,))
-        in_app_purchase_results = cursor.fetchall()
-    return render_template_string(
-        html, main_results=main_results, lang_results=language_results,
-        cust_results=customer_review_results, purc_results=in_app_purchase_results
-    )
 
-
-@app.route('/')
-def index():
-    html = """
+index_html = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -182,29 +178,583 @@ def index():
                 </tbody>
             </table>
         </div>
+        <button id='more' class='btn btn-default' style='display: none' onclick='more(); return false'>More</button>
         </div>
     </body>
     <script>
+        var searchString = '';
+        var page = 1;
         function successAjax(d){
             var tbody = $('tbody');
-            for (i = 0; i < d.length; i++) { 
-                tbody.append("<tr><td><a href='/app_id/"+d[i][0]+"'>"+d[i][1]+"</a></td></tr>")
+            var r = d.results;
+            for (i = 0; i < r.length; i++) { 
+                tbody.append("<tr><td><a href='/app_id/"+r[i][0]+"'>"+r[i][1]+"</a></td></tr>")
             }
+            $('#more').toggle(d.more);
         }
-        function search() {
-          var tbody = $('tbody');
-          tbody.html('');
+        function fetchPage() {
           $.ajax({
             url: '/ajax_apps',
             type: 'POST',
-            data: {'string': $('input').val()},
+            data: {'string': searchString, 'page': page},
             success: successAjax
           })
         }
+        function search() {
+          var tbody = $('tbody');
+          tbody.html('');
+          searchString = $('input').val();
+          page = 1;
+          fetchPage();
+        }
+        function more() {
+          page += 1;
+          fetchPage();
+        }
     </script>
     </html>
     """
-    return render_template_string(html)
+
+rollups_html = """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+      <title>App Store {{ plural|capitalize }}</title>
+      <link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/bootstrap/3.3.7/css/bootstrap.min.css">
+    </head>
+    <body>
+        <div class='container'>
+
+        <h1>App Store {{ plural|capitalize }}</h1>
+
+        <div class='table-responsive'>
+            <table class='table'>
+                <thead>
+                <tr>
+                    <th>{{ dimension|capitalize }}</th>
+                    <th>Apps</th>
+                    <th>Average Rating</th>
+                </tr>
+                </thead>
+                <tbody>
+                    {% for r in rollups %}
+                    <tr>
+                        <td><a href="/{{ dimension }}/{{ r.name|urlencode }}">{{ r.name or 'Unknown' }}</a></td>
+                        <td>{{ r.apps }}</td>
+                        <td>{{ '%.2f'|format(r.average_rating) if r.average_rating is not none else '' }}</td>
+                    </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+        </div>
+        {% if page > 1 %}<a class='btn btn-default' href='?page={{ page - 1 }}'>Previous</a>{% endif %}
+        {% if more %}<a class='btn btn-default' href='?page={{ page + 1 }}'>Next</a>{% endif %}
+        </div>
+    </body>
+    </html>
+    """
+
+dashboard_html = """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+      <title>App Store {{ dimension|capitalize }}</title>
+      <link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/bootstrap/3.3.7/css/bootstrap.min.css">
+    </head>
+    <body>
+        <div class='container'>
+
+        <h1>{{ r.name or 'Unknown' }}</h1>
+        <p><a href="/{{ plural }}">All {{ plural }}</a></p>
+
+        <hr>
+
+        <div class='row'>
+            <div class='col-xs-6'>
+                <h4>Summary</h4>
+                <table class='table'>
+                    <tbody>
+                        <tr><th>Apps</th><td>{{ r.apps }}</td></tr>
+                        <tr><th>Average Rating</th><td>{{ '%.2f'|format(r.average_rating) if r.average_rating is not none else '' }}</td></tr>
+                        <tr><th>Ratings</th><td>{{ r.review_count }}</td></tr>
+                        <tr><th>Paid Apps</th><td>{{ r.paid_apps }}</td></tr>
+                        <tr><th>Average Price</th><td>{{ '%.2f'|format(r.average_price) if r.average_price is not none else '' }}</td></tr>
+                    </tbody>
+                </table>
+            </div>
+            <div class='col-xs-6'>
+                <h4>Reviews</h4>
+                <table class='table'>
+                    <tbody>
+                        {% for x in r.reviews %}
+                        <tr><th>{{ x.month }}</th><td>{{ x.reviews }}</td></tr>
+                        {% endfor %}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+        <div class='row'>
+            {% for title, key, label in (('Ratings', 'ratings', 'bucket'), ('Prices', 'prices', 'bucket'), ('Languages', 'languages', 'language')) %}
+            <div class='col-xs-4'>
+                <h4>{{ title }}</h4>
+                {% for x in r[key] %}
+                {% if key != 'prices' %}<div>{{ x[label] }} ({{ x.apps }})</div>
+                {% elif x.bucket == 0 %}<div>Free ({{ x.apps }})</div>
+                {% elif x.bucket == 100 %}<div>50 or more ({{ x.apps }})</div>
+                {% else %}<div>Under {{ x.bucket }} ({{ x.apps }})</div>{% endif %}
+                <div class='progress'>
+                    <div class='progress-bar' style='width: {{ (100 * x.apps / r.apps) if r.apps else 0 }}%'></div>
+                </div>
+                {% endfor %}
+            </div>
+            {% endfor %}
+        </div>
+
+        </div>
+    </body>
+    </html>
+    """
+
+# compiled once instead of on every request
+app_page_template = app.jinja_env.from_string(app_page_html)
+index_template = app.jinja_env.from_string(index_html)
+rollups_template = app.jinja_env.from_string(rollups_html)
+dashboard_template = app.jinja_env.from_string(dashboard_html)
+
+
+def search_query(string):
+    """Turns what was typed into an FTS5 query that
+    matches apps containing every word, with the
+    words treated as prefixes.
+
+    :param string:
+    :type string: str
+    :rtype: str
+    """
+    return ' '.join('"{}"*'.format(x) for x in re.findall(r'\w+', string))
+
+
+@app.route('/ajax_apps', methods=["POST"])
+def ajax_apps():
+    string = request.form['string']
+    page = max(request.form.get('page', 1, type=int), 1)
+    query = search_query(string)
+    if not query:
+        return jsonify(results=[], page=page, more=False)
+    watcher.check()
+    r = search_cache.get((query, page))
+    if r is not None:
+        return jsonify(
+            results=r[:results_per_page], page=page,
+            more=len(r) > results_per_page
+        )
+    offset = (page - 1) * results_per_page
+
+    def search_shard(conn):
+        # a match in the name counts the most, then
+        # the seller, the category and the description
+        return conn.execute(
+            """select app_store_main.app_id, app_store_main.app_name,
+                bm25(app_store_search, 10.0, 5.0, 2.0, 1.0) from app_store_search
+            JOIN app_store_main ON app_store_main.search_id = app_store_search.rowid
+            WHERE app_store_search MATCH ?
+            ORDER BY 3
+            LIMIT ?
+            """, (query, offset + results_per_page + 1)
+        ).fetchall()
+
+    # each shard ranks its own matches, then the best of them
+    # are merged, the shards being even enough for their bm25
+    # scores to compare
+    merged = heapq.merge(*pool.map(search_shard), key=lambda x: x[2])
+    r = [x[:2] for x in merged][offset:offset + results_per_page + 1]
+    search_cache.set((query, page), r)
+    return jsonify(
+        results=r[:results_per_page], page=page,
+        more=len(r) > results_per_page
+    )
+
+
+def cached_app(app_id):
+    """Only called for apps that are in the db, so ids
+    that aren't can't push real apps out of the cache.
+
+    :param app_id:
+    :type app_id: str
+    :return: the app's cache entry, made if there isn't one
+    :rtype: dict
+    """
+    entry = app_cache.get(app_id)
+    if entry is None:
+        entry = {}
+        app_cache.set(app_id, entry)
+    return entry
+
+
+@app.route('/app_id/<id>')
+def app_id(id):
+    watcher.check()
+    entry = app_cache.get(id)
+    if entry is not None and 'page' in entry:
+        return entry['page']
+    with pool.connection_for(id) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""SELECT * FROM app_store_main WHERE app_id = ?""", (id,))
+        main_results = cursor.fetchone()
+        cursor.execute("""SELECT * FROM app_store_languages WHERE app_id = ?""", (id,))
+        language_results = cursor.fetchall()
+        cursor.execute("""SELECT * FROM app_store_customer_reviews WHERE app_id = ?""", (id,))
+        customer_review_results = cursor.fetchall()
+        cursor.execute("""SELECT * FROM app_store_top_in_app_purchases WHERE app_id = ? ORDER BY "order" """, (id,))
+        in_app_purchase_results = cursor.fetchall()
+    page = app_page_template.render(
+        main_results=main_results, lang_results=language_results,
+        cust_results=customer_review_results, purc_results=in_app_purchase_results
+    )
+    if main_results is not None:
+        cached_app(id)['page'] = page
+    return page
+
+
+# noinspection SqlDialectInspection
+def fetch_apps(app_ids):
+    """Reads many apps, with their languages, purchases
+    and reviews, in one round of queries.
+
+    :param app_ids:
+    :type app_ids: list
+    :return: app id mapped to the app as a dict, for
+        the apps that are in the db
+    :rtype: dict
+    """
+    columns = ParseAppStorePage.main_table_columns + ('updated_at',)
+
+    def fetch_shard(conn, shard_ids):
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT {} FROM app_store_main WHERE app_id IN ({})'.format(
+                ', '.join(columns), ', '.join('?' * len(shard_ids))
+            ),
+            shard_ids
+        )
+        shard_apps = {x[0]: dict(zip(columns, x)) for x in cursor.fetchall()}
+        if shard_apps:
+            children = AppExporter.fetch_children(cursor, list(shard_apps))
+            for found_id, found_app in shard_apps.items():
+                found_app.update(children[found_id])
+        return shard_apps
+
+    apps = {}
+    for shard_apps in pool.map_ids(fetch_shard, app_ids):
+        apps.update(shard_apps)
+    return apps
+
+
+@app.route('/api/apps')
+def api_apps():
+    """Looks up many apps at once, i.e. /api/apps?ids=1,2,3.
+    Apps that aren't in the db are left out."""
+    ids = [x for x in request.args.get('ids', '').split(',') if x][:max_api_apps]
+    watcher.check()
+    found = {}
+    missing = []
+    for x in ids:
+        entry = app_cache.get(x)
+        if entry is not None and 'json' in entry:
+            found[x] = entry['json']
+        else:
+            missing.append(x)
+    if missing:
+        for found_id, found_app in fetch_apps(missing).items():
+            # cached as text so hits don't get serialized again
+            found[found_id] = cached_app(found_id)['json'] = json.dumps(found_app)
+    body = '{{"apps": [{}]}}'.format(', '.join(found[x] for x in ids if x in found))
+    return Response(body, mimetype='application/json')
+
+
+list_rollups_statement = """
+SELECT name, apps, rated_apps, rating_sum
+FROM app_store_rollup_summary
+WHERE dimension = ? AND apps > 0
+ORDER BY apps DESC, name
+LIMIT ? OFFSET ?
+"""
+
+
+# noinspection SqlDialectInspection
+def top_rollups(dimension, count):
+    """Finds the count categories or sellers with the most
+    apps across the shards, without reading every one.
+
+    Each shard gives its own top n, and the candidates'
+    totals are added up from every shard. A name outside
+    every shard's top n can't have more apps than the sum
+    of the shards' nth counts, so once the count-th
+    candidate has more than that, it's the answer.
+    Otherwise n doubles and it goes again.
+
+    :param dimension: category or seller
+    :type dimension: str
+    :param count:
+    :type count: int
+    :return: (name, apps, rated_apps, rating_sum) rows,
+        the most apps first
+    :rtype: list
+    """
+    n = count
+    while 1:
+        tops = pool.map(lambda conn: conn.execute(
+            list_rollups_statement, (dimension, n, 0)
+        ).fetchall())
+        names = list(dict.fromkeys(x[0] for rows in tops for x in rows))
+
+        def read_names(conn):
+            rows = []
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                rows.extend(conn.execute(
+                    """
+                    SELECT name, apps, rated_apps, rating_sum
+                    FROM app_store_rollup_summary
+                    WHERE dimension = ? AND name IN ({}) AND apps > 0
+                    """.format(', '.join('?' * len(chunk))),
+                    [dimension] + chunk
+                ).fetchall())
+            return rows
+
+        ranked = sorted(sum_rows(pool.map(read_names)), key=lambda x: (-x[1], x[0]))
+        full = [rows for rows in tops if len(rows) == n]
+        bound = sum(rows[-1][1] for rows in full)
+        # ties go by name, so an unseen name with as
+        # many apps could still come first
+        if not full or (len(ranked) >= count and ranked[count - 1][1] > bound):
+            return ranked[:count]
+        n *= 2
+
+
+# noinspection SqlDialectInspection
+def list_rollups(dimension, page):
+    """Reads a page of categories or sellers, the
+    ones with the most apps first.
+
+    :param dimension: category or seller
+    :type dimension: str
+    :param page:
+    :type page: int
+    :return: a dict for each, and whether there's another page
+    :rtype: tuple
+    """
+    key = ('list', dimension, page)
+    r = rollup_cache.get(key)
+    if r is None:
+        offset = (page - 1) * results_per_page
+        if pool.shard_count > 1:
+            # a name has apps in every shard, so the
+            # shards' pages can't just be put together
+            r = top_rollups(dimension, offset + results_per_page + 1)[offset:]
+        else:
+            r = pool.map(lambda conn: conn.execute(
+                list_rollups_statement, (dimension, results_per_page + 1, offset)
+            ).fetchall())[0]
+        rollup_cache.set(key, r)
+    rollups = [
+        dict(name=name, apps=apps, average_rating=rating_sum / rated if rated else None)
+        for name, apps, rated, rating_sum in r
+    ]
+    return rollups[:results_per_page], len(rollups) > results_per_page
+
+
+# noinspection SqlDialectInspection
+def read_rollup(dimension, name):
+    """Reads a category's or seller's dashboard from the
+    rollup tables, which are kept up to date as apps are
+    written, so this never touches the crawled tables.
+
+    :param dimension: category or seller
+    :type dimension: str
+    :param name:
+    :type name: str
+    :return: None if there are no apps for it
+    :rtype: dict
+    """
+    key = ('rollup', dimension, name)
+    r = rollup_cache.get(key)
+    if r is not None:
+        return r
+
+    def read_shard(conn):
+        # the sums from one shard, for sum_rows to add up
+        where = (dimension, name)
+        return dict(
+            summary=conn.execute(
+                """
+                SELECT apps, rated_apps, rating_sum, review_count_sum, paid_apps, price_sum
+                FROM app_store_rollup_summary
+                WHERE dimension = ? AND name = ? AND apps > 0
+                """, where
+            ).fetchall(),
+            ratings=conn.execute(
+                """
+                SELECT bucket, apps FROM app_store_rollup_ratings
+                WHERE dimension = ? AND name = ? AND apps > 0
+                """, where
+            ).fetchall(),
+            prices=conn.execute(
+                """
+                SELECT bucket, apps FROM app_store_rollup_prices
+                WHERE dimension = ? AND name = ? AND apps > 0
+                """, where
+            ).fetchall(),
+            languages=conn.execute(
+                """
+                SELECT language, apps FROM app_store_rollup_languages
+                WHERE dimension = ? AND name = ? AND apps > 0
+                """, where
+            ).fetchall(),
+            reviews=conn.execute(
+                """
+                SELECT month, reviews FROM app_store_rollup_reviews
+                WHERE dimension = ? AND name = ? AND reviews > 0
+                """, where
+            ).fetchall(),
+        )
+
+    parts = pool.map(read_shard)
+    summary = sum_rows([x['summary'] for x in parts], keys=0)
+    if not summary:
+        return None
+    apps, rated_apps, rating_sum, review_count, paid_apps, price_sum = summary[0]
+    r = dict(
+        name=name, apps=apps,
+        average_rating=rating_sum / rated_apps if rated_apps else None,
+        review_count=review_count, paid_apps=paid_apps,
+        average_price=price_sum / paid_apps if paid_apps else None,
+    )
+    r['ratings'] = [dict(bucket=x, apps=y) for x, y in sorted(
+        sum_rows([x['ratings'] for x in parts])
+    )]
+    r['prices'] = [dict(bucket=x, apps=y) for x, y in sorted(
+        sum_rows([x['prices'] for x in parts])
+    )]
+    r['languages'] = [dict(language=x, apps=y) for x, y in sorted(
+        sum_rows([x['languages'] for x in parts]), key=lambda x: (-x[1], x[0])
+    )[:max_rollup_languages]]
+    r['reviews'] = [dict(month=x, reviews=y) for x, y in sorted(
+        sum_rows([x['reviews'] for x in parts])
+    )]
+    rollup_cache.set(key, r)
+    return r
+
+
+@app.route('/api/<plural>')
+def api_rollups(plural):
+    """Lists the categories or sellers, i.e. /api/categories?page=2"""
+    dimension = {v: k for k, v in rollup_dimensions.items()}.get(plural)
+    if dimension is None:
+        return jsonify(error='not found'), 404
+    page = max(request.args.get('page', 1, type=int), 1)
+    watcher.check()
+    rollups, more = list_rollups(dimension, page)
+    return jsonify(results=rollups, page=page, more=more)
+
+
+@app.route('/api/<dimension>/<path:name>')
+def api_rollup(dimension, name):
+    """A category's or seller's dashboard as json,
+    i.e. /api/category/Games"""
+    if dimension not in rollup_dimensions:
+        return jsonify(error='not found'), 404
+    watcher.check()
+    r = read_rollup(dimension, name)
+    if r is None:
+        return jsonify(error='not found'), 404
+    return jsonify(r)
+
+
+@app.route('/categories')
+@app.route('/sellers')
+def rollups_page():
+    plural = request.path.strip('/')
+    dimension = {v: k for k, v in rollup_dimensions.items()}[plural]
+    page = max(request.args.get('page', 1, type=int), 1)
+    watcher.check()
+    rollups, more = list_rollups(dimension, page)
+    return rollups_template.render(
+        dimension=dimension, plural=plural, rollups=rollups, page=page, more=more
+    )
+
+
+@app.route('/category/<path:name>')
+@app.route('/seller/<path:name>')
+def dashboard_page(name):
+    dimension = request.path.split('/')[1]
+    watcher.check()
+    r = read_rollup(dimension, name)
+    if r is None:
+        return 'Not found', 404
+    return dashboard_template.render(
+        dimension=dimension, plural=rollup_dimensions[dimension], r=r
+    )
+
+
+@app.route('/')
+def index():
+    return index_page
+
+
+# the front page is the same for everybody
+index_page = index_template.render()
+
+
+# noinspection SqlDialectInspection
+def db_sizes():
+    """Read from tables the triggers keep up to date,
+    so a scrape doesn't count the frontier or the apps.
+
+    :return: the number of urls in each frontier
+        state, and the number of apps crawled
+    :rtype: tuple
+    """
+    with pool.connection() as conn:
+        frontier = conn.execute(
+            'SELECT state, urls FROM app_store_url_counts ORDER BY state'
+        ).fetchall()
+    # every app is in exactly one category rollup
+    apps = sum(pool.map(
+        lambda conn: conn.execute(
+            """
+            SELECT coalesce(sum(apps), 0) FROM app_store_rollup_summary
+            WHERE dimension = 'category'
+            """
+        ).fetchone()[0]
+    ))
+    return frontier, apps
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """The crawler's metrics, if it's running in this process,
+    and the size of the frontier in the Prometheus text format.
+    A crawler running on its own serves its metrics with
+    metrics.start_metrics_server instead."""
+    frontier, apps = db_sizes()
+    lines = [
+        '# HELP app_store_db_frontier_urls Urls in the crawl frontier, by state',
+        '# TYPE app_store_db_frontier_urls gauge',
+    ]
+    lines += [
+        'app_store_db_frontier_urls{{state="{}"}} {}'.format(state, count)
+        for state, count in frontier
+    ]
+    lines += [
+        '# HELP app_store_db_apps Apps in app_store_main',
+        '# TYPE app_store_db_apps gauge',
+        'app_store_db_apps {}'.format(apps),
+    ]
+    return Response(
+        metrics.registry.render() + '\n'.join(lines) + '\n',
+        content_type=metrics.content_type
+    )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,467 @@
+import argparse
+import copy
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from parse_app_page import ParseAppStorePage
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+def time_parse(source, backend, iterations):
+    """Parses source iterations times with the backend.
+
+    :param source:
+    :type source: str
+    :param backend:
+    :type backend: str
+    :param iterations:
+    :type iterations: int
+    :return: pages parsed per second
+    :rtype: float
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        ParseAppStorePage(source, backend).parse()
+    return iterations / (time.perf_counter() - start)
+
+
+def benchmark_parser_backends(source, iterations=20):
+    """Times every parser backend on the same page, making
+    sure they all give the same output as html.parser.
+
+    Backends that can't be used (i.e. lxml isn't installed)
+    are left out.
+
+    :param source:
+    :type source: str
+    :param iterations:
+    :type iterations: int
+    :return: backend name mapped to pages per second
+    :rtype: dict
+    """
+    expected = ParseAppStorePage(source).parse()
+    results = {}
+    for backend in ParseAppStorePage.backends:
+        try:
+            output = ParseAppStorePage(source, backend).parse()
+        except Exception as e:
+            print('skipping {}: {}'.format(backend, e))
+            continue
+        if output != expected:
+            raise AssertionError('{} gave a different output_dict'.format(backend))
+        results[backend] = time_parse(source, backend, iterations)
+    return results
+
+
+def percentile(values, p):
+    """
+    :param values:
+    :type values: list
+    :param p: between 0 and 100
+    :type p: float
+    :return: the value p percent of the way through
+        the sorted values (nearest rank)
+    :rtype: float
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(round(p / 100 * (len(values) - 1)))
+    return values[rank]
+
+
+def peak_rss_mb():
+    """
+    :return: the most memory this process has used so
+        far, in MB, or None where it can't be measured
+    :rtype: float
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    if platform.system() == 'Darwin':
+        peak /= 1024
+    return peak / 1024
+
+
+def summarize(durations, elapsed, items=None):
+    """
+    :param durations: seconds taken by each page
+    :type durations: list
+    :param elapsed: seconds taken by all of them
+    :type elapsed: float
+    :param items: what to count per second, defaults
+        to the number of durations
+    :type items: int
+    :return: pages per second, p50 and p99 latency in
+        ms and the peak rss so far
+    :rtype: dict
+    """
+    if items is None:
+        items = len(durations)
+    return dict(
+        count=items,
+        per_second=items / elapsed if elapsed else None,
+        p50_ms=percentile(durations, 50) * 1000 if durations else None,
+        p99_ms=percentile(durations, 99) * 1000 if durations else None,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def synthetic_page(source, reviews=0, purchases=0):
+    """Makes a bigger version of the example page, with its
+    first customer review repeated reviews times and its
+    first in app purchase repeated purchases times.
+
+    :param source: the example page
+    :type source: str
+    :param reviews:
+    :type reviews: int
+    :param purchases:
+    :type purchases: int
+    :rtype: str
+    """
+    if reviews:
+        marker = '<div more-text="More" class="customer-review">'
+        first = source.index(marker)
+        second = source.index(marker, first + 1)
+        review = source[first:second]
+        title = re.search(r'class="customerReviewTitle">([^<]*)<', review).group(1)
+        source = source[:first] + ''.join(
+            review.replace(title, '{} #{}'.format(title, i))
+            for i in range(reviews)
+        ) + source[second:]
+    if purchases:
+        match = re.search(r'<li><span class="in-app-title">.*?</li>', source)
+        purchase = match.group(0)
+        source = source[:match.start()] + ''.join(
+            purchase.replace('</span>', ' #{}</span>'.format(i), 1)
+            for i in range(purchases)
+        ) + source[match.end():]
+    return source
+
+
+def benchmark_parse(source, backend='html.parser', iterations=20, profile='full'):
+    """Times ParseAppStorePage.parse page by page.
+
+    :param source:
+    :type source: str
+    :param backend:
+    :type backend: str
+    :param iterations:
+    :type iterations: int
+    :param profile: see ParseAppStorePage.profiles
+    :type profile: str
+    :rtype: dict
+    """
+    durations = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        page_start = time.perf_counter()
+        ParseAppStorePage(source, backend, profile).parse()
+        durations.append(time.perf_counter() - page_start)
+    return summarize(durations, time.perf_counter() - start)
+
+
+def benchmark_stream_parse(source, iterations=20, chunk_size=16384, profile='full'):
+    """Times StreamingParseAppStorePage on the page fed in
+    chunks, as it would arrive from the network.
+
+    :param source:
+    :type source: str
+    :param iterations:
+    :type iterations: int
+    :param chunk_size:
+    :type chunk_size: int
+    :param profile: see ParseAppStorePage.profiles
+    :type profile: str
+    :return: also the share of the page that had to be read
+    :rtype: dict
+    """
+    from stream_parse import StreamingParseAppStorePage
+
+    body = source.encode('utf-8')
+    read = []
+
+    def chunks():
+        for i in range(0, len(body), chunk_size):
+            read.append(min(chunk_size, len(body) - i))
+            yield body[i:i + chunk_size]
+
+    durations = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        page_start = time.perf_counter()
+        StreamingParseAppStorePage(profile=profile).parse_stream(chunks())
+        durations.append(time.perf_counter() - page_start)
+    results = summarize(durations, time.perf_counter() - start)
+    results['read_fraction'] = sum(read) / (len(body) * iterations)
+    return results
+
+
+def benchmark_write_out(source, pages=500, db=None):
+    """Times writing parsed pages through the db writer,
+    each one with a different app id.
+
+    :param source:
+    :type source: str
+    :param pages:
+    :type pages: int
+    :param db: defaults to a temporary db
+    :type db: str
+    :return: pages per second, with rows_per_second
+    :rtype: dict
+    """
+    from db_writer import DBWriter
+    from migrations import migrate
+
+    temp_dir = None
+    if db is None:
+        temp_dir = tempfile.mkdtemp()
+        db = os.path.join(temp_dir, 'app_store_db')
+    try:
+        migrate(db)
+        output_dict = ParseAppStorePage(source).parse()
+        parsed_pages = []
+        for i in range(pages):
+            page_dict = copy.deepcopy(output_dict)
+            page_dict['app_id'] = str(i)
+            parsed_pages.append(ParseAppStorePage.from_output_dict(page_dict))
+        rows = sum(len(x[1]) for x in parsed_pages[0].rows()) * pages
+
+        writer = DBWriter(db).start()
+        durations = []
+        start = time.perf_counter()
+        for parsed in parsed_pages:
+            page_start = time.perf_counter()
+            parsed.write_out(writer)
+            durations.append(time.perf_counter() - page_start)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        results = summarize(durations, elapsed)
+        results['rows_per_second'] = rows / elapsed
+        return results
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+
+def benchmark_write_out_links(links=50000, batch_size=100):
+    """Times CrawlAppStore.write_out_links on a temporary db,
+    with every link a new app.
+
+    :param links:
+    :type links: int
+    :param batch_size: links per call, i.e. per category page
+    :type batch_size: int
+    :return: links per second, latency per call
+    :rtype: dict
+    """
+    from app_store_crawler import CrawlAppStore
+
+    temp_dir = tempfile.mkdtemp()
+    crawler_class = type(
+        'BenchmarkCrawlAppStore', (CrawlAppStore,),
+        dict(db=os.path.join(temp_dir, 'app_store_db'))
+    )
+    crawler = crawler_class()
+    try:
+        all_links = [
+            'https://itunes.apple.com/us/app/app-{0}/id{0}?mt=8'.format(i)
+            for i in range(links)
+        ]
+        durations = []
+        start = time.perf_counter()
+        for i in range(0, links, batch_size):
+            call_start = time.perf_counter()
+            crawler.write_out_links(all_links[i:i + batch_size])
+            durations.append(time.perf_counter() - call_start)
+        crawler.writer.flush()
+        return summarize(durations, time.perf_counter() - start, links)
+    finally:
+        crawler.close()
+        shutil.rmtree(temp_dir)
+
+
+def benchmark_crawl(source, pages=200, latency=0.05, pool_size=10, streaming=False):
+    """Times CrawlAppStore.crawl_app_pages end to end against
+    a StubAppStoreServer on a temporary db. The rate limiter
+    is set high enough that the server latency, the parser
+    and the writer are what's being measured.
+
+    :param source:
+    :type source: str
+    :param pages:
+    :type pages: int
+    :param latency: seconds the server takes per response
+    :type latency: float
+    :param pool_size:
+    :type pool_size: int
+    :param streaming: parse pages as they download
+    :type streaming: bool
+    :rtype: dict
+    """
+    from app_store_crawler import CrawlAppStore
+    from rate_limiter import AdaptiveRateLimiter
+    from stub_server import StubAppStoreServer
+
+    durations = []
+    durations_lock = threading.Lock()
+
+    class BenchmarkCrawlAppStore(CrawlAppStore):
+        db = os.path.join(tempfile.mkdtemp(), 'app_store_db')
+
+        def scrape_app_page(self, url):
+            page_start = time.perf_counter()
+            super().scrape_app_page(url)
+            with durations_lock:
+                durations.append(time.perf_counter() - page_start)
+
+    crawler = BenchmarkCrawlAppStore(
+        pool_size=pool_size,
+        rate_limiter=AdaptiveRateLimiter(
+            initial_rate=10000, max_rate=10000, max_concurrency=pool_size
+        ),
+        streaming=streaming
+    )
+    try:
+        with StubAppStoreServer(default_page=source, latency=latency) as server:
+            urls = [
+                server.url('/us/app/app-{0}/id{0}?mt=8'.format(i))
+                for i in range(pages)
+            ]
+            start = time.perf_counter()
+            crawler.crawl_app_pages(urls)
+            results = summarize(durations, time.perf_counter() - start, pages)
+        results.update(latency=latency, pool_size=pool_size)
+        return results
+    finally:
+        crawler.close()
+        shutil.rmtree(os.path.dirname(BenchmarkCrawlAppStore.db))
+
+
+def git_commit():
+    """
+    :return: the commit being benchmarked, or None
+    :rtype: str
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(source, iterations=20, write_pages=500, links=50000,
+                   crawl_pages=200, latency=0.05):
+    """Runs the whole suite.
+
+    Peak rss is for the whole process so far, so each result
+    shows the most memory used up to the end of that benchmark.
+
+    :param source: the example page
+    :type source: str
+    :param iterations: parses per parse benchmark
+    :type iterations: int
+    :param write_pages:
+    :type write_pages: int
+    :param links:
+    :type links: int
+    :param crawl_pages:
+    :type crawl_pages: int
+    :param latency: of the stub server, in seconds
+    :type latency: float
+    :rtype: dict
+    """
+    results = dict(
+        commit=git_commit(),
+        python=platform.python_version(),
+        time=time.time(),
+        parse={},
+    )
+    variants = dict(
+        example=source,
+        reviews_100=synthetic_page(source, reviews=100),
+        purchases_100=synthetic_page(source, purchases=100),
+        reviews_100_purchases_100=synthetic_page(source, reviews=100, purchases=100),
+    )
+    for backend in benchmark_parser_backends(source, iterations=1):
+        for name, page in variants.items():
+            results['parse']['{}/{}'.format(backend, name)] = benchmark_parse(
+                page, backend, iterations
+            )
+    for name, page in variants.items():
+        results['parse']['streaming/{}'.format(name)] = benchmark_stream_parse(
+            page, iterations
+        )
+    # what each field profile costs, on the default backend and streaming
+    for profile in ParseAppStorePage.profiles:
+        for name in ('example', 'reviews_100'):
+            results['parse']['profile-{}/html.parser/{}'.format(profile, name)] = \
+                benchmark_parse(variants[name], 'html.parser', iterations, profile)
+            results['parse']['profile-{}/streaming/{}'.format(profile, name)] = \
+                benchmark_stream_parse(variants[name], iterations, profile=profile)
+    results['write_out'] = benchmark_write_out(source, write_pages)
+    results['write_out_links'] = benchmark_write_out_links(links)
+    results['crawl'] = benchmark_crawl(source, crawl_pages, latency)
+    results['crawl_streaming'] = benchmark_crawl(source, crawl_pages, latency, streaming=True)
+    return results
+
+
+def print_results(results):
+    """
+    :param results: from run_benchmarks
+    :type results: dict
+    """
+    rows = [('parse ' + name, x) for name, x in results['parse'].items()]
+    rows += [
+        (name, results[name])
+        for name in ('write_out', 'write_out_links', 'crawl', 'crawl_streaming')
+        if name in results
+    ]
+    print('{:<45} {:>12} {:>10} {:>10} {:>10}'.format(
+        '', 'per sec', 'p50 ms', 'p99 ms', 'rss MB'
+    ))
+    for name, x in rows:
+        print('{:<45} {:>12.1f} {:>10.2f} {:>10.2f} {:>10}'.format(
+            name, x['per_second'], x['p50_ms'], x['p99_ms'],
+            '{:.0f}'.format(x['peak_rss_mb']) if x['peak_rss_mb'] else '-'
+        ))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the parser, db writer and crawler.'
+    )
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='where to save the results as json')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--write-pages', type=int, default=500)
+    parser.add_argument('--links', type=int, default=50000)
+    parser.add_argument('--crawl-pages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    page = open('App Store app example.htm').read()
+    benchmark_results = run_benchmarks(
+        page, args.iterations, args.write_pages, args.links,
+        args.crawl_pages, args.latency
+    )
+    print_results(benchmark_results)
+    with open(args.output, 'w') as f:
+        json.dump(benchmark_results, f, indent=2)
+    print('saved to', args.output)
@@ -1,3 +1,6 @@
+-- The first version of the schema. Run `python migrations.py` to create
+-- the db, or to bring an existing one up to the latest version.
+
 create table app_store_app_urls
 (
 	url TEXT
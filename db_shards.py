@@ -0,0 +1,344 @@
+import os
+import sqlite3
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from db_writer import AfterCommit, DBWriter
+from metrics import registry
+from migrations import migrate
+from web_cache import ChangeWatcher, ConnectionPool
+
+
+def shard_index(app_id, shard_count):
+    """Which shard an app lives in. crc32 rather than
+    hash(), which gives different answers in each process.
+
+    :param app_id:
+    :type app_id: str
+    :param shard_count:
+    :type shard_count: int
+    :rtype: int
+    """
+    return zlib.crc32(str(app_id).encode('utf-8')) % shard_count
+
+
+def shard_name(db, shard):
+    """
+    :param db:
+    :type db: str
+    :param shard:
+    :type shard: int
+    :return: i.e. app_store_db-shard-3
+    :rtype: str
+    """
+    return '{}-shard-{}'.format(os.path.basename(db), shard)
+
+
+# noinspection SqlDialectInspection
+def read_shard_paths(db='app_store_db'):
+    """
+    :param db:
+    :type db: str
+    :return: the paths of the db's shards in order, or
+        an empty list if it isn't sharded
+    :rtype: list
+    """
+    if not os.path.exists(db):
+        return []
+    conn = sqlite3.connect(db)
+    try:
+        rows = conn.execute('SELECT path FROM app_store_db_shards ORDER BY shard').fetchall()
+    except sqlite3.OperationalError:
+        # from before migration_10
+        return []
+    finally:
+        conn.close()
+    # kept relative to the db, so the files can be moved together
+    return [os.path.join(os.path.dirname(db), x[0]) for x in rows]
+
+
+# noinspection SqlDialectInspection
+def create_shards(db='app_store_db', shard_count=4):
+    """Sets the db up to keep its apps in shard_count files
+    next to it, or checks that it already does. Each shard
+    has the whole schema, so anything that reads one db,
+    i.e. export.py, can be pointed at a shard.
+
+    :param db:
+    :type db: str
+    :param shard_count:
+    :type shard_count: int
+    :return: the paths of the shards
+    :rtype: list
+    """
+    migrate(db)
+    paths = read_shard_paths(db)
+    if not paths:
+        with sqlite3.connect(db) as conn:
+            if conn.execute('SELECT count(*) FROM app_store_main').fetchone()[0]:
+                raise ValueError('{} already has apps in it, so it can\'t be sharded'.format(db))
+            conn.executemany(
+                'INSERT INTO app_store_db_shards (shard, path) VALUES (?, ?)',
+                [(x, shard_name(db, x)) for x in range(shard_count)]
+            )
+        paths = read_shard_paths(db)
+    elif len(paths) != shard_count:
+        raise ValueError('{} has {} shards, not {}'.format(db, len(paths), shard_count))
+    for path in paths:
+        migrate(path)
+    return paths
+
+
+def open_writer(db='app_store_db', db_shards=None, **kwargs):
+    """The writer for a db, sharded the way the db already
+    is, see app_store_db_shards, or into db_shards files if
+    it isn't yet. Everything that writes apps should get its
+    writer here, so none of them write apps to the main file
+    of a sharded db.
+
+    :param db:
+    :type db: str
+    :param db_shards: the number of shards, which has to
+        match the db's if it's already sharded
+    :type db_shards: int
+    :param kwargs: passed on to each DBWriter
+    :return: not started yet
+    :rtype: DBWriter or ShardedWriter
+    """
+    paths = read_shard_paths(db)
+    if paths and db_shards and db_shards != len(paths):
+        raise ValueError('{} has {} shards, not {}'.format(db, len(paths), db_shards))
+    shard_count = db_shards or len(paths)
+    if shard_count:
+        return ShardedWriter(db, shard_count, **kwargs)
+    return DBWriter(db, **kwargs)
+
+
+class ShardedWriter:
+    def __init__(self, db='app_store_db', shard_count=4, **kwargs):
+        """Writes the app tables to shard_count files, split by
+        a hash of the app id. Each shard has its own DBWriter
+        thread, connection and WAL, so shards commit without
+        waiting on each other and each file stays a fraction
+        of the size. Everything else, i.e. the frontier, still
+        goes to db, with urls marked done only after their
+        app's shard has committed, see put_after.
+
+        It has the same methods as DBWriter, and
+        ParseAppStorePage.write_record picks the shard
+        with writer_for.
+
+        :param db:
+        :type db: str
+        :param shard_count:
+        :type shard_count: int
+        :param kwargs: passed on to each DBWriter
+        """
+        self.db = db
+        self.paths = create_shards(db, shard_count)
+        self.main = DBWriter(db, **kwargs)
+        self.shards = [DBWriter(x, **kwargs) for x in self.paths]
+
+    def start(self):
+        """Starts every writer thread.
+
+        :rtype: ShardedWriter
+        """
+        self.main.start()
+        for shard in self.shards:
+            shard.start()
+        # each DBWriter replaces the last one's gauge
+        registry.gauge(
+            'app_store_db_writer_queue_depth', 'Items waiting for the db writer',
+            function=self.queue_depth
+        )
+        return self
+
+    def queue_depth(self):
+        return self.main.queue.qsize() + sum(x.queue.qsize() for x in self.shards)
+
+    def writer_for(self, app_id):
+        """
+        :param app_id:
+        :type app_id: str
+        :return: the writer of the app's shard
+        :rtype: DBWriter
+        """
+        return self.shards[shard_index(app_id, len(self.shards))]
+
+    def put(self, statement, rows):
+        """Queues rows for the main db.
+
+        :param statement:
+        :type statement: str
+        :param rows: a list of parameter tuples
+        :type rows: list
+        """
+        self.main.put(statement, rows)
+
+    def put_all(self, statements):
+        """Queues statements for the main db, to be
+        committed together.
+
+        :param statements: a list of (statement, rows)
+        :type statements: list
+        """
+        self.main.put_all(statements)
+
+    def put_after(self, app_id, statement, rows):
+        """Queues rows for the main db that mustn't commit
+        before the app's rows, i.e. marking its url done.
+        They're handed to the main writer once the app's
+        shard has committed everything put before them, so
+        a crash in between leaves the url leased, to be
+        crawled again once the lease runs out, rather than
+        done without its app.
+
+        :param app_id:
+        :type app_id: str
+        :param statement:
+        :type statement: str
+        :param rows: a list of parameter tuples
+        :type rows: list
+        """
+        if rows:
+            self.writer_for(app_id).queue.put(AfterCommit(self.main, statement, rows))
+
+    def flush(self):
+        """Blocks until everything put so far is committed,
+        in every shard."""
+        for shard in self.shards:
+            shard.flush()
+        self.main.flush()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self.main.close()
+
+
+class ShardedConnectionPool:
+    def __init__(self, db='app_store_db', paths=None, size=8):
+        """Reads a sharded db for the web server. An app's
+        reads go to its own shard, and searches run on every
+        shard at once on a thread each, for the caller to
+        merge. It has the same methods as ConnectionPool.
+
+        :param db:
+        :type db: str
+        :param paths: defaults to read_shard_paths(db)
+        :type paths: list
+        :param size: connections kept open to each file
+        :type size: int
+        """
+        paths = paths or read_shard_paths(db)
+        self.main = ConnectionPool(db, size)
+        self.shards = [ConnectionPool(x, size) for x in paths]
+        self.shard_count = len(self.shards)
+        self.executor = ThreadPoolExecutor(self.shard_count)
+
+    def connection(self):
+        """A connection to the main db, i.e. for the frontier."""
+        return self.main.connection()
+
+    def connection_for(self, app_id):
+        """
+        :param app_id:
+        :type app_id: str
+        :return: a connection to the app's shard
+        """
+        return self.shards[shard_index(app_id, self.shard_count)].connection()
+
+    @staticmethod
+    def call(shard, function, *args):
+        with shard.connection() as conn:
+            return function(conn, *args)
+
+    def map(self, function):
+        """Calls function(conn) on every shard at once.
+
+        :param function:
+        :type function: function
+        :return: what it returned for each shard
+        :rtype: list
+        """
+        futures = [self.executor.submit(self.call, x, function) for x in self.shards]
+        return [x.result() for x in futures]
+
+    def map_ids(self, function, app_ids):
+        """Calls function(conn, app_ids) on each shard with
+        the ids that live there, all at once.
+
+        :param function:
+        :type function: function
+        :param app_ids:
+        :type app_ids: list
+        :return: what it returned for each shard it was called on
+        :rtype: list
+        """
+        by_shard = {}
+        for app_id in app_ids:
+            by_shard.setdefault(shard_index(app_id, self.shard_count), []).append(app_id)
+        futures = [
+            self.executor.submit(self.call, self.shards[x], function, ids)
+            for x, ids in sorted(by_shard.items())
+        ]
+        return [x.result() for x in futures]
+
+    def close(self):
+        self.executor.shutdown()
+        self.main.close()
+        for shard in self.shards:
+            shard.close()
+
+
+class ShardedChangeWatcher:
+    def __init__(self, paths, app_cache=None, caches=(), slack=5.0, clear_interval=10.0):
+        """A ChangeWatcher on each shard.
+
+        :param paths:
+        :type paths: list
+        :param app_cache:
+        :type app_cache: web_cache.TTLCache
+        :param caches:
+        :type caches: tuple
+        :param slack:
+        :type slack: float
+        :param clear_interval:
+        :type clear_interval: float
+        """
+        self.watchers = [
+            ChangeWatcher(x, app_cache, caches, slack, clear_interval) for x in paths
+        ]
+
+    def check(self):
+        for watcher in self.watchers:
+            watcher.check()
+
+    def close(self):
+        for watcher in self.watchers:
+            watcher.close()
+
+
+def sum_rows(parts, keys=1):
+    """Adds up rows from several shards that have the same
+    key, i.e. the rollups of a category, which has apps in
+    every shard.
+
+    :param parts: the rows from each shard
+    :type parts: list
+    :param keys: how many of the first columns are the key
+    :type keys: int
+    :return: a row for each key, in the order they were
+        first seen
+    :rtype: list
+    """
+    totals = {}
+    for rows in parts:
+        for row in rows:
+            total = totals.get(row[:keys])
+            if total is None:
+                totals[row[:keys]] = list(row[keys:])
+            else:
+                for i, value in enumerate(row[keys:]):
+                    total[i] = (total[i] or 0) + (value or 0)
+    return [key + tuple(total) for key, total in totals.items()]
@@ -0,0 +1,249 @@
+import queue
+import sqlite3
+import threading
+import time
+from metrics import registry
+
+write_seconds = registry.histogram(
+    'app_store_db_write_seconds', 'Time taken to commit each batch of writes'
+)
+rows_written = registry.counter(
+    'app_store_db_rows_written_total', 'Rows sent to the db by the writer'
+)
+write_errors = registry.counter(
+    'app_store_db_write_errors_total', 'Items the db writer couldn\'t commit'
+)
+put_wait_seconds = registry.histogram(
+    'app_store_db_writer_put_wait_seconds',
+    'Time spent waiting for room in the db writer\'s queue'
+)
+
+
+class AfterCommit:
+    def __init__(self, writer, statement, rows):
+        """Rows to hand on to another writer once everything
+        put before them has been committed, see
+        db_shards.ShardedWriter.put_after.
+
+        :param writer:
+        :type writer: DBWriter
+        :param statement:
+        :type statement: str
+        :param rows:
+        :type rows: list
+        """
+        self.writer = writer
+        self.statement = statement
+        self.rows = rows
+
+
+class DBWriter:
+    def __init__(self, db='app_store_db', batch_rows=500, flush_interval=1.0,
+                 max_queue=10000):
+        """Owns the one connection used to write to the db.
+
+        Other threads call put with a statement and its rows.
+        A background thread collects them and commits them in
+        groups, either once batch_rows rows are waiting or once
+        flush_interval seconds have passed since the first one,
+        whichever is sooner. Everything is committed in the
+        order it was put, and the statements of one put_all
+        always commit together, see group.
+
+        :param db:
+        :type db: str
+        :param batch_rows:
+        :type batch_rows: int
+        :param flush_interval:
+        :type flush_interval: float
+        :param max_queue: put blocks once this many items are waiting
+        :type max_queue: int
+        """
+        self.db = db
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_queue)
+        self.thread = None
+
+    def start(self):
+        """Starts the writer thread.
+
+        :rtype: DBWriter
+        """
+        if self.thread is None:
+            registry.gauge(
+                'app_store_db_writer_queue_depth', 'Items waiting for the db writer',
+                function=self.queue.qsize
+            )
+            self.thread = threading.Thread(target=self.run, daemon=1)
+            self.thread.start()
+        return self
+
+    def put(self, statement, rows):
+        """Queues rows to be written with statement.
+
+        :param statement:
+        :type statement: str
+        :param rows: a list of parameter tuples
+        :type rows: list
+        """
+        if rows:
+            with put_wait_seconds.time():
+                self.queue.put([(statement, rows)])
+
+    def put_all(self, statements):
+        """Queues several statements that are run in order
+        and always committed in the same transaction, i.e.
+        an app's main row and its languages and reviews.
+
+        :param statements: a list of (statement, rows)
+        :type statements: list
+        """
+        statements = [x for x in statements if x[1]]
+        if statements:
+            with put_wait_seconds.time():
+                self.queue.put(statements)
+
+    def put_after(self, app_id, statement, rows):
+        """Queues rows that mustn't commit before the app's
+        rows, i.e. marking its url done. With one db they
+        simply go in the same queue.
+
+        :param app_id:
+        :type app_id: str
+        :param statement:
+        :type statement: str
+        :param rows: a list of parameter tuples
+        :type rows: list
+        """
+        self.put(statement, rows)
+
+    def writer_for(self, app_id):
+        """The writer for an app's rows, which is always this
+        one, see db_shards.ShardedWriter.
+
+        :param app_id:
+        :type app_id: str
+        :rtype: DBWriter
+        """
+        return self
+
+    def flush(self):
+        """Blocks until everything put so far is committed."""
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        """Commits everything waiting and stops the thread."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def connect(self):
+        conn = sqlite3.connect(self.db)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def run(self):
+        conn = self.connect()
+        pending = []
+        pending_rows = 0
+        after_commit = []
+        deadline = None
+        try:
+            while 1:
+                timeout = None
+                if deadline is not None:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = False
+
+                if isinstance(item, list):
+                    # a whole put or put_all, so a batch never
+                    # ends part way through one
+                    pending.append(item)
+                    pending_rows += sum(len(rows) for _, rows in item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    if pending_rows < self.batch_rows:
+                        continue
+                elif isinstance(item, AfterCommit):
+                    after_commit.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    continue
+
+                # the batch is full, the interval is up, or
+                # somebody is waiting on a flush or close
+                self.commit(conn, pending)
+                for after in after_commit:
+                    after.writer.put(after.statement, after.rows)
+                pending = []
+                pending_rows = 0
+                after_commit = []
+                deadline = None
+
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is None:
+                    return
+        finally:
+            conn.close()
+
+    @staticmethod
+    def group(pending):
+        """Merges statements that are put one after another
+        with the same statement, so each run of them goes
+        through a single executemany, i.e. a crawl's links.
+        Nothing is reordered.
+
+        :param pending: the items, each a list of (statement, rows)
+        :type pending: list
+        :rtype: list
+        """
+        groups = []
+        for item in pending:
+            for statement, rows in item:
+                if groups and groups[-1][0] == statement:
+                    groups[-1][1].extend(rows)
+                else:
+                    groups.append((statement, list(rows)))
+        return groups
+
+    def commit(self, conn, pending):
+        """Writes out a batch in one transaction.
+
+        :param conn:
+        :type conn: sqlite3.Connection
+        :param pending:
+        :type pending: list
+        """
+        if not pending:
+            return
+        groups = self.group(pending)
+        start = time.perf_counter()
+        try:
+            with conn:
+                for statement, rows in groups:
+                    conn.executemany(statement, rows)
+        except sqlite3.Error as e:
+            # one bad row shouldn't lose the whole batch, so
+            # fall back to committing the items one at a time,
+            # each still all or nothing
+            print(e)
+            for item in pending:
+                try:
+                    with conn:
+                        for statement, rows in item:
+                            conn.executemany(statement, rows)
+                except sqlite3.Error as e:
+                    print(item[0][0])
+                    print(e)
+                    write_errors.inc()
+        write_seconds.observe(time.perf_counter() - start)
+        rows_written.inc(amount=sum(len(rows) for _, rows in groups))
@@ -0,0 +1,476 @@
+import argparse
+import gzip
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from app_store_crawler import FetchAppStore, pages_total
+from db_shards import open_writer
+from frontier import CrawlFrontier, PENDING, LEASED
+from http_cache import HTTPCache
+from migrations import migrate
+from parse_app_page import ParseAppStorePage
+from rate_limiter import AdaptiveRateLimiter
+from records import AppRecord
+from url_dedup import LinkDeduper
+
+
+def encode_body(payload):
+    """
+    :param payload:
+    :type payload: dict
+    :return: the payload as gzipped json
+    :rtype: bytes
+    """
+    return gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'), 1)
+
+
+def decode_body(body, encoding=None):
+    """
+    :param body:
+    :type body: bytes
+    :param encoding: the Content-Encoding header
+    :type encoding: str
+    :rtype: dict
+    """
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    return json.loads(body.decode('utf-8')) if body else {}
+
+
+class CrawlCoordinator:
+    def __init__(self, db='app_store_db', host='127.0.0.1', port=8765,
+                 lease_seconds=600, max_attempts=3, db_shards=None):
+        """Hands out batches of urls from the frontier to
+        CrawlWorkers over HTTP and writes the records they
+        send back, so a crawl can be spread over many
+        processes, machines or IPs that share one db.
+
+        Only the coordinator touches the db. Urls are leased
+        to the worker that asked for them, and go back to the
+        frontier if the worker doesn't report back before the
+        lease runs out.
+
+        POST /lease {"worker": id, "count": n}
+            -> {"urls": [...], "done": true if nothing is left}
+        POST /results {"worker": id, "records": [...], "profile": name,
+                       "failed": [[url, error], ...], "links": [...]}
+            records are (url, AppRecord as a list) pairs, parsed
+            with the field profile
+        POST /release {"worker": id}
+            gives back everything leased to the worker
+        GET /status
+            -> the frontier counts and when each worker was last seen
+
+        Bodies are json, gzipped if Content-Encoding says so.
+
+        :param db:
+        :type db: str
+        :param host:
+        :type host: str
+        :param port: 0 picks a free port
+        :type port: int
+        :param lease_seconds: how long a worker has to
+            report back on a batch
+        :type lease_seconds: float
+        :param max_attempts:
+        :type max_attempts: int
+        :param db_shards: split the app tables across this
+            many files if the db isn't sharded yet, see
+            db_shards.open_writer
+        :type db_shards: int
+        """
+        self.db = db
+        migrate(db)
+        self.writer = open_writer(db, db_shards).start()
+        self.frontier = CrawlFrontier(db, self.writer, lease_seconds, max_attempts)
+        self.link_deduper = LinkDeduper(db)
+        # the frontier's connection isn't safe to
+        # share between the handler threads
+        self.frontier_lock = threading.Lock()
+        self.workers = {}
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def lease(self, worker, count):
+        """
+        :param worker:
+        :type worker: str
+        :param count:
+        :type count: int
+        :rtype: dict
+        """
+        with self.frontier_lock:
+            urls = self.frontier.claim(count, owner=worker)
+            done = False
+            if not urls:
+                # completes still in the writer's queue
+                # would look like urls still leased
+                self.writer.flush()
+                counts = self.frontier.counts()
+                done = counts[PENDING] == 0 and counts[LEASED] == 0
+        return dict(urls=urls, done=done)
+
+    def results(self, worker, records=(), failed=(), links=(), profile='full'):
+        """Writes out what a worker found. Each record
+        commits along with its url being marked done, or
+        just before if the app tables are in shards.
+
+        Records for urls that are no longer leased to the
+        worker, i.e. its lease ran out and somebody else
+        has the url now, are dropped.
+
+        :param worker:
+        :type worker: str
+        :param records: (url, AppRecord as a list) pairs
+        :type records: list
+        :param failed: (url, error) pairs
+        :type failed: list
+        :param links: app urls to add to the frontier
+        :type links: list
+        :param profile: the profile the records were parsed with
+        :type profile: str
+        """
+        with self.frontier_lock:
+            leased = self.frontier.leased([x[0] for x in records], worker)
+        for url, values in records:
+            if url not in leased:
+                print(url)
+                print('lease lost by {}'.format(worker))
+                pages_total.inc('expired')
+                continue
+            ParseAppStorePage.write_record(AppRecord.from_list(values), self.writer, profile)
+            self.frontier.complete(url, worker)
+            pages_total.inc('done')
+        for url, error in failed:
+            self.frontier.fail(url, error, worker)
+            pages_total.inc('failed')
+        if links:
+            self.writer.put(
+                'INSERT OR IGNORE INTO app_store_app_urls (url, app_id) VALUES (?, ?)',
+                self.link_deduper.filter_new(links)
+            )
+
+    def release(self, worker):
+        """
+        :param worker:
+        :type worker: str
+        """
+        self.writer.flush()
+        with self.frontier_lock:
+            self.frontier.release(worker)
+        self.workers.pop(worker, None)
+
+    def status(self):
+        """
+        :rtype: dict
+        """
+        with self.frontier_lock:
+            counts = self.frontier.counts()
+        return dict(frontier=counts, workers=dict(self.workers))
+
+    def make_handler(self):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def send_json(self, payload, status=200):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/status':
+                    self.send_json(coordinator.status())
+                else:
+                    self.send_json(dict(error='not found'), 404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    payload = decode_body(
+                        self.rfile.read(length), self.headers.get('Content-Encoding')
+                    )
+                    worker = payload.get('worker', '')
+                    coordinator.workers[worker] = time.time()
+                    if self.path == '/lease':
+                        self.send_json(coordinator.lease(worker, int(payload.get('count', 10))))
+                    elif self.path == '/results':
+                        coordinator.results(
+                            worker, payload.get('records', []), payload.get('failed', []),
+                            payload.get('links', []), payload.get('profile', 'full')
+                        )
+                        self.send_json({})
+                    elif self.path == '/release':
+                        coordinator.release(worker)
+                        self.send_json({})
+                    else:
+                        self.send_json(dict(error='not found'), 404)
+                except Exception as e:
+                    print(self.path)
+                    print(e)
+                    self.send_json(dict(error=str(e)), 500)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def url(self):
+        host = self.server.server_address[0]
+        return 'http://{}:{}'.format(host, self.port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=1)
+        self.thread.start()
+        return self
+
+    def close(self):
+        """Stops serving and commits everything the
+        workers have sent."""
+        if self.thread is not None:
+            self.server.shutdown()
+        self.server.server_close()
+        self.link_deduper.save()
+        self.writer.close()
+        self.frontier.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CrawlWorker(FetchAppStore):
+    def __init__(self, coordinator_url, pool_size=10, parser_backend='html.parser',
+                 rate_limiter=None, max_retries=3, batch_size=20, poll_seconds=5.0,
+                 exit_when_done=True, archive=None, worker_id=None, profile='full',
+                 http_cache=None):
+        """Fetches and parses the urls a CrawlCoordinator
+        leases to it and sends back compact records, instead
+        of writing to a db of its own. Run one per process,
+        machine or IP.
+
+        A worker has no db, but fetches, parses and archives
+        the same way as CrawlAppStore, which it shares
+        FetchAppStore with.
+
+        :param coordinator_url: i.e. http://10.0.0.2:8765
+        :type coordinator_url: str
+        :param pool_size:
+        :type pool_size: int
+        :param parser_backend: see ParseAppStorePage.backends
+        :type parser_backend: str
+        :param rate_limiter:
+        :type rate_limiter: rate_limiter.AdaptiveRateLimiter
+        :param max_retries:
+        :type max_retries: int
+        :param batch_size: urls to lease at a time
+        :type batch_size: int
+        :param poll_seconds: how long to wait before asking
+            again when there's nothing to lease
+        :type poll_seconds: float
+        :param exit_when_done: stop once the frontier is empty
+            rather than waiting for more urls
+        :type exit_when_done: bool
+        :param archive: keeps the raw html if given
+        :type archive: page_archive.PageArchive
+        :param worker_id: names this worker in the leases
+        :type worker_id: str
+        :param profile: see ParseAppStorePage.profiles
+        :type profile: str
+        :param http_cache: pages are read from it before
+            being fetched, if given
+        :type http_cache: http_cache.HTTPCache
+        """
+        super().__init__(
+            pool_size=pool_size, parser_backend=parser_backend,
+            rate_limiter=rate_limiter, max_retries=max_retries, archive=archive,
+            profile=profile, http_cache=http_cache
+        )
+        self.coordinator_url = coordinator_url.rstrip('/')
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.exit_when_done = exit_when_done
+        self.worker_id = worker_id or '{}:{}:{}'.format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]
+        )
+        # kept apart from the crawl's session, so talking to
+        # the coordinator doesn't wait on the rate limiter
+        self.coordinator_session = requests.Session()
+
+    def post(self, path, payload, retries=5):
+        """Sends a request to the coordinator, retrying
+        for a while if it can't be reached.
+
+        :param path:
+        :type path: str
+        :param payload:
+        :type payload: dict
+        :param retries:
+        :type retries: int
+        :rtype: dict
+        """
+        payload = dict(payload, worker=self.worker_id)
+        attempt = 0
+        while 1:
+            attempt += 1
+            try:
+                r = self.coordinator_session.post(
+                    self.coordinator_url + path, data=encode_body(payload),
+                    headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/json'},
+                    timeout=60
+                )
+                r.raise_for_status()
+                return r.json()
+            except requests.RequestException:
+                if attempt > retries:
+                    raise
+                time.sleep(self.rate_limiter.backoff(attempt))
+
+    def fetch_record(self, url):
+        """Fetches and parses a single url.
+
+        :param url:
+        :type url: str
+        :return: (url, AppRecord or None, error or None)
+        :rtype: tuple
+        """
+        try:
+            source = self.get_request(url)
+            self.archive_page(url, source)
+            return url, self.parse_page(source).to_record(), None
+        except Exception as e:
+            print(url)
+            print(e)
+            return url, None, str(e)
+
+    def crawl_batch(self, urls, executor):
+        """Searches a leased batch and reports back on it.
+
+        :param urls:
+        :type urls: list
+        :param executor:
+        :type executor: ThreadPoolExecutor
+        """
+        records = []
+        failed = []
+        for url, record, error in executor.map(self.fetch_record, urls):
+            if error is None:
+                records.append((url, record))
+                pages_total.inc('done')
+            else:
+                failed.append((url, error))
+                pages_total.inc('failed')
+        self.post('/results', dict(records=records, failed=failed, profile=self.profile))
+
+    def run(self):
+        """Leases and searches batches until the coordinator
+        says the frontier is empty, or forever if exit_when_done
+        is off. Anything still leased is given back on the
+        way out.
+
+        :return: the number of urls searched
+        :rtype: int
+        """
+        searched = 0
+        try:
+            with ThreadPoolExecutor(self.pool_size) as executor:
+                while 1:
+                    lease = self.post('/lease', dict(count=self.batch_size))
+                    if not lease['urls']:
+                        if lease['done'] and self.exit_when_done:
+                            return searched
+                        time.sleep(self.poll_seconds)
+                        continue
+                    self.crawl_batch(lease['urls'], executor)
+                    searched += len(lease['urls'])
+        finally:
+            try:
+                self.post('/release', {}, retries=0)
+            except requests.RequestException as e:
+                # the leases will run out on their own
+                print(e)
+
+    def close(self):
+        super().close()
+        self.coordinator_session.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Spread a crawl of the frontier over several worker processes.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    coordinator_parser = commands.add_parser(
+        'coordinator', help='serve the frontier of a db to workers'
+    )
+    coordinator_parser.add_argument('--db', default='app_store_db')
+    coordinator_parser.add_argument('--host', default='127.0.0.1')
+    coordinator_parser.add_argument('--port', type=int, default=8765)
+    coordinator_parser.add_argument('--lease-seconds', type=float, default=600)
+    coordinator_parser.add_argument('--db-shards', type=int,
+                                    help='split the app tables across this many files')
+    worker_parser = commands.add_parser('worker', help='crawl urls leased from a coordinator')
+    worker_parser.add_argument('coordinator_url', nargs='?', default='http://127.0.0.1:8765')
+    worker_parser.add_argument('--pool-size', type=int, default=10)
+    worker_parser.add_argument('--batch-size', type=int, default=20)
+    worker_parser.add_argument('--backend', default='html.parser',
+                               choices=sorted(ParseAppStorePage.backends))
+    worker_parser.add_argument('--profile', default='full',
+                               choices=sorted(ParseAppStorePage.profiles))
+    worker_parser.add_argument('--initial-rate', type=float, default=0.5,
+                               help='requests per second per host to start at')
+    worker_parser.add_argument('--max-rate', type=float, default=20.0)
+    worker_parser.add_argument('--wait', action='store_true',
+                               help='keep waiting for urls once the frontier is empty')
+    worker_parser.add_argument('--http-cache',
+                               help='a directory to cache the fetched pages in')
+    worker_parser.add_argument('--offline', action='store_true',
+                               help='only read pages from the http cache')
+    args = parser.parse_args()
+
+    if args.command == 'coordinator':
+        c = CrawlCoordinator(
+            args.db, args.host, args.port, args.lease_seconds, db_shards=args.db_shards
+        ).start()
+        print('coordinating on', c.url())
+        try:
+            c.thread.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            c.close()
+    else:
+        limiter = AdaptiveRateLimiter(
+            initial_rate=args.initial_rate, max_rate=args.max_rate,
+            max_concurrency=args.pool_size
+        )
+        cache = None
+        if args.http_cache:
+            cache = HTTPCache(args.http_cache, offline=args.offline)
+        w = CrawlWorker(
+            args.coordinator_url, args.pool_size, args.backend, limiter,
+            batch_size=args.batch_size, exit_when_done=not args.wait,
+            profile=args.profile, http_cache=cache
+        )
+        try:
+            print('searched', w.run())
+        finally:
+            w.close()
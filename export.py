@@ -0,0 +1,365 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import sqlite3
+import time
+from db_shards import read_shard_paths
+from parse_app_page import ParseAppStorePage
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def partition_name(category):
+    """
+    :param category:
+    :type category: str
+    :return: the category made safe to use as a directory name
+    :rtype: str
+    """
+    return re.sub(r'[^\w.-]+', '_', category or '') or '_'
+
+
+def parquet_schema():
+    """
+    :return: the schema of the exported apps, with the
+        languages, purchases and reviews nested in each
+    :rtype: pyarrow.Schema
+    """
+    types = dict(
+        price_value=pyarrow.float64(), size_bytes=pyarrow.int64(),
+        current_version_rating=pyarrow.float64(),
+        current_version_review_count=pyarrow.int64(),
+        all_versions_rating=pyarrow.float64(),
+        all_versions_review_count=pyarrow.int64(),
+    )
+    return pyarrow.schema(
+        [(x, types.get(x, pyarrow.string())) for x in ParseAppStorePage.main_table_columns]
+        + [
+            ('updated_at', pyarrow.float64()),
+            ('languages', pyarrow.list_(pyarrow.string())),
+            ('top_in_app_purchases', pyarrow.list_(pyarrow.struct([
+                ('order', pyarrow.int64()), ('title', pyarrow.string()),
+                ('price', pyarrow.string()), ('price_value', pyarrow.float64()),
+            ]))),
+            ('customer_reviews', pyarrow.list_(pyarrow.struct([
+                ('title', pyarrow.string()), ('rating', pyarrow.string()),
+                ('user', pyarrow.string()), ('content', pyarrow.string()),
+                ('rating_value', pyarrow.float64()),
+            ]))),
+        ]
+    )
+
+
+class NDJSONPartitionWriter:
+    extension = 'ndjson'
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, apps):
+        for app in apps:
+            self.file.write(json.dumps(app, ensure_ascii=False))
+            self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetPartitionWriter:
+    extension = 'parquet'
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise ValueError('parquet exports need `pip install pyarrow`')
+        self.schema = parquet_schema()
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, apps):
+        # each chunk becomes a row group
+        self.writer.write_table(pyarrow.Table.from_pylist(apps, self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+# noinspection SqlDialectInspection
+class AppExporter:
+
+    formats = {
+        'ndjson': NDJSONPartitionWriter,
+        'parquet': ParquetPartitionWriter,
+    }
+
+    def __init__(self, db='app_store_db', output='app_store_export',
+                 file_format='ndjson', chunk_size=500, slack=60.0):
+        """Exports every app with its languages, in app purchases
+        and reviews nested in it, one file per category under
+        output/category=<category>/, as NDJSON or Parquet. A
+        sharded db is exported a shard at a time.
+
+        Apps are read chunk_size at a time, so memory use doesn't
+        grow with the size of the db. Each export remembers the
+        latest updated_at it saw in each db or shard in
+        output/export_state.json, and the next one only exports
+        the apps updated since, into new files next to the old
+        ones.
+
+        updated_at is stamped when the row is written, not when
+        it's committed, so a write can commit with an updated_at
+        older than one an export already saw. The next export
+        looks back slack seconds past that, and skips the apps
+        in that window it already exported as they were.
+
+        :param db:
+        :type db: str
+        :param output: the directory to export to
+        :type output: str
+        :param file_format: ndjson or parquet
+        :type file_format: str
+        :param chunk_size:
+        :type chunk_size: int
+        :param slack: seconds a write can take to commit
+        :type slack: float
+        """
+        if file_format not in self.formats:
+            raise ValueError('unknown format {!r}'.format(file_format))
+        self.db = db
+        self.output = output
+        self.file_format = file_format
+        self.chunk_size = chunk_size
+        self.slack = slack
+        self.state_path = os.path.join(output, 'export_state.json')
+
+    def load_state(self):
+        """
+        :return: the name of each db or shard mapped to the
+            updated_at the last export got up to and the
+            [app id, updated_at] it exported in the slack
+            window before that
+        :rtype: dict
+        """
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            state = json.load(f).get(self.file_format, {})
+        if not isinstance(state, dict):
+            # from before the state was kept per shard
+            state = {os.path.basename(self.db): dict(updated_at=state, recent=[])}
+        return state
+
+    def save_state(self, state):
+        states = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                states = json.load(f)
+        states[self.file_format] = state
+        with open(self.state_path, 'w') as f:
+            json.dump(states, f)
+
+    @staticmethod
+    def fetch_children(cursor, app_ids):
+        """Reads the languages, purchases and reviews of a
+        chunk of apps.
+
+        :param cursor:
+        :type cursor: sqlite3.Cursor
+        :param app_ids:
+        :type app_ids: list
+        :return: app id mapped to its languages, purchases
+            and reviews
+        :rtype: dict
+        """
+        children = {
+            x: dict(languages=[], top_in_app_purchases=[], customer_reviews=[])
+            for x in app_ids
+        }
+        placeholders = ', '.join('?' * len(app_ids))
+        cursor.execute(
+            """
+            SELECT app_id, language FROM app_store_languages
+            WHERE app_id IN ({}) ORDER BY app_id, language
+            """.format(placeholders),
+            app_ids
+        )
+        for app_id, language in cursor:
+            children[app_id]['languages'].append(language)
+        cursor.execute(
+            """
+            SELECT app_id, "order", title, price, price_value
+            FROM app_store_top_in_app_purchases
+            WHERE app_id IN ({}) ORDER BY app_id, "order"
+            """.format(placeholders),
+            app_ids
+        )
+        for app_id, order, title, price, price_value in cursor:
+            children[app_id]['top_in_app_purchases'].append(dict(
+                order=order, title=title, price=price, price_value=price_value
+            ))
+        cursor.execute(
+            """
+            SELECT app_id, title, rating, user, content, rating_value
+            FROM app_store_customer_reviews
+            WHERE app_id IN ({}) ORDER BY app_id, review_id
+            """.format(placeholders),
+            app_ids
+        )
+        for app_id, title, rating, user, content, rating_value in cursor:
+            children[app_id]['customer_reviews'].append(dict(
+                title=title, rating=rating, user=user, content=content,
+                rating_value=rating_value
+            ))
+        return children
+
+    def iter_chunks(self, conn, since=None, exported=()):
+        """Yields the apps updated after since, a chunk at a
+        time, ordered by category.
+
+        :param conn:
+        :type conn: sqlite3.Connection
+        :param since:
+        :type since: float
+        :param exported: (app id, updated_at) of apps to skip,
+            since they were already exported as they are
+        :type exported: set
+        :return: lists of app dicts
+        :rtype: collections.Iterable[list]
+        """
+        columns = ParseAppStorePage.main_table_columns + ('updated_at',)
+        main_cursor = conn.cursor()
+        main_cursor.execute(
+            """
+            SELECT {} FROM app_store_main
+            WHERE updated_at > ?
+            ORDER BY category, rowid
+            """.format(', '.join(columns)),
+            (since if since is not None else -1,)
+        )
+        children_cursor = conn.cursor()
+        while 1:
+            rows = main_cursor.fetchmany(self.chunk_size)
+            if not rows:
+                return
+            apps = [dict(zip(columns, x)) for x in rows]
+            apps = [x for x in apps if (x['app_id'], x['updated_at']) not in exported]
+            if not apps:
+                continue
+            children = self.fetch_children(children_cursor, [x['app_id'] for x in apps])
+            for app in apps:
+                app.update(children[app['app_id']])
+            yield apps
+
+    def export_db(self, db, file_name, state, counts):
+        """Exports the apps of one db or shard.
+
+        :param db:
+        :type db: str
+        :param file_name: of the file to write in each category
+        :type file_name: str
+        :param state: the db's from load_state, or None to
+            export every app
+        :type state: dict
+        :param counts: the number of apps exported to each
+            category, added to
+        :type counts: dict
+        :return: the db's new state
+        :rtype: dict
+        """
+        writer_class = self.formats[self.file_format]
+        since = exported = None
+        if state is not None and state['updated_at'] is not None:
+            since = state['updated_at'] - self.slack
+            exported = {tuple(x) for x in state['recent']}
+        writer = None
+        category = None
+
+        conn = sqlite3.connect(db)
+        try:
+            # a read transaction, so the export sees the db
+            # as it was when it started
+            conn.execute('BEGIN')
+            latest = conn.execute('SELECT max(updated_at) FROM app_store_main').fetchone()[0]
+            for apps in self.iter_chunks(conn, since, exported or ()):
+                # a chunk can span categories, but each
+                # category is only ever in one run of chunks
+                for chunk_category, group in itertools.groupby(
+                        apps, lambda x: x['category']):
+                    group = list(group)
+                    if writer is None or chunk_category != category:
+                        if writer is not None:
+                            writer.close()
+                        category = chunk_category
+                        directory = os.path.join(
+                            self.output, 'category={}'.format(partition_name(category))
+                        )
+                        os.makedirs(directory, exist_ok=True)
+                        writer = writer_class(os.path.join(directory, file_name))
+                    writer.write(group)
+                    counts[category] = counts.get(category, 0) + len(group)
+            recent = []
+            if latest is not None:
+                recent = conn.execute(
+                    'SELECT app_id, updated_at FROM app_store_main WHERE updated_at > ?',
+                    (latest - self.slack,)
+                ).fetchall()
+        finally:
+            if writer is not None:
+                writer.close()
+            conn.close()
+        if latest is None and state is not None:
+            # nothing in the db yet
+            return state
+        return dict(updated_at=latest, recent=[list(x) for x in recent])
+
+    def export(self, full=False):
+        """Writes out the apps updated since the last export,
+        or every app if full is set.
+
+        :param full:
+        :type full: bool
+        :return: the number of apps exported to each category
+        :rtype: dict
+        """
+        state = self.load_state()
+        extension = self.formats[self.file_format].extension
+        # one name for every file this export writes, so they
+        # sort after the files from earlier exports
+        stamp = int(time.time() * 1000)
+        paths = read_shard_paths(self.db) or [self.db]
+        counts = {}
+        for shard, path in enumerate(paths):
+            if len(paths) > 1:
+                # each shard has apps in every category
+                file_name = 'part-{}-{}.{}'.format(stamp, shard, extension)
+            else:
+                file_name = 'part-{}.{}'.format(stamp, extension)
+            name = os.path.basename(path)
+            state[name] = self.export_db(
+                path, file_name, None if full else state.get(name), counts
+            )
+        os.makedirs(self.output, exist_ok=True)
+        self.save_state(state)
+        return counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Export the crawled apps, only the ones changed since '
+                    'the last export unless --full is given.'
+    )
+    parser.add_argument('output', nargs='?', default='app_store_export')
+    parser.add_argument('--db', default='app_store_db')
+    parser.add_argument('--format', default='ndjson', choices=sorted(AppExporter.formats))
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--slack', type=float, default=60.0)
+    parser.add_argument('--full', action='store_true')
+    args = parser.parse_args()
+    exporter = AppExporter(args.db, args.output, args.format, args.chunk_size, args.slack)
+    exported = exporter.export(args.full)
+    print('exported {} apps in {} categories'.format(sum(exported.values()), len(exported)))
@@ -0,0 +1,255 @@
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from url_dedup import app_id_from_url
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+# noinspection SqlDialectInspection
+class CrawlFrontier:
+
+    # both only touch urls still leased to the worker, so
+    # one whose lease ran out and went to someone else
+    # can't undo what the new owner does with it
+    complete_statement = """
+    UPDATE app_store_app_urls
+    SET state = 'done', lease_owner = NULL, lease_expires = NULL
+    WHERE url = ? AND state = 'leased' AND lease_owner = ?
+    """
+    # a url goes back to pending until it has
+    # used up all of its attempts
+    fail_statement = """
+    UPDATE app_store_app_urls
+    SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+        lease_owner = NULL, lease_expires = NULL, last_error = ?
+    WHERE url = ? AND state = 'leased' AND lease_owner = ?
+    """
+
+    def __init__(self, db='app_store_db', writer=None, lease_seconds=600,
+                 max_attempts=3, owner=None):
+        """The queue of app urls waiting to be crawled,
+        kept in the app_store_app_urls table.
+
+        Every url is pending, leased, done or failed. Workers
+        claim pending urls in batches, which leases them to the
+        worker for lease_seconds. If the worker doesn't complete
+        or fail a url before its lease runs out (i.e. it crashed),
+        the url goes back to pending for somebody else.
+
+        Claims happen in an immediate transaction, so several
+        processes or machines can share the same db without
+        fetching the same url twice.
+
+        :param db:
+        :type db: str
+        :param writer: if given, completes and fails are
+            queued on it instead of written straight away, so
+            they commit along with the page they belong to, or
+            just after it if the app tables are sharded
+        :type writer: db_writer.DBWriter
+        :param lease_seconds:
+        :type lease_seconds: float
+        :param max_attempts:
+        :type max_attempts: int
+        :param owner: identifies this worker in the leases
+        :type owner: str
+        """
+        self.db = db
+        self.writer = writer
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = owner or '{}:{}:{}'.format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]
+        )
+        self.conn = sqlite3.connect(
+            db, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute('PRAGMA journal_mode=WAL')
+
+    def add(self, urls, priority=0):
+        """Adds urls to the frontier as pending. Urls, or
+        apps, already in the frontier are left as they are.
+
+        :param urls:
+        :type urls: list
+        :param priority: higher priorities are claimed first
+        :type priority: int
+        """
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(
+                """
+                INSERT OR IGNORE INTO app_store_app_urls (url, app_id, priority)
+                VALUES (?, ?, ?)
+                """,
+                [(url, app_id_from_url(url), priority) for url in urls]
+            )
+
+    def claim(self, batch_size=10, owner=None):
+        """Leases up to batch_size pending urls to this
+        worker, highest priority first.
+
+        :param batch_size:
+        :type batch_size: int
+        :param owner: lease them to someone else instead,
+            i.e. a distributed.CrawlWorker
+        :type owner: str
+        :rtype: list
+        """
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # give urls from expired leases back to the queue
+            self.conn.execute(
+                """
+                UPDATE app_store_app_urls
+                SET state = 'pending', lease_owner = NULL, lease_expires = NULL
+                WHERE state = 'leased' AND lease_expires < ?
+                """,
+                (now,)
+            )
+            urls = [x[0] for x in self.conn.execute(
+                """
+                SELECT url FROM app_store_app_urls
+                WHERE state = 'pending'
+                ORDER BY priority DESC
+                LIMIT ?
+                """,
+                (batch_size,)
+            )]
+            self.conn.executemany(
+                """
+                UPDATE app_store_app_urls
+                SET state = 'leased', lease_owner = ?, lease_expires = ?,
+                    attempts = attempts + 1
+                WHERE url = ?
+                """,
+                [(owner or self.owner, now + self.lease_seconds, url) for url in urls]
+            )
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return urls
+
+    def iter_claims(self, batch_size=10):
+        """Yields urls until the frontier has no pending
+        ones left, claiming the next batch only once the
+        last one has been handed out.
+
+        :param batch_size:
+        :type batch_size: int
+        :rtype: collections.Iterable[str]
+        """
+        while 1:
+            urls = self.claim(batch_size)
+            if not urls and self.writer is not None:
+                # urls failed since the last claim only go back
+                # to pending once the writer commits them
+                self.writer.flush()
+                urls = self.claim(batch_size)
+            if not urls:
+                return
+            for url in urls:
+                yield url
+
+    def execute(self, statement, row, app_id=None):
+        if self.writer is not None and app_id is not None:
+            # after the app's own rows, see ShardedWriter.put_after
+            self.writer.put_after(app_id, statement, [row])
+        elif self.writer is not None:
+            self.writer.put(statement, [row])
+        else:
+            with self.conn:
+                self.conn.execute('BEGIN')
+                self.conn.execute(statement, row)
+
+    def complete(self, url, owner=None):
+        """Marks a url as done, if it's still leased to
+        this worker.
+
+        :param url:
+        :type url: str
+        :param owner: the worker it was leased to, if
+            not this one
+        :type owner: str
+        """
+        self.execute(
+            self.complete_statement, (url, owner or self.owner), app_id_from_url(url)
+        )
+
+    def fail(self, url, error, owner=None):
+        """Records a failed attempt at a url, if it's
+        still leased to this worker.
+
+        :param url:
+        :type url: str
+        :param error:
+        :type error: Exception
+        :param owner: the worker it was leased to, if
+            not this one
+        :type owner: str
+        """
+        self.execute(
+            self.fail_statement, (self.max_attempts, str(error), url, owner or self.owner)
+        )
+
+    def leased(self, urls, owner=None):
+        """
+        :param urls:
+        :type urls: list
+        :param owner: someone else's leases instead
+        :type owner: str
+        :return: the urls that are still leased to this worker
+        :rtype: set
+        """
+        leased = set()
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            leased.update(x[0] for x in self.conn.execute(
+                """
+                SELECT url FROM app_store_app_urls
+                WHERE url IN ({}) AND state = 'leased' AND lease_owner = ?
+                """.format(', '.join('?' * len(chunk))),
+                list(chunk) + [owner or self.owner]
+            ))
+        return leased
+
+    def release(self, owner=None):
+        """Puts every url still leased to this worker back to
+        pending, i.e. when shutting down before finishing.
+
+        :param owner: release someone else's urls instead
+        :type owner: str
+        """
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute(
+                """
+                UPDATE app_store_app_urls
+                SET state = 'pending', lease_owner = NULL, lease_expires = NULL,
+                    attempts = attempts - 1
+                WHERE state = 'leased' AND lease_owner = ?
+                """,
+                (owner or self.owner,)
+            )
+
+    def counts(self):
+        """
+        :return: the number of urls in each state
+        :rtype: dict
+        """
+        counts = dict.fromkeys((PENDING, LEASED, DONE, FAILED), 0)
+        counts.update(self.conn.execute(
+            'SELECT state, urls FROM app_store_url_counts'
+        ).fetchall())
+        return counts
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,249 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib import parse
+from metrics import registry
+from page_archive import compress, decompress, zstandard
+
+cache_lookups = registry.counter(
+    'app_store_http_cache_lookups_total', 'Http cache lookups, by outcome', ['outcome']
+)
+
+
+class OfflineCacheMiss(Exception):
+    """Raised when an offline HTTPCache is asked for a url
+    it doesn't have, instead of going to the network."""
+
+
+def normalize_url(url):
+    """Normalizes a url so the ways of writing the same one
+    share a cache entry, i.e. the scheme and host are made
+    lower case, the query params sorted and the fragment
+    dropped.
+
+    :param url:
+    :type url: str
+    :rtype: str
+    """
+    parts = parse.urlsplit(url)
+    netloc = parts.netloc.lower()
+    default_port = {'http': ':80', 'https': ':443'}.get(parts.scheme.lower())
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+    query = parse.urlencode(sorted(parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return parse.urlunsplit((parts.scheme.lower(), netloc, parts.path or '/', query, ''))
+
+
+# noinspection SqlDialectInspection
+class HTTPCache:
+    def __init__(self, path='app_store_http_cache', ttl=86400.0,
+                 max_bytes=1024 * 1024 * 1024, offline=False, codec=None,
+                 commit_every=100):
+        """An on disk cache of the pages the crawler fetches,
+        so reruns, i.e. after a crash, read them from disk
+        instead of downloading them again.
+
+        Entries are keyed by the normalized url. The bodies are
+        compressed and stored by the sha256 of their content in
+        the objects directory, so urls with the same body, i.e.
+        the empty pages past the end of a category, share one
+        file. The index is an sqlite db in the same directory.
+
+        Entries older than ttl are fetched again. Once the
+        bodies pass max_bytes, the least recently used
+        entries are evicted. An offline cache never goes to
+        the network: it serves entries however old they are
+        and raises OfflineCacheMiss for the rest.
+
+        :param path: the directory to keep the cache in
+        :type path: str
+        :param ttl: seconds an entry is served for
+        :type ttl: float
+        :param max_bytes: of compressed bodies
+        :type max_bytes: int
+        :param offline:
+        :type offline: bool
+        :param codec: zstd if the zstandard package is
+            installed, otherwise zlib
+        :type codec: str
+        :param commit_every: the last used times of hits are
+            committed after this many, and on every store
+        :type commit_every: int
+        """
+        if codec is None:
+            codec = 'zstd' if zstandard is not None else 'zlib'
+        if codec not in ('zlib', 'zstd'):
+            raise ValueError('unknown codec {!r}'.format(codec))
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError('the zstd codec needs `pip install zstandard`')
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.codec = codec
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        self.index = sqlite3.connect(
+            os.path.join(path, 'index'), check_same_thread=False
+        )
+        self.index.execute('PRAGMA journal_mode=WAL')
+        self.index.executescript("""
+        CREATE TABLE IF NOT EXISTS entries
+        (
+            url TEXT PRIMARY KEY,
+            digest TEXT,
+            codec TEXT,
+            size INTEGER,
+            stored REAL,
+            used REAL
+        );
+        CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+        CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+        """)
+        self.total_bytes = self.index.execute(
+            'SELECT coalesce(sum(size), 0) FROM (SELECT DISTINCT digest, size FROM entries)'
+        ).fetchone()[0]
+
+    def object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], digest)
+
+    def get(self, url):
+        """
+        :param url:
+        :type url: str
+        :return: the cached body, or None if it has to be fetched
+        :rtype: str
+        """
+        key = normalize_url(url)
+        with self.lock:
+            row = self.index.execute(
+                'SELECT digest, codec, stored FROM entries WHERE url = ?', (key,)
+            ).fetchone()
+            fresh = row is not None and (self.offline or row[2] + self.ttl > time.time())
+            if fresh:
+                self.index.execute(
+                    'UPDATE entries SET used = ? WHERE url = ?', (time.time(), key)
+                )
+                self.uncommitted += 1
+                if self.uncommitted >= self.commit_every:
+                    self.commit()
+        body = None
+        if fresh:
+            try:
+                with open(self.object_path(row[0]), 'rb') as f:
+                    body = decompress(f.read(), row[1]).decode('utf-8')
+            except FileNotFoundError:
+                # evicted by another thread in the meantime
+                pass
+        if body is None:
+            cache_lookups.inc('expired' if row is not None and not fresh else 'miss')
+            if self.offline:
+                raise OfflineCacheMiss(url)
+            return None
+        cache_lookups.inc('hit')
+        return body
+
+    def put(self, url, body):
+        """Stores a fetched body, replacing anything
+        cached for the url before.
+
+        :param url:
+        :type url: str
+        :param body:
+        :type body: str
+        """
+        data = body.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        data = compress(data, self.codec)
+        object_path = self.object_path(digest)
+        key = normalize_url(url)
+        now = time.time()
+        with self.lock:
+            shared = self.index.execute(
+                'SELECT codec, size FROM entries WHERE digest = ? LIMIT 1', (digest,)
+            ).fetchone()
+            if shared is not None:
+                # another url has the same body already
+                codec, size = shared
+            else:
+                codec, size = self.codec, len(data)
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                # written under another name first, so a crash
+                # never leaves half an object behind
+                temp_path = object_path + '.tmp'
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, object_path)
+                self.total_bytes += size
+            old = self.index.execute(
+                'SELECT digest, size FROM entries WHERE url = ?', (key,)
+            ).fetchone()
+            self.index.execute(
+                """
+                INSERT OR REPLACE INTO entries (url, digest, codec, size, stored, used)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (key, digest, codec, size, now, now)
+            )
+            if old is not None and old[0] != digest:
+                self.drop_object(*old)
+            self.evict()
+            self.commit()
+
+    def drop_object(self, digest, size):
+        """Deletes a body once no entry points at it.
+
+        :param digest:
+        :type digest: str
+        :param size: as it was counted in total_bytes
+        :type size: int
+        """
+        if self.index.execute(
+                'SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (digest,)).fetchone():
+            return
+        self.total_bytes -= size
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Drops the least recently used entries until
+        the bodies fit in max_bytes."""
+        while self.total_bytes > self.max_bytes:
+            rows = self.index.execute(
+                'SELECT url, digest, size FROM entries ORDER BY used LIMIT 100'
+            ).fetchall()
+            if not rows:
+                return
+            for url, digest, size in rows:
+                self.index.execute('DELETE FROM entries WHERE url = ?', (url,))
+                self.drop_object(digest, size)
+                if self.total_bytes <= self.max_bytes:
+                    return
+
+    def commit(self):
+        self.index.commit()
+        self.uncommitted = 0
+
+    def clear(self):
+        """Drops every entry."""
+        with self.lock:
+            for (digest,) in self.index.execute(
+                    'SELECT DISTINCT digest FROM entries').fetchall():
+                try:
+                    os.remove(self.object_path(digest))
+                except FileNotFoundError:
+                    pass
+            self.index.execute('DELETE FROM entries')
+            self.commit()
+            self.total_bytes = 0
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.index.close()
@@ -0,0 +1,377 @@
+import argparse
+import threading
+from datetime import datetime
+from urllib import parse
+from app_store_crawler import CrawlAppStore, parse_seconds
+from parse_app_page import ParseAppStorePage
+from url_dedup import app_id_from_url
+
+# the lookup api gives languages as ISO 639-1 codes,
+# these are the names the app pages use for them
+language_names = {
+    'AR': 'Arabic', 'CA': 'Catalan', 'CS': 'Czech', 'DA': 'Danish',
+    'DE': 'German', 'EL': 'Greek', 'EN': 'English', 'ES': 'Spanish',
+    'FI': 'Finnish', 'FR': 'French', 'HE': 'Hebrew', 'HI': 'Hindi',
+    'HR': 'Croatian', 'HU': 'Hungarian', 'ID': 'Indonesian', 'IT': 'Italian',
+    'JA': 'Japanese', 'KO': 'Korean', 'MS': 'Malay', 'NB': 'Norwegian Bokmål',
+    'NL': 'Dutch', 'PL': 'Polish', 'PT': 'Portuguese', 'RO': 'Romanian',
+    'RU': 'Russian', 'SK': 'Slovak', 'SV': 'Swedish', 'TH': 'Thai',
+    'TR': 'Turkish', 'UK': 'Ukrainian', 'VI': 'Vietnamese',
+}
+# codes the api gives once for each of several languages
+# the pages name apart. they're listed in the same place
+# as on the page, so the first ZH is the simplified one
+language_variants = {
+    'ZH': ('Simplified Chinese', 'Traditional Chinese'),
+}
+# the device families in the api's supportedDevices,
+# i.e. iPhone6-iPhone6, as the pages name them
+device_families = (('iPhone', 'iPhone'), ('iPad', 'iPad'), ('iPod', 'iPod touch'))
+
+# the backend that parses the same way, but
+# only builds the parts of the page it needs
+strained_backends = {'html.parser': 'strained', 'lxml': 'lxml-strained'}
+
+
+def parse_iso_date(value):
+    """
+    :param value: i.e. 2016-11-23T09:39:55Z
+    :type value: str
+    :rtype: datetime
+    """
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+
+
+def language_list(codes):
+    """Names the api's language codes the way the app
+    pages do, in the same order.
+
+    :param codes: i.e. ['EN', 'ZH', 'ES', 'ZH']
+    :type codes: list
+    :return: i.e. ['English', 'Simplified Chinese',
+        'Spanish', 'Traditional Chinese']
+    :rtype: list
+    """
+    languages = []
+    seen = {}
+    for code in codes:
+        n = seen[code] = seen.get(code, 0) + 1
+        variants = language_variants.get(code)
+        if variants is not None:
+            if n <= len(variants):
+                languages.append(variants[n - 1])
+        elif n == 1:
+            languages.append(language_names.get(code, code))
+    return languages
+
+
+def compatibility_text(minimum_os_version, supported_devices):
+    """Writes the compatibility line the app pages have.
+
+    :param minimum_os_version: i.e. 7.0
+    :type minimum_os_version: str
+    :param supported_devices: i.e. ['iPhone6-iPhone6']
+    :type supported_devices: list
+    :return: i.e. Requires iOS 7.0 or later. Compatible
+        with iPhone, iPad, and iPod touch.
+    :rtype: str
+    """
+    text = 'Requires iOS {} or later.'.format(minimum_os_version)
+    families = [
+        name for prefix, name in device_families
+        if any(x.startswith(prefix) for x in supported_devices)
+    ]
+    if len(families) > 2:
+        families = [', '.join(families[:-1]) + ',', families[-1]]
+    if families:
+        text += ' Compatible with {}.'.format(' and '.join(families))
+    return text
+
+
+# the lookup result key each of the lookup profile's
+# fields is made from
+lookup_keys = dict(
+    app_name='trackName', description='description', price='formattedPrice',
+    category='primaryGenreName', version='version', seller='sellerName',
+    languages='languageCodesISO2A', published_date='releaseDate',
+    last_updated_date='currentVersionReleaseDate', size='fileSizeBytes',
+    app_rating='trackContentRating', compatibility='minimumOsVersion',
+    current_version_rating_value='averageUserRatingForCurrentVersion',
+    current_version_rating_review_count='userRatingCountForCurrentVersion',
+    all_versions_rating_value='averageUserRating',
+    all_versions_rating_review_count='userRatingCount',
+)
+
+
+def lookup_result_fields(result):
+    """
+    :param result: one of the lookup response's results
+    :type result: dict
+    :return: the text fields parse_lookup_result fills in
+        from it, the only ones that should be written
+    :rtype: frozenset
+    """
+    return frozenset(['app_id'] + [
+        field for field, key in lookup_keys.items()
+        if result.get(key) not in (None, '', [])
+    ])
+
+
+def parse_lookup_result(result):
+    """Maps an app from the lookup api onto the fields
+    ParseAppStorePage.parse gives, in the same formats.
+    The api doesn't have the copyright, in app purchases
+    or reviews, so those are left empty.
+
+    :param result: one of the lookup response's results
+    :type result: dict
+    :return: an unnormalized output_dict, see
+        lookup_result_fields for the fields it fills in
+    :rtype: dict
+    """
+    output_dict = ParseAppStorePage('').output_dict
+    output_dict.update(
+        app_id=str(result['trackId']),
+        app_name=result.get('trackName', ''),
+        description=result.get('description', ''),
+        price=result.get('formattedPrice', ''),
+        category=result.get('primaryGenreName', ''),
+        version=result.get('version', ''),
+        seller=result.get('sellerName', ''),
+        languages=language_list(result.get('languageCodesISO2A', [])),
+    )
+    if result.get('releaseDate'):
+        published = parse_iso_date(result['releaseDate'])
+        output_dict['published_date'] = published.strftime('%Y-%m-%d %H:%M:%S Etc/GMT')
+    if result.get('currentVersionReleaseDate'):
+        updated = parse_iso_date(result['currentVersionReleaseDate'])
+        output_dict['last_updated_date'] = '{:%b} {}, {}'.format(
+            updated, updated.day, updated.year
+        )
+    if result.get('fileSizeBytes'):
+        # the app pages give the size in decimal megabytes
+        size_mb = int(result['fileSizeBytes']) / 1000000
+        output_dict['size'] = '{:.1f} MB'.format(size_mb).replace('.0 MB', ' MB')
+    if result.get('trackContentRating'):
+        output_dict['app_rating'] = 'Rated {}'.format(result['trackContentRating'])
+    if result.get('minimumOsVersion'):
+        output_dict['compatibility'] = compatibility_text(
+            result['minimumOsVersion'], result.get('supportedDevices', [])
+        )
+    for field, key in (
+            ('current_version_rating_value', 'averageUserRatingForCurrentVersion'),
+            ('current_version_rating_review_count', 'userRatingCountForCurrentVersion'),
+            ('all_versions_rating_value', 'averageUserRating'),
+            ('all_versions_rating_review_count', 'userRatingCount')):
+        if result.get(key) is not None:
+            output_dict[field] = str(result[key])
+    return output_dict
+
+
+class LookupCrawlAppStore(CrawlAppStore):
+
+    lookup_url = 'https://itunes.apple.com/lookup'
+
+    def __init__(self, pool_size=10, parser_backend='html.parser', lookup_url=None,
+                 country='us', batch_size=200,
+                 html_fields=(), archive=None, db_shards=None):
+        """Crawls apps through the iTunes lookup api, which gives
+        the details of up to 200 apps in one small json response,
+        instead of downloading and parsing a page per app.
+
+        The api doesn't have everything the app pages do, i.e.
+        the in app purchases, reviews and copyright. Any
+        html_fields are filled in from the app's page, so
+        those pages are fetched again, but only the parts of
+        them the fields are in get parsed. Apps the api
+        doesn't know about are scraped from their page as
+        usual.
+
+        :param pool_size:
+        :type pool_size: int
+        :param parser_backend: see ParseAppStorePage.backends
+        :type parser_backend: str
+        :param lookup_url: i.e. a StubAppStoreServer's /lookup
+        :type lookup_url: str
+        :param country: the store to look the apps up in
+        :type country: str
+        :param batch_size: apps per lookup, at most 200
+        :type batch_size: int
+        :param html_fields: output_dict text fields to take
+            from the app's page, i.e. ('customer_reviews',)
+        :type html_fields: tuple
+        :param archive: keeps the raw html if given
+        :type archive: page_archive.PageArchive
+        :param db_shards: split the app tables across this
+            many files if the db isn't sharded yet, see
+            db_shards.open_writer
+        :type db_shards: int
+        """
+        super().__init__(
+            pool_size=pool_size, parser_backend=parser_backend, archive=archive,
+            db_shards=db_shards
+        )
+        if lookup_url is not None:
+            self.lookup_url = lookup_url
+        self.country = country
+        self.batch_size = min(batch_size, 200)
+        self.html_fields = tuple(html_fields)
+        unknown = set(self.html_fields) - ParseAppStorePage.profiles['full']
+        if unknown:
+            raise ValueError('Unknown html fields: {}'.format(', '.join(sorted(unknown))))
+
+    def lookup(self, app_ids):
+        """
+        :param app_ids:
+        :type app_ids: list
+        :return: app id mapped to its lookup result, for the
+            apps the api found
+        :rtype: dict
+        """
+        url = '{}?{}'.format(self.lookup_url, parse.urlencode(dict(
+            id=','.join(str(x) for x in app_ids), country=self.country,
+            entity='software'
+        )))
+        r = self.get_response(url)
+        r.raise_for_status()
+        return {
+            str(x['trackId']): x for x in r.json().get('results', [])
+            if 'trackId' in x
+        }
+
+    def parse_html_fields(self, source):
+        """Parses just the html_fields out of an app page,
+        with the strained version of the parser backend so
+        the rest of the page isn't built either.
+
+        :param source:
+        :type source: str
+        :rtype: dict
+        """
+        backend = strained_backends.get(self.parser_backend, self.parser_backend)
+        with parse_seconds.time():
+            parsed = ParseAppStorePage(source, backend, fields=self.html_fields)
+            parsed.parse(normalize=False)
+        return parsed.output_dict
+
+    def write_lookup_result(self, url, result):
+        """Writes out an app from the lookup api, with the
+        html_fields filled in from its page. Only the fields
+        the result or the page filled in are written, so what
+        an earlier crawl of the app's page found for the
+        others, i.e. the copyright, is kept.
+
+        :param url:
+        :type url: str
+        :param result:
+        :type result: dict
+        """
+        output_dict = parse_lookup_result(result)
+        if self.html_fields:
+            source = self.get_request(url)
+            self.archive_page(url, source)
+            page_dict = self.parse_html_fields(source)
+            for field in self.html_fields:
+                output_dict[field] = page_dict[field]
+        parsed = ParseAppStorePage.from_output_dict(output_dict, 'lookup')
+        parsed.fields = lookup_result_fields(result) | frozenset(self.html_fields)
+        parsed.normalize()
+        if result.get('fileSizeBytes'):
+            output_dict['size_bytes'] = int(result['fileSizeBytes'])
+        parsed.write_out(self.writer)
+
+    def search_app(self, url, result):
+        """Search a single app, from its lookup result if there's
+        one or else from its page.
+
+        :param url:
+        :type url: str
+        :param result:
+        :type result: dict
+        """
+        try:
+            if result is None:
+                self.scrape_app_page(url)
+            else:
+                self.write_lookup_result(url, result)
+            self.remove_searched_url(url)
+        except Exception as e:
+            self.fail_searched_url(url, e)
+        finally:
+            self.search_semaphore.release()
+
+    def search_batch(self, urls):
+        """Looks up a batch of urls in one request, then
+        writes out each app on its own thread.
+
+        :param urls:
+        :type urls: list
+        """
+        app_ids = [app_id_from_url(x) for x in urls]
+        try:
+            results = self.lookup([x for x in app_ids if x is not None])
+        except Exception as e:
+            for url in urls:
+                self.fail_searched_url(url, e)
+            return
+        for url, app_id in zip(urls, app_ids):
+            self.search_semaphore.acquire()
+            result = results.get(str(app_id))
+            if result is not None and not self.html_fields:
+                # nothing more to fetch, so no need for a thread
+                self.search_app(url, result)
+                continue
+            threading.Thread(
+                target=self.search_app, daemon=1, args=(url, result)
+            ).start()
+
+    def crawl_app_pages(self, url_list):
+        """Given a list of urls, looks them up batch_size
+        at a time and writes them out.
+
+        :param url_list:
+        :type url_list: list
+        """
+        batch = []
+        for url in url_list:
+            batch.append(url)
+            if len(batch) >= self.batch_size:
+                self.search_batch(batch)
+                batch = []
+        if batch:
+            self.search_batch(batch)
+        # wait for the last apps to finish and
+        # for their rows to be committed
+        for _ in range(self.pool_size):
+            self.search_semaphore.acquire()
+        for _ in range(self.pool_size):
+            self.search_semaphore.release()
+        self.writer.flush()
+
+    def crawl_app_pages_from_db(self, batch_size=None):
+        """Claim urls from the frontier a lookup's worth at
+        a time and search them until there are none left.
+
+        :param batch_size: defaults to self.batch_size
+        :type batch_size: int
+        """
+        super().crawl_app_pages_from_db(batch_size or self.batch_size)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Crawl the apps in the frontier through the iTunes lookup api.'
+    )
+    parser.add_argument(
+        '--html-fields', nargs='*', default=[], metavar='FIELD',
+        help='fields to fill in from each app\'s page as well, i.e. top_in_app_purchases '
+             'customer_reviews copyright. The api has none of those, so by default the '
+             'pages aren\'t fetched and in app purchases, reviews and the copyright '
+             'aren\'t collected.'
+    )
+    parser.add_argument('--batch-size', type=int, default=200)
+    args = parser.parse_args()
+    c = LookupCrawlAppStore(batch_size=args.batch_size, html_fields=args.html_fields)
+    c.crawl_app_pages_from_db()
+    c.close()
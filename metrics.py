@@ -0,0 +1,412 @@
+import bisect
+import collections
+import cProfile
+import contextlib
+import os
+import pstats
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, from a fast parse to a slow request
+default_buckets = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        )
+        for name, value in pairs
+    ) + '}'
+
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        """A number that only goes up, i.e. requests sent.
+
+        :param name:
+        :type name: str
+        :param description:
+        :type description: str
+        :param labels: names of the labels the count is split by
+        :type labels: tuple
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = collections.defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] += amount
+
+    def value(self, *label_values):
+        with self.lock:
+            return self.values.get(label_values, 0)
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} counter'.format(self.name),
+        ]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append('{}{} {}'.format(
+                    self.name, format_labels(self.labels, label_values), value
+                ))
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, description, labels=(), function=None):
+        """A number that goes up and down, i.e. a queue's depth.
+
+        Either set it, or give a function that's called to
+        read it every time the metrics are rendered. With
+        labels, the function returns a dict of label value
+        tuples to numbers.
+
+        :param name:
+        :type name: str
+        :param description:
+        :type description: str
+        :param labels:
+        :type labels: tuple
+        :param function:
+        :type function: collections.Callable
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def read(self):
+        if self.function is None:
+            with self.lock:
+                return dict(self.values)
+        try:
+            value = self.function()
+        except Exception as e:
+            print(e)
+            return {}
+        if self.labels:
+            return value
+        return {(): value}
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} gauge'.format(self.name),
+        ]
+        for label_values, value in sorted(self.read().items()):
+            lines.append('{}{} {}'.format(
+                self.name, format_labels(self.labels, label_values), value
+            ))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=default_buckets):
+        """Counts observations, i.e. request times, into buckets
+        so their distribution can be graphed and percentiles
+        estimated.
+
+        :param name:
+        :type name: str
+        :param description:
+        :type description: str
+        :param labels:
+        :type labels: tuple
+        :param buckets: the upper bound of each bucket
+        :type buckets: tuple
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket plus +Inf, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if label_values not in self.values:
+                self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = self.values[label_values]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        """Observes how long the with block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values):
+        with self.lock:
+            return self.values.get(label_values, [None, 0.0, 0])[2]
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} histogram'.format(self.name),
+        ]
+        with self.lock:
+            values = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in self.values.items())
+        for label_values, (bucket_counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), bucket_counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(self.labels, label_values, [('le', bound)]),
+                    cumulative
+                ))
+            labels = format_labels(self.labels, label_values)
+            lines.append('{}_sum{} {}'.format(self.name, labels, total))
+            lines.append('{}_count{} {}'.format(self.name, labels, count))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Holds metrics by name and renders them in the
+        Prometheus text format."""
+        self.metrics = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, metric, replace=False):
+        with self.lock:
+            if replace or metric.name not in self.metrics:
+                self.metrics[metric.name] = metric
+            return self.metrics[metric.name]
+
+    def counter(self, name, description, labels=()):
+        """
+        :return: the counter with the name, made if
+            there isn't one yet
+        :rtype: Counter
+        """
+        return self.add(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=default_buckets):
+        """
+        :return: the histogram with the name, made if
+            there isn't one yet
+        :rtype: Histogram
+        """
+        return self.add(Histogram(name, description, labels, buckets))
+
+    def gauge(self, name, description, labels=(), function=None):
+        """A gauge given a function replaces any gauge with the
+        same name, so the latest crawler is the one reported.
+
+        :rtype: Gauge
+        """
+        return self.add(
+            Gauge(name, description, labels, function), replace=function is not None
+        )
+
+    def remove(self, name):
+        with self.lock:
+            self.metrics.pop(name, None)
+
+    def render(self):
+        """
+        :return: every metric in the Prometheus text format
+        :rtype: str
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# the registry the crawler's metrics are kept in
+registry = MetricsRegistry()
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class TimedLock:
+    def __init__(self, histogram):
+        """A lock that records how long it's waited for.
+
+        :param histogram:
+        :type histogram: Histogram
+        """
+        self.lock = threading.Lock()
+        self.histogram = histogram
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        self.histogram.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def start_metrics_server(port=9100, metrics_registry=None):
+    """Serves the metrics on http://localhost:port/metrics
+    from a background thread, for crawlers that aren't run
+    in the same process as the visualization.
+
+    :param port:
+    :type port: int
+    :param metrics_registry: defaults to registry
+    :type metrics_registry: MetricsRegistry
+    :rtype: ThreadingHTTPServer
+    """
+    metrics_registry = metrics_registry or registry
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics_registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=1).start()
+    return server
+
+
+@contextlib.contextmanager
+def profiled(path=None, sort='cumulative', limit=30):
+    """Runs the with block under cProfile, then prints the
+    top functions and, if path is given, saves the stats
+    there for snakeviz or pstats.
+
+    cProfile only sees the thread it's started in, so for
+    the crawler's threads use SamplingProfiler instead.
+
+    :param path:
+    :type path: str
+    :param sort:
+    :type sort: str
+    :param limit: the number of functions to print
+    :type limit: int
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        pstats.Stats(profiler).sort_stats(sort).print_stats(limit)
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.01):
+        """Looks at what every thread is doing every interval
+        seconds and counts the stacks it sees. Cheap enough to
+        leave on during a real crawl, and it sees all threads.
+
+        Use it as a context manager, then print report() or
+        save() the stacks in the collapsed format flamegraph.pl
+        and speedscope read.
+
+        :param interval:
+        :type interval: float
+        """
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.running = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        me = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            names = []
+            while frame is not None:
+                names.append('{}:{}'.format(
+                    os.path.basename(frame.f_code.co_filename), frame.f_code.co_name
+                ))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+        self.samples += 1
+
+    def run(self):
+        while self.running.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, daemon=1)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running.clear()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def report(self, limit=20):
+        """
+        :param limit:
+        :type limit: int
+        :return: the functions seen on top of a stack most
+            often, and the share of samples they were seen in
+        :rtype: list
+        """
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(leaf, count / total) for leaf, count in leaves.most_common(limit)]
+
+    def save(self, path):
+        """Writes the stacks out in the collapsed format.
+
+        :param path:
+        :type path: str
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
@@ -0,0 +1,892 @@
+import sqlite3
+from parse_app_page import ParseAppStorePage
+from url_dedup import app_id_from_url
+
+
+# noinspection SqlDialectInspection
+def migration_1(conn):
+    """The original schema, see create table statements.sql"""
+    execute_script(conn, """
+    CREATE TABLE IF NOT EXISTS app_store_app_urls
+    (
+        url TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS app_store_crawl_categories_prog
+    (
+        url TEXT,
+        page TEXT,
+        letter TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS app_store_customer_reviews
+    (
+        app_id TEXT,
+        title TEXT,
+        rating TEXT,
+        user TEXT,
+        content TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS app_store_languages
+    (
+        app_id TEXT,
+        language TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS app_store_main
+    (
+        app_id TEXT,
+        app_name TEXT,
+        description TEXT,
+        price TEXT,
+        category TEXT,
+        published_date TEXT,
+        last_updated_date TEXT,
+        version TEXT,
+        size TEXT,
+        seller TEXT,
+        copyright TEXT,
+        app_rating TEXT,
+        compatibility TEXT,
+        current_version_rating_value TEXT,
+        current_version_rating_review_count TEXT,
+        all_versions_rating_value TEXT,
+        all_versions_rating_review_count TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS app_store_top_in_app_purchases
+    (
+        app_id TEXT,
+        "order" TEXT,
+        title TEXT,
+        price TEXT
+    );
+    """)
+
+
+# noinspection SqlDialectInspection
+def migration_2(conn):
+    """Adds primary keys, indexes and typed numeric columns.
+
+    Duplicate rows left behind by re-crawls are dropped,
+    keeping the most recently inserted one, and the typed
+    columns are filled in for the rows already there.
+    """
+    execute_script(conn, """
+    DELETE FROM app_store_app_urls WHERE rowid NOT IN (
+        SELECT max(rowid) FROM app_store_app_urls GROUP BY url
+    );
+    CREATE UNIQUE INDEX app_store_app_urls_url
+        ON app_store_app_urls (url);
+
+    DELETE FROM app_store_crawl_categories_prog WHERE rowid NOT IN (
+        SELECT max(rowid) FROM app_store_crawl_categories_prog GROUP BY url
+    );
+    CREATE UNIQUE INDEX app_store_crawl_categories_prog_url
+        ON app_store_crawl_categories_prog (url);
+
+    DELETE FROM app_store_languages WHERE rowid NOT IN (
+        SELECT max(rowid) FROM app_store_languages GROUP BY app_id, language
+    );
+    CREATE UNIQUE INDEX app_store_languages_app_id
+        ON app_store_languages (app_id, language);
+
+    CREATE TABLE app_store_main_new
+    (
+        app_id TEXT PRIMARY KEY,
+        app_name TEXT,
+        description TEXT,
+        price TEXT,
+        category TEXT,
+        published_date TEXT,
+        last_updated_date TEXT,
+        version TEXT,
+        size TEXT,
+        seller TEXT,
+        copyright TEXT,
+        app_rating TEXT,
+        compatibility TEXT,
+        current_version_rating_value TEXT,
+        current_version_rating_review_count TEXT,
+        all_versions_rating_value TEXT,
+        all_versions_rating_review_count TEXT,
+        price_value REAL,
+        size_bytes INTEGER,
+        current_version_rating REAL,
+        current_version_review_count INTEGER,
+        all_versions_rating REAL,
+        all_versions_review_count INTEGER
+    );
+    INSERT OR REPLACE INTO app_store_main_new (
+        app_id, app_name, description, price, category, published_date,
+        last_updated_date, version, size, seller, copyright, app_rating,
+        compatibility, current_version_rating_value,
+        current_version_rating_review_count, all_versions_rating_value,
+        all_versions_rating_review_count
+    )
+    SELECT * FROM app_store_main ORDER BY rowid;
+    DROP TABLE app_store_main;
+    ALTER TABLE app_store_main_new RENAME TO app_store_main;
+    CREATE INDEX app_store_main_category ON app_store_main (category);
+    CREATE INDEX app_store_main_seller ON app_store_main (seller);
+
+    CREATE TABLE app_store_top_in_app_purchases_new
+    (
+        app_id TEXT,
+        "order" INTEGER,
+        title TEXT,
+        price TEXT,
+        price_value REAL,
+        PRIMARY KEY (app_id, "order")
+    );
+    INSERT OR REPLACE INTO app_store_top_in_app_purchases_new (
+        app_id, "order", title, price
+    )
+    SELECT app_id, CAST("order" AS INTEGER), title, price
+    FROM app_store_top_in_app_purchases ORDER BY rowid;
+    DROP TABLE app_store_top_in_app_purchases;
+    ALTER TABLE app_store_top_in_app_purchases_new
+        RENAME TO app_store_top_in_app_purchases;
+
+    CREATE TABLE app_store_customer_reviews_new
+    (
+        app_id TEXT,
+        title TEXT,
+        rating TEXT,
+        user TEXT,
+        content TEXT,
+        rating_value REAL,
+        review_id INTEGER PRIMARY KEY
+    );
+    INSERT INTO app_store_customer_reviews_new (
+        app_id, title, rating, user, content
+    )
+    SELECT app_id, title, rating, user, content
+    FROM app_store_customer_reviews WHERE rowid IN (
+        SELECT max(rowid) FROM app_store_customer_reviews
+        GROUP BY app_id, user, title
+    ) ORDER BY rowid;
+    DROP TABLE app_store_customer_reviews;
+    ALTER TABLE app_store_customer_reviews_new
+        RENAME TO app_store_customer_reviews;
+    CREATE UNIQUE INDEX app_store_customer_reviews_app_id
+        ON app_store_customer_reviews (app_id, user, title);
+    """)
+
+    # fill in the typed columns with the same
+    # normalizing the parser does
+    p = ParseAppStorePage
+    main_rows = conn.execute("""
+    SELECT app_id, price, size, current_version_rating_value,
+        current_version_rating_review_count, all_versions_rating_value,
+        all_versions_rating_review_count
+    FROM app_store_main
+    """).fetchall()
+    conn.executemany(
+        """
+        UPDATE app_store_main SET
+            price_value = ?, size_bytes = ?,
+            current_version_rating = ?, current_version_review_count = ?,
+            all_versions_rating = ?, all_versions_review_count = ?
+        WHERE app_id = ?
+        """,
+        [
+            (
+                p.parse_price(price), p.parse_size(size),
+                p.parse_number(current_rating, float),
+                p.parse_number(current_count, int),
+                p.parse_number(all_rating, float),
+                p.parse_number(all_count, int),
+                app_id
+            )
+            for (app_id, price, size, current_rating, current_count,
+                 all_rating, all_count) in main_rows
+        ]
+    )
+    purchase_rows = conn.execute("""
+    SELECT app_id, "order", price FROM app_store_top_in_app_purchases
+    """).fetchall()
+    conn.executemany(
+        """
+        UPDATE app_store_top_in_app_purchases SET price_value = ?
+        WHERE app_id = ? AND "order" = ?
+        """,
+        [(p.parse_price(price), app_id, order) for app_id, order, price in purchase_rows]
+    )
+    conn.execute("""
+    UPDATE app_store_customer_reviews SET rating_value = CAST(rating AS REAL)
+    WHERE rating != ''
+    """)
+
+
+# noinspection SqlDialectInspection
+def migration_3(conn):
+    """Turns app_store_app_urls into a crawl frontier,
+    see frontier.py"""
+    execute_script(conn, """
+    ALTER TABLE app_store_app_urls
+        ADD COLUMN state TEXT NOT NULL DEFAULT 'pending';
+    ALTER TABLE app_store_app_urls
+        ADD COLUMN priority INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE app_store_app_urls
+        ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE app_store_app_urls ADD COLUMN lease_owner TEXT;
+    ALTER TABLE app_store_app_urls ADD COLUMN lease_expires REAL;
+    ALTER TABLE app_store_app_urls ADD COLUMN last_error TEXT;
+    CREATE INDEX app_store_app_urls_claim
+        ON app_store_app_urls (state, priority DESC);
+    CREATE INDEX app_store_app_urls_lease
+        ON app_store_app_urls (state, lease_expires);
+    """)
+
+
+# noinspection SqlDialectInspection
+def migration_4(conn):
+    """Adds app_store_search, an FTS5 index over the app name,
+    seller, category and description in app_store_main.
+
+    The index doesn't keep its own copy of the text, it points
+    at app_store_main rows by rowid, and triggers keep it in
+    sync with every insert, update and delete. VACUUM can renumber
+    those rowids, so after a VACUUM rebuild the index with:
+
+        INSERT INTO app_store_search(app_store_search) VALUES ('rebuild');
+    """
+    execute_script(conn, """
+    CREATE VIRTUAL TABLE app_store_search USING fts5(
+        app_name, seller, category, description,
+        content='app_store_main', content_rowid='rowid'
+    );
+
+    CREATE TRIGGER app_store_search_insert AFTER INSERT ON app_store_main
+    BEGIN
+        INSERT INTO app_store_search (rowid, app_name, seller, category, description)
+        VALUES (new.rowid, new.app_name, new.seller, new.category, new.description);
+    END;
+
+    CREATE TRIGGER app_store_search_delete AFTER DELETE ON app_store_main
+    BEGIN
+        INSERT INTO app_store_search (
+            app_store_search, rowid, app_name, seller, category, description
+        )
+        VALUES ('delete', old.rowid, old.app_name, old.seller, old.category,
+                old.description);
+    END;
+
+    CREATE TRIGGER app_store_search_update
+    AFTER UPDATE OF app_name, seller, category, description ON app_store_main
+    BEGIN
+        INSERT INTO app_store_search (
+            app_store_search, rowid, app_name, seller, category, description
+        )
+        VALUES ('delete', old.rowid, old.app_name, old.seller, old.category,
+                old.description);
+        INSERT INTO app_store_search (rowid, app_name, seller, category, description)
+        VALUES (new.rowid, new.app_name, new.seller, new.category, new.description);
+    END;
+
+    INSERT INTO app_store_search (app_store_search) VALUES ('rebuild');
+    """)
+
+
+# noinspection SqlDialectInspection
+def migration_5(conn):
+    """Adds the tables used to refresh apps that have
+    already been crawled, see refresh.py"""
+    execute_script(conn, """
+    CREATE TABLE app_store_page_state
+    (
+        url TEXT PRIMARY KEY,
+        app_id TEXT,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT,
+        fetched REAL,
+        changed REAL
+    );
+    CREATE INDEX app_store_page_state_app_id ON app_store_page_state (app_id);
+
+    CREATE TABLE app_store_app_history
+    (
+        history_id INTEGER PRIMARY KEY,
+        app_id TEXT,
+        field TEXT,
+        old_value TEXT,
+        new_value TEXT,
+        changed REAL
+    );
+    CREATE INDEX app_store_app_history_app_id
+        ON app_store_app_history (app_id, changed);
+    """)
+
+
+# noinspection SqlDialectInspection
+def migration_6(conn):
+    """Adds the per (genre, letter) checkpoints used by
+    CrawlAppStore.crawl_categories"""
+    execute_script(conn, """
+    CREATE TABLE app_store_crawl_shards
+    (
+        genre_url TEXT,
+        letter TEXT,
+        page INTEGER NOT NULL DEFAULT 1,
+        done INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (genre_url, letter)
+    );
+    """)
+
+
+# noinspection SqlDialectInspection
+def migration_7(conn):
+    """Adds the numeric app id to app_store_app_urls and keeps
+    only one url per app, preferring one that's been crawled."""
+    conn.execute('ALTER TABLE app_store_app_urls ADD COLUMN app_id INTEGER')
+    urls = conn.execute('SELECT rowid, url FROM app_store_app_urls').fetchall()
+    conn.executemany(
+        'UPDATE app_store_app_urls SET app_id = ? WHERE rowid = ?',
+        [(app_id_from_url(url), rowid) for rowid, url in urls]
+    )
+    execute_script(conn, """
+    DELETE FROM app_store_app_urls WHERE rowid IN (
+        SELECT rowid FROM (
+            SELECT rowid, row_number() OVER (
+                PARTITION BY app_id ORDER BY state = 'done' DESC, rowid
+            ) AS n
+            FROM app_store_app_urls WHERE app_id IS NOT NULL
+        ) WHERE n > 1
+    );
+    CREATE UNIQUE INDEX app_store_app_urls_app_id
+        ON app_store_app_urls (app_id);
+    """)
+
+
+# noinspection SqlDialectInspection
+def migration_8(conn):
+    """Adds updated_at to app_store_main, the time in
+    seconds since the epoch an app's row last changed, so
+    exports can pick up only what changed since last time
+    (see export.py). Triggers keep it up to date. Rows
+    already there count as updated now."""
+    execute_script(conn, """
+    ALTER TABLE app_store_main ADD COLUMN updated_at REAL;
+    UPDATE app_store_main SET updated_at = (julianday('now') - 2440587.5) * 86400.0;
+    CREATE INDEX app_store_main_updated_at ON app_store_main (updated_at);
+
+    CREATE TRIGGER app_store_main_inserted AFTER INSERT ON app_store_main
+    BEGIN
+        UPDATE app_store_main
+        SET updated_at = (julianday('now') - 2440587.5) * 86400.0
+        WHERE rowid = new.rowid;
+    END;
+
+    CREATE TRIGGER app_store_main_updated AFTER UPDATE ON app_store_main
+    WHEN new.updated_at IS old.updated_at
+    BEGIN
+        UPDATE app_store_main
+        SET updated_at = (julianday('now') - 2440587.5) * 86400.0
+        WHERE rowid = new.rowid;
+    END;
+    """)
+
+
+# the groups apps are rolled up by, mapped to their column
+rollup_dimensions = dict(category='category', seller='seller')
+# apps are counted in the price bucket of the lowest of
+# these prices above theirs, 0 is free and 100 is 50 or more
+price_bucket = """CASE WHEN {0} = 0 THEN 0 WHEN {0} < 1 THEN 1 WHEN {0} < 2 THEN 2
+    WHEN {0} < 5 THEN 5 WHEN {0} < 10 THEN 10 WHEN {0} < 20 THEN 20
+    WHEN {0} < 50 THEN 50 ELSE 100 END"""
+# ratings are counted in half star buckets
+rating_bucket = 'CAST({0} * 2 AS INTEGER) / 2.0'
+
+
+def rollup_app_statements(row, sign):
+    """The statements that add an app_store_main row
+    to the rollups, or take it out of them.
+
+    :param row: new or old
+    :type row: str
+    :param sign: 1 to add, -1 to take out
+    :type sign: int
+    :rtype: str
+    """
+    statements = []
+    for dimension, column in rollup_dimensions.items():
+        name = "coalesce({}.{}, '')".format(row, column)
+        values = dict(
+            row=row, dimension=dimension, name=name, sign=sign,
+            rating_bucket=rating_bucket.format(row + '.all_versions_rating'),
+            price_bucket=price_bucket.format(row + '.price_value'),
+        )
+        statements.append("""
+        INSERT INTO app_store_rollup_summary (
+            dimension, name, apps, rated_apps, rating_sum,
+            review_count_sum, paid_apps, price_sum
+        )
+        VALUES (
+            '{dimension}', {name}, {sign},
+            {sign} * ({row}.all_versions_rating IS NOT NULL),
+            {sign} * coalesce({row}.all_versions_rating, 0),
+            {sign} * coalesce({row}.all_versions_review_count, 0),
+            {sign} * (coalesce({row}.price_value, 0) > 0),
+            {sign} * coalesce({row}.price_value, 0)
+        )
+        ON CONFLICT (dimension, name) DO UPDATE SET
+            apps = apps + excluded.apps,
+            rated_apps = rated_apps + excluded.rated_apps,
+            rating_sum = rating_sum + excluded.rating_sum,
+            review_count_sum = review_count_sum + excluded.review_count_sum,
+            paid_apps = paid_apps + excluded.paid_apps,
+            price_sum = price_sum + excluded.price_sum;
+
+        INSERT INTO app_store_rollup_ratings (dimension, name, bucket, apps)
+        SELECT '{dimension}', {name}, {rating_bucket}, {sign}
+        WHERE {row}.all_versions_rating IS NOT NULL
+        ON CONFLICT (dimension, name, bucket) DO UPDATE SET apps = apps + excluded.apps;
+
+        INSERT INTO app_store_rollup_prices (dimension, name, bucket, apps)
+        SELECT '{dimension}', {name}, {price_bucket}, {sign}
+        WHERE {row}.price_value IS NOT NULL
+        ON CONFLICT (dimension, name, bucket) DO UPDATE SET apps = apps + excluded.apps;
+        """.format(**values))
+    return ''.join(statements)
+
+
+def rollup_language_statements(row, language, sign):
+    """The statements that add languages to the rollups
+    of their app's category and seller, or take them out.
+
+    :param row: new or old, the app_store_main row to take the
+        app's category and seller from, or None to look them up
+        by the app id of the language row, new.app_id or old.app_id
+    :type row: str
+    :param language: new.language or old.language, or None for
+        all of the app's languages
+    :type language: str
+    :param sign: 1 to add, -1 to take out
+    :type sign: int
+    :rtype: str
+    """
+    statements = []
+    for dimension, column in rollup_dimensions.items():
+        if language is None:
+            name = '{}.{}'.format(row, column)
+            source = 'FROM app_store_languages WHERE app_id = {}.app_id'.format(row)
+        else:
+            name = column
+            source = 'FROM app_store_main WHERE app_id = {}'.format(
+                language.replace('.language', '.app_id')
+            )
+        statements.append("""
+        INSERT INTO app_store_rollup_languages (dimension, name, language, apps)
+        SELECT '{dimension}', coalesce({name}, ''), {language}, {sign}
+        {source}
+        ON CONFLICT (dimension, name, language) DO UPDATE SET apps = apps + excluded.apps;
+        """.format(dimension=dimension, name=name, language=language or 'language',
+                   sign=sign, source=source))
+    return ''.join(statements)
+
+
+# noinspection SqlDialectInspection
+def migration_9(conn):
+    """Adds rollup tables summing up apps by category
+    and seller, kept up to date by triggers as the crawler
+    writes, so the dashboards never scan the main tables.
+
+    Every rollup is keyed by dimension (category or seller)
+    and name. Reviews are counted by the month they were first
+    stored in, since the pages don't date them, and stay with
+    the category and seller the app had then.
+
+    An app's languages and reviews can be in the db before
+    its main row, i.e. written by hand or by an older writer
+    that didn't keep an app's rows together, so inserting an
+    app also counts the languages and reviews it already has.
+    """
+    execute_script(conn, """
+    CREATE TABLE app_store_rollup_summary
+    (
+        dimension TEXT,
+        name TEXT,
+        apps INTEGER NOT NULL DEFAULT 0,
+        rated_apps INTEGER NOT NULL DEFAULT 0,
+        rating_sum REAL NOT NULL DEFAULT 0,
+        review_count_sum INTEGER NOT NULL DEFAULT 0,
+        paid_apps INTEGER NOT NULL DEFAULT 0,
+        price_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, name)
+    );
+    CREATE TABLE app_store_rollup_ratings
+    (
+        dimension TEXT,
+        name TEXT,
+        bucket REAL,
+        apps INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, name, bucket)
+    );
+    CREATE TABLE app_store_rollup_prices
+    (
+        dimension TEXT,
+        name TEXT,
+        bucket REAL,
+        apps INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, name, bucket)
+    );
+    CREATE TABLE app_store_rollup_languages
+    (
+        dimension TEXT,
+        name TEXT,
+        language TEXT,
+        apps INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, name, language)
+    );
+    CREATE TABLE app_store_rollup_reviews
+    (
+        dimension TEXT,
+        name TEXT,
+        month TEXT,
+        reviews INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, name, month)
+    );
+    """)
+
+    # fill them in from what's already there
+    for dimension, column in rollup_dimensions.items():
+        name = "coalesce({}, '')".format(column)
+        execute_script(conn, """
+        INSERT INTO app_store_rollup_summary
+        SELECT '{dimension}', {name}, count(*),
+            count(all_versions_rating), coalesce(sum(all_versions_rating), 0),
+            coalesce(sum(all_versions_review_count), 0),
+            sum(coalesce(price_value, 0) > 0), coalesce(sum(price_value), 0)
+        FROM app_store_main GROUP BY {name};
+
+        INSERT INTO app_store_rollup_ratings
+        SELECT '{dimension}', {name}, {rating_bucket} AS bucket, count(*)
+        FROM app_store_main WHERE all_versions_rating IS NOT NULL
+        GROUP BY {name}, bucket;
+
+        INSERT INTO app_store_rollup_prices
+        SELECT '{dimension}', {name}, {price_bucket} AS bucket, count(*)
+        FROM app_store_main WHERE price_value IS NOT NULL
+        GROUP BY {name}, bucket;
+
+        INSERT INTO app_store_rollup_languages
+        SELECT '{dimension}', coalesce(app_store_main.{column}, ''),
+            app_store_languages.language, count(*)
+        FROM app_store_languages JOIN app_store_main
+            ON app_store_main.app_id = app_store_languages.app_id
+        GROUP BY 2, 3;
+
+        INSERT INTO app_store_rollup_reviews
+        SELECT '{dimension}', coalesce(app_store_main.{column}, ''),
+            strftime('%Y-%m', 'now'), count(*)
+        FROM app_store_customer_reviews JOIN app_store_main
+            ON app_store_main.app_id = app_store_customer_reviews.app_id
+        GROUP BY 2;
+        """.format(
+            dimension=dimension, column=column, name=name,
+            rating_bucket=rating_bucket.format('all_versions_rating'),
+            price_bucket=price_bucket.format('price_value'),
+        ))
+
+    review_statements = ''.join("""
+        INSERT INTO app_store_rollup_reviews (dimension, name, month, reviews)
+        SELECT '{0}', coalesce({1}, ''), strftime('%Y-%m', 'now'), 1
+        FROM app_store_main WHERE app_id = new.app_id
+        ON CONFLICT (dimension, name, month) DO UPDATE SET reviews = reviews + 1;
+        """.format(dimension, column) for dimension, column in rollup_dimensions.items())
+    earlier_review_statements = ''.join("""
+        INSERT INTO app_store_rollup_reviews (dimension, name, month, reviews)
+        SELECT '{0}', coalesce(new.{1}, ''), strftime('%Y-%m', 'now'), count(*)
+        FROM app_store_customer_reviews WHERE app_id = new.app_id
+        HAVING count(*) > 0
+        ON CONFLICT (dimension, name, month) DO UPDATE SET
+            reviews = reviews + excluded.reviews;
+        """.format(dimension, column) for dimension, column in rollup_dimensions.items())
+    execute_script(conn, """
+    CREATE TRIGGER app_store_rollup_main_insert AFTER INSERT ON app_store_main
+    BEGIN
+        {add_new}
+        {add_languages}
+        {add_earlier_reviews}
+    END;
+
+    CREATE TRIGGER app_store_rollup_main_update AFTER UPDATE OF
+        category, seller, all_versions_rating, all_versions_review_count, price_value
+    ON app_store_main
+    BEGIN
+        {remove_old}
+        {add_new}
+    END;
+
+    CREATE TRIGGER app_store_rollup_main_regroup AFTER UPDATE OF category, seller
+    ON app_store_main
+    WHEN old.category IS NOT new.category OR old.seller IS NOT new.seller
+    BEGIN
+        {remove_old_languages}
+        {add_languages}
+    END;
+
+    CREATE TRIGGER app_store_rollup_main_delete AFTER DELETE ON app_store_main
+    BEGIN
+        {remove_old}
+        {remove_old_languages}
+    END;
+
+    CREATE TRIGGER app_store_rollup_language_insert AFTER INSERT ON app_store_languages
+    BEGIN
+        {add_language}
+    END;
+
+    CREATE TRIGGER app_store_rollup_language_delete AFTER DELETE ON app_store_languages
+    BEGIN
+        {remove_language}
+    END;
+
+    CREATE TRIGGER app_store_rollup_review_insert AFTER INSERT ON app_store_customer_reviews
+    BEGIN
+        {add_review}
+    END;
+    """.format(
+        add_new=rollup_app_statements('new', 1),
+        remove_old=rollup_app_statements('old', -1),
+        add_languages=rollup_language_statements('new', None, 1),
+        remove_old_languages=rollup_language_statements('old', None, -1),
+        add_language=rollup_language_statements(None, 'new.language', 1),
+        remove_language=rollup_language_statements(None, 'old.language', -1),
+        add_review=review_statements,
+        add_earlier_reviews=earlier_review_statements,
+    ))
+
+
+def migration_10(conn):
+    """Adds app_store_db_shards, the files the app tables
+    are split across when the db is sharded, see
+    db_shards.ShardedWriter. It's empty otherwise."""
+    execute_script(conn, """
+    CREATE TABLE app_store_db_shards
+    (
+        shard INTEGER PRIMARY KEY,
+        path TEXT
+    );
+    """)
+
+
+# noinspection SqlDialectInspection
+def migration_11(conn):
+    """Points app_store_search at a search_id column instead
+    of app_store_main's rowid, which VACUUM can renumber since
+    app_id is the primary key. search_id is given out on
+    insert and never changes, so the index stays right
+    without the manual rebuild migration_4 needed.
+    """
+    execute_script(conn, """
+    DROP TRIGGER app_store_search_insert;
+    DROP TRIGGER app_store_search_delete;
+    DROP TRIGGER app_store_search_update;
+    DROP TABLE app_store_search;
+
+    ALTER TABLE app_store_main ADD COLUMN search_id INTEGER;
+    UPDATE app_store_main SET search_id = rowid;
+    CREATE UNIQUE INDEX app_store_main_search_id ON app_store_main (search_id);
+
+    CREATE VIRTUAL TABLE app_store_search USING fts5(
+        app_name, seller, category, description,
+        content='app_store_main', content_rowid='search_id'
+    );
+
+    CREATE TRIGGER app_store_search_insert AFTER INSERT ON app_store_main
+    BEGIN
+        UPDATE app_store_main
+        SET search_id = (SELECT coalesce(max(search_id), 0) + 1 FROM app_store_main)
+        WHERE rowid = new.rowid AND search_id IS NULL;
+        INSERT INTO app_store_search (rowid, app_name, seller, category, description)
+        SELECT search_id, app_name, seller, category, description
+        FROM app_store_main WHERE rowid = new.rowid;
+    END;
+
+    CREATE TRIGGER app_store_search_delete AFTER DELETE ON app_store_main
+    BEGIN
+        INSERT INTO app_store_search (
+            app_store_search, rowid, app_name, seller, category, description
+        )
+        VALUES ('delete', old.search_id, old.app_name, old.seller, old.category,
+                old.description);
+    END;
+
+    CREATE TRIGGER app_store_search_update
+    AFTER UPDATE OF app_name, seller, category, description ON app_store_main
+    BEGIN
+        INSERT INTO app_store_search (
+            app_store_search, rowid, app_name, seller, category, description
+        )
+        VALUES ('delete', old.search_id, old.app_name, old.seller, old.category,
+                old.description);
+        INSERT INTO app_store_search (rowid, app_name, seller, category, description)
+        VALUES (new.search_id, new.app_name, new.seller, new.category, new.description);
+    END;
+
+    INSERT INTO app_store_search (app_store_search) VALUES ('rebuild');
+    """)
+
+
+# noinspection SqlDialectInspection
+def migration_12(conn):
+    """Keeps the number of urls in each frontier state in
+    app_store_url_counts, so the frontier gauges and the
+    /metrics page read a few rows instead of counting the
+    whole frontier every scrape.
+    """
+    execute_script(conn, """
+    CREATE TABLE app_store_url_counts
+    (
+        state TEXT PRIMARY KEY,
+        urls INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT INTO app_store_url_counts (state, urls)
+    SELECT state, count(*) FROM app_store_app_urls GROUP BY state;
+
+    CREATE TRIGGER app_store_url_counts_insert AFTER INSERT ON app_store_app_urls
+    BEGIN
+        INSERT INTO app_store_url_counts (state, urls) VALUES (new.state, 1)
+        ON CONFLICT (state) DO UPDATE SET urls = urls + 1;
+    END;
+
+    CREATE TRIGGER app_store_url_counts_delete AFTER DELETE ON app_store_app_urls
+    BEGIN
+        UPDATE app_store_url_counts SET urls = urls - 1 WHERE state = old.state;
+    END;
+
+    CREATE TRIGGER app_store_url_counts_update AFTER UPDATE OF state ON app_store_app_urls
+    WHEN old.state IS NOT new.state
+    BEGIN
+        UPDATE app_store_url_counts SET urls = urls - 1 WHERE state = old.state;
+        INSERT INTO app_store_url_counts (state, urls) VALUES (new.state, 1)
+        ON CONFLICT (state) DO UPDATE SET urls = urls + 1;
+    END;
+    """)
+
+
+# the tables that hang off app_store_main by app_id
+child_tables = (
+    'app_store_languages', 'app_store_top_in_app_purchases', 'app_store_customer_reviews',
+)
+
+
+# noinspection SqlDialectInspection
+def migration_13(conn):
+    """Bumps an app's updated_at when its languages, in-app
+    purchases or reviews change, so the visualization's
+    cache and exports see the app as changed even when its
+    main row wasn't written.
+
+    A crawled app's rows usually go in within the same
+    millisecond, so the app's row is only rewritten once
+    the time has moved on. Otherwise every language and
+    review would rewrite it and halve the writer's speed.
+    """
+    execute_script(conn, ''.join("""
+    CREATE TRIGGER {table}_touch_{event} AFTER {event} ON {table}
+    BEGIN
+        UPDATE app_store_main
+        SET updated_at = (julianday('now') - 2440587.5) * 86400.0
+        WHERE app_id = {row}.app_id
+        AND updated_at IS NOT (julianday('now') - 2440587.5) * 86400.0;
+    END;
+    """.format(table=table, event=event, row=row)
+        for table in child_tables
+        for event, row in (('insert', 'new'), ('update', 'new'), ('delete', 'old'))
+    ))
+
+
+# noinspection SqlDialectInspection
+def migration_14(conn):
+    """Keeps the error a category shard last failed with,
+    see CrawlAppStore.crawl_categories"""
+    execute_script(conn, """
+    ALTER TABLE app_store_crawl_shards ADD COLUMN last_error TEXT;
+    """)
+
+
+# the position in this list is the schema version
+# that a migration brings the db up to
+MIGRATIONS = [
+    migration_1,
+    migration_2,
+    migration_3,
+    migration_4,
+    migration_5,
+    migration_6,
+    migration_7,
+    migration_8,
+    migration_9,
+    migration_10,
+    migration_11,
+    migration_12,
+    migration_13,
+    migration_14,
+]
+
+
+def execute_script(conn, script):
+    """Runs each statement in script on conn.
+
+    Unlike executescript this doesn't commit first, so
+    the statements stay in the migration's transaction.
+
+    :param conn:
+    :type conn: sqlite3.Connection
+    :param script:
+    :type script: str
+    """
+    statement = ''
+    for line in script.splitlines(True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''
+
+
+def schema_version(conn):
+    """
+    :param conn:
+    :type conn: sqlite3.Connection
+    :rtype: int
+    """
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db='app_store_db'):
+    """Brings the db up to the latest schema version,
+    creating it if it doesn't exist yet.
+
+    Each migration runs in its own transaction, so a
+    failed one leaves the db at the version before it.
+
+    :param db:
+    :type db: str
+    :return: the schema version the db is now at
+    :rtype: int
+    """
+    conn = sqlite3.connect(db, isolation_level=None)
+    try:
+        version = schema_version(conn)
+        for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+            conn.execute('BEGIN')
+            try:
+                migration(conn)
+                conn.execute('PRAGMA user_version = {}'.format(number))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return schema_version(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+
+    print('app_store_db is at schema version', migrate())
@@ -0,0 +1,235 @@
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def compress(data, codec):
+    """
+    :param data:
+    :type data: bytes
+    :param codec: zlib or zstd
+    :type codec: str
+    :rtype: bytes
+    """
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(data, codec):
+    """
+    :param data:
+    :type data: bytes
+    :param codec: zlib or zstd
+    :type codec: str
+    :rtype: bytes
+    """
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def read_pages(segment_path, records):
+    """Reads pages out of a segment file through a memory map,
+    so only the parts asked for get read from disk.
+
+    :param segment_path:
+    :type segment_path: str
+    :param records: (offset, length, codec) for each page
+    :type records: list
+    :return: the html of each page, in the same order
+    :rtype: collections.Iterable[str]
+    """
+    with open(segment_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for offset, length, codec in records:
+                yield decompress(m[offset:offset + length], codec).decode('utf-8')
+
+
+# noinspection SqlDialectInspection
+class PageArchive:
+    def __init__(self, path='app_store_archive', codec=None,
+                 segment_bytes=256 * 1024 * 1024, commit_every=100):
+        """An append only store of the raw html of every page
+        fetched, so pages can be parsed again without fetching
+        them again (see reparse.py).
+
+        Each page is compressed on its own and appended to the
+        current segment file in the path directory. A new segment
+        is started once the current one passes segment_bytes.
+        The index, an sqlite db in the same directory, records
+        the segment, offset and length of every page by app id.
+        A page fetched again is appended again, and the index
+        keeps every copy.
+
+        :param path: the directory to keep the archive in
+        :type path: str
+        :param codec: zstd if the zstandard package is
+            installed, otherwise zlib
+        :type codec: str
+        :param segment_bytes:
+        :type segment_bytes: int
+        :param commit_every: the index is committed after this
+            many pages, and on flush and close
+        :type commit_every: int
+        """
+        if codec is None:
+            codec = 'zstd' if zstandard is not None else 'zlib'
+        if codec not in ('zlib', 'zstd'):
+            raise ValueError('unknown codec {!r}'.format(codec))
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError('the zstd codec needs `pip install zstandard`')
+        self.path = path
+        self.codec = codec
+        self.segment_bytes = segment_bytes
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        os.makedirs(path, exist_ok=True)
+        self.index = sqlite3.connect(
+            os.path.join(path, 'index'), check_same_thread=False
+        )
+        self.index.execute('PRAGMA journal_mode=WAL')
+        self.index.executescript("""
+        CREATE TABLE IF NOT EXISTS pages
+        (
+            page_id INTEGER PRIMARY KEY,
+            app_id INTEGER,
+            url TEXT,
+            segment INTEGER,
+            "offset" INTEGER,
+            length INTEGER,
+            codec TEXT,
+            fetched REAL
+        );
+        CREATE INDEX IF NOT EXISTS pages_app_id ON pages (app_id);
+        """)
+        self.segment = self.index.execute(
+            'SELECT coalesce(max(segment), 0) FROM pages'
+        ).fetchone()[0]
+        self.segment_file = None
+        self.open_segment()
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, 'segment-{:05d}'.format(segment))
+
+    def open_segment(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+        self.segment_file = open(self.segment_path(self.segment), 'ab')
+
+    def add(self, app_id, url, source):
+        """Appends a page to the archive.
+
+        :param app_id:
+        :type app_id: int
+        :param url:
+        :type url: str
+        :param source: the page's html
+        :type source: str
+        """
+        data = compress(source.encode('utf-8'), self.codec)
+        with self.lock:
+            if self.segment_file.tell() + len(data) > self.segment_bytes \
+                    and self.segment_file.tell():
+                self.segment += 1
+                self.open_segment()
+            offset = self.segment_file.tell()
+            self.segment_file.write(data)
+            self.index.execute(
+                """
+                INSERT INTO pages (app_id, url, segment, "offset", length, codec, fetched)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (app_id, url, self.segment, offset, len(data), self.codec, time.time())
+            )
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self.commit()
+
+    def commit(self):
+        # the page has to be on disk before the index points at it
+        self.segment_file.flush()
+        self.index.commit()
+        self.uncommitted = 0
+
+    def flush(self):
+        """Writes out everything added so far."""
+        with self.lock:
+            self.commit()
+
+    def get(self, app_id):
+        """
+        :param app_id:
+        :type app_id: int
+        :return: the html last archived for the app, or None
+        :rtype: str
+        """
+        self.flush()
+        with self.lock:
+            row = self.index.execute(
+                """
+                SELECT segment, "offset", length, codec FROM pages
+                WHERE app_id = ? ORDER BY page_id DESC LIMIT 1
+                """,
+                (app_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        segment, offset, length, codec = row
+        return next(read_pages(self.segment_path(segment), [(offset, length, codec)]))
+
+    def iter_latest(self, batch_size=200):
+        """Yields the latest copy of every app's page, a batch
+        at a time, with each batch from a single segment and
+        in the order the pages are in the segment.
+
+        :param batch_size:
+        :type batch_size: int
+        :return: (segment path, list of (url, offset, length, codec))
+        :rtype: collections.Iterable[tuple]
+        """
+        self.flush()
+        # a connection of its own, so pages can
+        # still be added while this is running
+        conn = sqlite3.connect(os.path.join(self.path, 'index'))
+        cursor = conn.execute("""
+        SELECT segment, url, "offset", length, codec FROM pages
+        WHERE page_id IN (SELECT max(page_id) FROM pages GROUP BY app_id)
+        ORDER BY segment, "offset"
+        """)
+        batch = []
+        for segment, url, offset, length, codec in cursor:
+            if batch and (len(batch) >= batch_size or segment != batch_segment):
+                yield self.segment_path(batch_segment), batch
+                batch = []
+            batch_segment = segment
+            batch.append((url, offset, length, codec))
+        if batch:
+            yield self.segment_path(batch_segment), batch
+        conn.close()
+
+    def count(self):
+        """
+        :return: the number of apps in the archive
+        :rtype: int
+        """
+        self.flush()
+        with self.lock:
+            return self.index.execute(
+                'SELECT count(DISTINCT app_id) FROM pages'
+            ).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.segment_file.close()
+            self.index.close()
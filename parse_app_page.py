@@ -1,6 +1,18 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import re
 import sqlite3
+import records
+
+# compiled once here instead of on every page
+language_regex = re.compile(r'Language[s]?: ')
+# searches for the rating in the string and the word half
+rating_regex = re.compile(
+    r'(?P<rating>[0-9]) (?:(?P<half>and a half stars)|(?P<not_half>star[s]?))'
+)
+number_regex = re.compile(r'[0-9][0-9,]*(?:\.[0-9]+)?')
+size_regex = re.compile(r'([0-9][0-9,]*(?:\.[0-9]+)?) ?([KMG]?B)')
+size_multipliers = {'B': 1, 'KB': 10 ** 3, 'MB': 10 ** 6, 'GB': 10 ** 9}
+whitespace_pair_regex = re.compile(r'\s\s')
 
 
 class InvalidPageException(Exception):
@@ -8,17 +20,158 @@ class InvalidPageException(Exception):
     values to parse, i.e. the app ID."""
 
 
+class AppPageStrainer(SoupStrainer):
+    """Only lets BeautifulSoup build the parts of an
+    app page that the parser reads from. Everything else
+    is skipped while parsing, so the tree is much smaller
+    and every find has less to search through."""
+
+    # (tag name, attribute, value) of the top level
+    # elements the fields are found in
+    targets = (
+        ('meta', 'name', 'apple:content_id'),
+        ('h1', 'itemprop', 'name'),
+        ('div', 'metrics-loc', 'Titledbox_Description'),
+        ('div', 'id', 'left-stack'),
+        ('div', 'class', 'customer-reviews'),
+    )
+
+    def __init__(self, fields=None):
+        """
+        :param fields: only keep the elements these fields
+            are found in, see ParseAppStorePage.profiles
+        :type fields: frozenset
+        """
+        super().__init__()
+        if fields is not None:
+            self.targets = tuple(
+                x for x in self.targets
+                if ParseAppStorePage.sections[x[2]] & fields
+            )
+
+    def wanted(self, name, attrs):
+        """Checks a tag against the targets.
+
+        :param name:
+        :type name: str
+        :param attrs:
+        :type attrs: dict
+        :rtype: bool
+        """
+        for target_name, attr, value in self.targets:
+            if name != target_name:
+                continue
+            attr_value = attrs.get(attr)
+            # class comes through as a string or a list
+            # depending on the bs4 version
+            if isinstance(attr_value, list):
+                attr_value = ' '.join(attr_value)
+            if attr_value == value:
+                return True
+        return False
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        # bs4 4.13 and later
+        return self.wanted(name, attrs or {})
+
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        # bs4 4.12 and earlier
+        return self.wanted(markup_name, dict(markup_attrs))
+
+
 class ParseAppStorePage:
-    def __init__(self, source_page):
+
+    # parser backends, mapped to the BeautifulSoup features
+    # and whether the AppPageStrainer is used
+    backends = {
+        'html.parser': ('html.parser', False),
+        'strained': ('html.parser', True),
+        'lxml': ('lxml', False),
+        'lxml-strained': ('lxml', True),
+    }
+
+    # the text fields found in each part of the page, keyed
+    # by the value AppPageStrainer looks for
+    sections = {
+        'apple:content_id': frozenset(('app_id',)),
+        'name': frozenset(('app_name',)),
+        'Titledbox_Description': frozenset(('description',)),
+        'left-stack': frozenset((
+            'price', 'category', 'published_date', 'last_updated_date', 'version',
+            'size', 'languages', 'seller', 'copyright', 'app_rating', 'compatibility',
+            'current_version_rating_value', 'current_version_rating_review_count',
+            'all_versions_rating_value', 'all_versions_rating_review_count',
+            'top_in_app_purchases',
+        )),
+        'customer-reviews': frozenset(('customer_reviews',)),
+    }
+    # the typed fields, mapped to the text field they're made from
+    typed_fields = dict(
+        price_value='price',
+        size_bytes='size',
+        current_version_rating='current_version_rating_value',
+        current_version_review_count='current_version_rating_review_count',
+        all_versions_rating='all_versions_rating_value',
+        all_versions_review_count='all_versions_rating_review_count',
+    )
+    # the text fields each profile extracts, the typed
+    # fields come along with the ones they're made from
+    profiles = dict(
+        minimal=frozenset(('app_id', 'app_name', 'price', 'version')),
+        ratings=frozenset((
+            'app_id', 'app_name', 'price', 'version',
+            'current_version_rating_value', 'current_version_rating_review_count',
+            'all_versions_rating_value', 'all_versions_rating_review_count',
+        )),
+        full=frozenset().union(*sections.values()),
+        # what the iTunes lookup api has, see lookup_api
+        lookup=frozenset((
+            'app_id', 'app_name', 'description', 'price', 'category', 'version',
+            'seller', 'languages', 'published_date', 'last_updated_date', 'size',
+            'app_rating', 'compatibility',
+            'current_version_rating_value', 'current_version_rating_review_count',
+            'all_versions_rating_value', 'all_versions_rating_review_count',
+        )),
+    )
+
+    def __init__(self, source_page, backend='html.parser', profile='full', fields=None):
         """Takes in the html from an app store page as a string.
 
         Call the parse method to parse and return a
         dict object of the parsed page.
 
+        backend picks how the html gets parsed, see
+        ParseAppStorePage.backends. The lxml ones need
+        lxml to be installed.
+
+        profile picks the fields to extract, see
+        ParseAppStorePage.profiles. The others are left
+        empty and aren't written out, so they keep whatever
+        value the db already has.
+
+        fields narrows it down further to just those text
+        fields, i.e. the few the lookup api doesn't have.
+        The app id is always parsed.
+
         :param source_page:
         :type source_page: str
+        :param backend:
+        :type backend: str
+        :param profile:
+        :type profile: str
+        :param fields: defaults to all of the profile's
+        :type fields: frozenset
         """
+        if backend not in self.backends:
+            raise ValueError('Unknown parser backend: {}'.format(backend))
+        if profile not in self.profiles:
+            raise ValueError('Unknown field profile: {}'.format(profile))
         self.source_page = source_page
+        self.backend = backend
+        self.profile = profile
+        self.fields = self.profiles[profile]
+        if fields is not None:
+            self.fields = self.fields & (frozenset(fields) | {'app_id'})
 
         self.output_dict = dict(
             app_id='',
@@ -40,11 +193,47 @@ class ParseAppStorePage:
             all_versions_rating_value='',
             all_versions_rating_review_count='',
             top_in_app_purchases=[],
-            customer_reviews=[]
+            customer_reviews=[],
+            # typed versions of the text fields above,
+            # filled in by normalize
+            price_value=None,
+            size_bytes=None,
+            current_version_rating=None,
+            current_version_review_count=None,
+            all_versions_rating=None,
+            all_versions_review_count=None
         )
 
-    def parse(self):
-        soup = BeautifulSoup(self.source_page, 'html.parser')
+    @classmethod
+    def from_output_dict(cls, output_dict, profile='full'):
+        """Wraps an already parsed output_dict, i.e. one
+        that came back from another process, so it can
+        be written out.
+
+        :param output_dict:
+        :type output_dict: dict
+        :param profile: the profile it was parsed with
+        :type profile: str
+        :rtype: ParseAppStorePage
+        """
+        parsed = cls('', profile=profile)
+        parsed.output_dict = output_dict
+        return parsed
+
+    def make_soup(self):
+        """Parses the html with the chosen backend.
+
+        :rtype: BeautifulSoup
+        """
+        features, strained = self.backends[self.backend]
+        parse_only = AppPageStrainer(self.fields) if strained else None
+        return BeautifulSoup(self.source_page, features, parse_only=parse_only)
+
+    def parse(self, normalize=True):
+        # normalize=False leaves the typed fields for
+        # postprocess.normalize_batch to fill in
+        soup = self.make_soup()
+        fields = self.fields
 
         # fields we will capture
         # app id: 1121971067
@@ -76,211 +265,395 @@ class ParseAppStorePage:
         self.output_dict['app_id'] = app_id_tag['content']
 
         # app name
-        self.output_dict['app_name'] = soup.find('h1', {'itemprop': 'name'}).text
+        if 'app_name' in fields:
+            self.output_dict['app_name'] = soup.find('h1', {'itemprop': 'name'}).text
 
         # get description div
-        description_div = soup.find('div', {'metrics-loc': 'Titledbox_Description'})
-        # get description paragraph and decode raw html
-        description_raw = description_div.p.decode_contents()
-        # assign description, replacing break tags as line feeds
-        self.output_dict['description'] = description_raw.replace('<br/>', '\n')
+        if 'description' in fields:
+            description_div = soup.find('div', {'metrics-loc': 'Titledbox_Description'})
+            # get description paragraph and decode raw html
+            description_raw = description_div.p.decode_contents()
+            # assign description, replacing break tags as line feeds
+            self.output_dict['description'] = description_raw.replace('<br/>', '\n')
 
         # price (this field isn't always there, i.e. TV apps)
-        price_tag = soup.find('div', {'itemprop': 'price'})
-        if price_tag is not None:
-            self.output_dict['price'] = price_tag.text
+        if 'price' in fields:
+            price_tag = soup.find('div', {'itemprop': 'price'})
+            if price_tag is not None:
+                self.output_dict['price'] = price_tag.text
 
         # category
-        self.output_dict['category'] = soup.find('span', {'itemprop': 'applicationCategory'}).text
+        if 'category' in fields:
+            self.output_dict['category'] = soup.find('span', {'itemprop': 'applicationCategory'}).text
 
         # date_published and last_update_date
-        published_date_span = soup.find('span', {'itemprop': 'datePublished'})
-        self.output_dict['published_date'] = published_date_span['content']
-        self.output_dict['last_updated_date'] = published_date_span.text
+        if 'last_updated_date' in fields:
+            published_date_span = soup.find('span', {'itemprop': 'datePublished'})
+            self.output_dict['published_date'] = published_date_span['content']
+            self.output_dict['last_updated_date'] = published_date_span.text
 
         # version
-        self.output_dict['version'] = soup.find('span', {'itemprop': 'softwareVersion'}).text
+        if 'version' in fields:
+            self.output_dict['version'] = soup.find('span', {'itemprop': 'softwareVersion'}).text
 
         # size
-        size_tag = soup.find('span', text='Size: ')
-        self.output_dict['size'] = size_tag.next_sibling
+        if 'size' in fields:
+            size_tag = soup.find('span', text='Size: ')
+            # str() so the value doesn't hold on to the whole tree
+            self.output_dict['size'] = str(size_tag.next_sibling)
 
         # languages (field is not always there)
-        language_regex = r'Language[s]?: '
-        language_tag = soup.find('span', text=re.compile(language_regex))
-        if language_tag is not None:
-            all_languages = language_tag.next_sibling.split(', ')
-            self.output_dict['languages'] = all_languages
+        if 'languages' in fields:
+            language_tag = soup.find('span', text=language_regex)
+            if language_tag is not None:
+                all_languages = str(language_tag.next_sibling).split(', ')
+                self.output_dict['languages'] = all_languages
 
         # seller
-        seller_tag = soup.find('span', {'itemprop': 'author'})
-        self.output_dict['seller'] = seller_tag.span.text
+        if 'seller' in fields:
+            seller_tag = soup.find('span', {'itemprop': 'author'})
+            self.output_dict['seller'] = seller_tag.span.text
 
         # copyright
-        self.output_dict['copyright'] = soup.find('li', {'class': 'copyright'}).text
+        if 'copyright' in fields:
+            self.output_dict['copyright'] = soup.find('li', {'class': 'copyright'}).text
 
         # app rating
-        self.output_dict['app_rating'] = soup.find('div', {'class': 'app-rating'}).text
+        if 'app_rating' in fields:
+            self.output_dict['app_rating'] = soup.find('div', {'class': 'app-rating'}).text
 
         # compatibility
-        compatibility = soup.find('span', {'itemprop': 'operatingSystem'}).text.replace('\xa0', ' ')
-        self.output_dict['compatibility'] = compatibility
+        if 'compatibility' in fields:
+            compatibility = soup.find('span', {'itemprop': 'operatingSystem'}).text.replace('\xa0', ' ')
+            self.output_dict['compatibility'] = compatibility
 
         # customer ratings (these fields may not appear)
 
         # current version rating
-        ratings_current_version_tag = soup.find('div', text='Current Version:')
-        # check to make sure we found it
-        if ratings_current_version_tag is not None:
-            # if so, parse
-            div = ratings_current_version_tag.find_next('div')
-            # check for the rating value in the page
-            rating_value_span = div.find('span', {'itemprop': 'ratingValue'})
-            if rating_value_span is not None:
-                self.output_dict['current_version_rating_value'] = rating_value_span.text
-            else:
-                # otherwise, parse it out of the aria-label
-                self.output_dict['current_version_rating_value'] = self.parse_rating(div['aria-label'])
-            # parse the rating count
-            rating_count_span = div.find('span', {'class': 'rating-count'})
-            rating_count = rating_count_span.text.replace(' Ratings', '')
-            self.output_dict['current_version_rating_review_count'] = rating_count
+        if 'current_version_rating_value' in fields:
+            ratings_current_version_tag = soup.find('div', text='Current Version:')
+            # check to make sure we found it
+            if ratings_current_version_tag is not None:
+                # if so, parse
+                div = ratings_current_version_tag.find_next('div')
+                # check for the rating value in the page
+                rating_value_span = div.find('span', {'itemprop': 'ratingValue'})
+                if rating_value_span is not None:
+                    self.output_dict['current_version_rating_value'] = rating_value_span.text
+                else:
+                    # otherwise, parse it out of the aria-label
+                    self.output_dict['current_version_rating_value'] = self.parse_rating(div['aria-label'])
+                # parse the rating count
+                rating_count_span = div.find('span', {'class': 'rating-count'})
+                rating_count = rating_count_span.text.replace(' Ratings', '')
+                self.output_dict['current_version_rating_review_count'] = rating_count
 
         # all versions rating
-        ratings_all_versions_tag = soup.find('div', text='All Versions:')
-        # check to make sure we found it
-        if ratings_all_versions_tag is not None:
-            # if so, parse
-            div = ratings_all_versions_tag.find_next('div')
-            # check for the rating value in the page
-            rating_value_span = div.find('span', {'itemprop': 'ratingValue'})
-            if rating_value_span is not None:
-                self.output_dict['all_versions_rating_value'] = rating_value_span.text
-            else:
-                # otherwise, parse it out of the aria-label
-                self.output_dict['all_versions_rating_value'] = self.parse_rating(div['aria-label'])
-            # parse the rating count
-            rating_count_span = div.find('span', {'class': 'rating-count'})
-            rating_count = rating_count_span.text.replace(' Ratings', '')
-            self.output_dict['all_versions_rating_review_count'] = rating_count
+        if 'all_versions_rating_value' in fields:
+            ratings_all_versions_tag = soup.find('div', text='All Versions:')
+            # check to make sure we found it
+            if ratings_all_versions_tag is not None:
+                # if so, parse
+                div = ratings_all_versions_tag.find_next('div')
+                # check for the rating value in the page
+                rating_value_span = div.find('span', {'itemprop': 'ratingValue'})
+                if rating_value_span is not None:
+                    self.output_dict['all_versions_rating_value'] = rating_value_span.text
+                else:
+                    # otherwise, parse it out of the aria-label
+                    self.output_dict['all_versions_rating_value'] = self.parse_rating(div['aria-label'])
+                # parse the rating count
+                rating_count_span = div.find('span', {'class': 'rating-count'})
+                rating_count = rating_count_span.text.replace(' Ratings', '')
+                self.output_dict['all_versions_rating_review_count'] = rating_count
 
         # top in app purchases (This field may not be there)
-        in_app_purchases_div = soup.find('div', {'metrics-loc': 'Titledbox_Top In-App Purchases'})
-        if in_app_purchases_div is not None:
-            in_app_purchases = []
-            for i, li in enumerate(in_app_purchases_div.find('ol').find_all('li'), 1):
-                title = li.find('span', {'class': 'in-app-title'}).text
-                price = li.find('span', {'class': 'in-app-price'}).text
-                in_app_purchases.append({'title': title, 'price': price, 'order': i})
-            self.output_dict['top_in_app_purchases'] = in_app_purchases
+        if 'top_in_app_purchases' in fields:
+            in_app_purchases_div = soup.find('div', {'metrics-loc': 'Titledbox_Top In-App Purchases'})
+            if in_app_purchases_div is not None:
+                in_app_purchases = []
+                for i, li in enumerate(in_app_purchases_div.find('ol').find_all('li'), 1):
+                    title = li.find('span', {'class': 'in-app-title'}).text
+                    price = li.find('span', {'class': 'in-app-price'}).text
+                    in_app_purchases.append({'title': title, 'price': price, 'order': i})
+                self.output_dict['top_in_app_purchases'] = in_app_purchases
 
         # customer reviews (this may not be there)
-        customer_reviews_div = soup.find('div', {'class': 'customer-reviews'})
-        if customer_reviews_div is not None:
-            all_customer_reviews = []
-            for review in customer_reviews_div.find_all('div', {'class': 'customer-review'}):
-                title = review.find('span', {'class': 'customerReviewTitle'}).text
-                rating_div = review.find('div', {'class': 'rating'})
-                rating_parsed = self.parse_rating(rating_div['aria-label'])
-
-                # get the user info and clean it up
-                user_span = review.find('span', {'class': 'user-info'}).text
-                user_clean = re.sub('\s\s', ' ', user_span)
-                while '  ' in user_clean:
-                    user_clean = re.sub('\s\s', ' ', user_clean)
-                user_clean = re.sub('^by ', '', user_clean).strip()
-
-                content = review.find('p', {'class': 'content'}).text
-
-                all_customer_reviews.append({
-                    'title': title, 'rating': rating_parsed,
-                    'user': user_clean, 'content': content
-                })
-            self.output_dict['customer_reviews'] = all_customer_reviews
-
+        if 'customer_reviews' in fields:
+            customer_reviews_div = soup.find('div', {'class': 'customer-reviews'})
+            if customer_reviews_div is not None:
+                all_customer_reviews = []
+                for review in customer_reviews_div.find_all('div', {'class': 'customer-review'}):
+                    title = review.find('span', {'class': 'customerReviewTitle'}).text
+                    rating_div = review.find('div', {'class': 'rating'})
+                    rating_parsed = self.parse_rating(rating_div['aria-label'])
+
+                    # get the user info and clean it up
+                    user_span = review.find('span', {'class': 'user-info'}).text
+                    user_clean = self.clean_user(user_span)
+
+                    content = review.find('p', {'class': 'content'}).text
+
+                    all_customer_reviews.append({
+                        'title': title, 'rating': rating_parsed,
+                        'user': user_clean, 'content': content
+                    })
+                self.output_dict['customer_reviews'] = all_customer_reviews
+
+        if normalize:
+            self.normalize()
         return self.output_dict
 
+    def normalize(self):
+        """Fills in the typed fields from their text versions,
+        i.e. price "$1.99" becomes price_value 1.99 and
+        size "142 MB" becomes size_bytes 142000000."""
+        d = self.output_dict
+        d['price_value'] = self.parse_price(d['price'])
+        d['size_bytes'] = self.parse_size(d['size'])
+        d['current_version_rating'] = self.parse_number(
+            d['current_version_rating_value'], float)
+        d['current_version_review_count'] = self.parse_number(
+            d['current_version_rating_review_count'], int)
+        d['all_versions_rating'] = self.parse_number(
+            d['all_versions_rating_value'], float)
+        d['all_versions_review_count'] = self.parse_number(
+            d['all_versions_rating_review_count'], int)
+        for in_app_purchase in d['top_in_app_purchases']:
+            in_app_purchase['price_value'] = self.parse_price(in_app_purchase['price'])
+        for customer_review in d['customer_reviews']:
+            customer_review['rating_value'] = self.parse_number(
+                customer_review['rating'], float)
+
+    main_table_columns = records.main_table_columns
+    # re-crawling an app updates its row instead of adding another
+    main_table_insert_statement = """
+    INSERT INTO app_store_main ({}) VALUES ({})
+    ON CONFLICT (app_id) DO UPDATE SET {}
+    """.format(
+        ', '.join(main_table_columns),
+        ', '.join('?' for _ in main_table_columns),
+        ', '.join('{0} = excluded.{0}'.format(x) for x in main_table_columns[1:])
+    )
+    # main_table_insert_statement_for's statements, by fields
+    profile_insert_statements = {}
+
+    @classmethod
+    def main_table_insert_statement_for(cls, profile, fields=None):
+        """An app_store_main upsert that only updates the
+        columns the profile extracts, so re-crawling with a
+        smaller profile doesn't blank out the others.
+
+        :param profile:
+        :type profile: str
+        :param fields: the text fields to update instead
+            of the profile's
+        :type fields: frozenset
+        :rtype: str
+        """
+        fields = cls.profiles[profile] if fields is None else frozenset(fields)
+        if fields == cls.profiles['full']:
+            return cls.main_table_insert_statement
+        statement = cls.profile_insert_statements.get(fields)
+        if statement is None:
+            columns = [
+                x for x in cls.main_table_columns[1:]
+                if x in fields or cls.typed_fields.get(x) in fields
+            ]
+            statement = cls.profile_insert_statements[fields] = """
+            INSERT INTO app_store_main ({}) VALUES ({})
+            ON CONFLICT (app_id) DO UPDATE SET {}
+            """.format(
+                ', '.join(cls.main_table_columns),
+                ', '.join('?' for _ in cls.main_table_columns),
+                ', '.join('{0} = excluded.{0}'.format(x) for x in columns)
+            )
+        return statement
+
+    # an app's languages and purchases are replaced on every
+    # crawl, so ones it no longer has don't linger
+    languages_delete_statement = """
+    DELETE FROM app_store_languages WHERE app_id = ?
+    """
+    purchases_delete_statement = """
+    DELETE FROM app_store_top_in_app_purchases WHERE app_id = ?
+    """
+    languages_insert_statement = """
+    INSERT OR IGNORE INTO app_store_languages (app_id, language)
+    VALUES (?, ?)
+    """
+    purchases_insert_statement = """
+    INSERT OR REPLACE INTO app_store_top_in_app_purchases
+    (app_id, "order", title, price, price_value)
+    VALUES (?, ?, ?, ?, ?)
+    """
+    # an upsert rather than a replace, so seeing a review again
+    # doesn't count it again in the review rollups
+    customer_reviews_insert_statement = """
+    INSERT INTO app_store_customer_reviews
+    (app_id, title, rating, user, content, rating_value)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (app_id, user, title) DO UPDATE SET
+    rating = excluded.rating, content = excluded.content,
+    rating_value = excluded.rating_value
+    """
+
+    def to_record(self):
+        """
+        :return: the parsed page as a compact record
+        :rtype: records.AppRecord
+        """
+        return records.AppRecord.from_output_dict(self.output_dict)
+
+    @classmethod
+    def record_rows(cls, record, profile='full', fields=None):
+        """Turns a record into the rows to insert. The
+        purchase and review records are rows already.
+        Tables the profile doesn't extract are left out.
+        The app's stored languages and purchases are
+        deleted before its new ones go in.
+
+        :param record:
+        :type record: records.AppRecord
+        :param profile: the profile it was parsed with
+        :type profile: str
+        :param fields: the text fields to write instead of
+            the profile's
+        :type fields: frozenset
+        :return: a list of (statement, list of row tuples)
+        :rtype: list
+        """
+        fields = cls.profiles[profile] if fields is None else fields
+        rows = [(cls.main_table_insert_statement_for(profile, fields), [record.main_row()])]
+        if 'languages' in fields:
+            rows.append((cls.languages_delete_statement, [(record.app_id,)]))
+            rows.append((cls.languages_insert_statement, record.language_rows()))
+        if 'top_in_app_purchases' in fields:
+            rows.append((cls.purchases_delete_statement, [(record.app_id,)]))
+            rows.append((cls.purchases_insert_statement, list(record.top_in_app_purchases)))
+        if 'customer_reviews' in fields:
+            rows.append((cls.customer_reviews_insert_statement, list(record.customer_reviews)))
+        return rows
+
+    @classmethod
+    def write_record(cls, record, writer, profile='full', fields=None):
+        """Queues a record on the db writer.
+
+        :param record:
+        :type record: records.AppRecord
+        :param writer: a db_shards.ShardedWriter picks the
+            app's shard
+        :type writer: db_writer.DBWriter
+        :param profile: the profile it was parsed with
+        :type profile: str
+        :param fields: the text fields to write instead of
+            the profile's
+        :type fields: frozenset
+        """
+        # one item, so the app's rows always commit together
+        writer.writer_for(record.app_id).put_all(cls.record_rows(record, profile, fields))
+
+    def rows(self):
+        """Turns the parsed page into the rows to insert.
+
+        :return: a list of (statement, list of row tuples)
+        :rtype: list
+        """
+        return self.record_rows(self.to_record(), self.profile, self.fields)
+
     # noinspection PyTypeChecker,SqlDialectInspection
-    def write_out(self):
+    def write_out(self, writer=None):
         """Override this method to write out
-        however you'd like."""
+        however you'd like.
+
+        If a DBWriter is given the rows are queued on it, or
+        on the app's shard for a db_shards.ShardedWriter,
+        otherwise they're written straight to the db.
+
+        :param writer:
+        :type writer: db_writer.DBWriter
+        """
+        if writer is not None:
+            self.write_record(self.to_record(), writer, self.profile, self.fields)
+            return
+
         db = 'app_store_db'
         # using a with statement here automatically
         # closes the connection upon completion
         with sqlite3.connect(db) as conn:
             cursor = conn.cursor()
+            for statement, rows in self.rows():
+                if rows:
+                    cursor.executemany(statement, rows)
+            conn.commit()
 
-            # insert into main table
-            main_table_insert_statement = """
-            INSERT INTO app_store_main VALUES (
-              ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-              ?, ?, ?, ?, ?, ?
-            )
-            """
-            cursor.execute(
-                main_table_insert_statement,
-                (
-                    self.output_dict['app_id'],
-                    self.output_dict['app_name'],
-                    self.output_dict['description'],
-                    self.output_dict['price'],
-                    self.output_dict['category'],
-                    self.output_dict['published_date'],
-                    self.output_dict['last_updated_date'],
-                    self.output_dict['version'],
-                    self.output_dict['size'],
-                    self.output_dict['seller'],
-                    self.output_dict['copyright'],
-                    self.output_dict['app_rating'],
-                    self.output_dict['compatibility'],
-                    self.output_dict['current_version_rating_value'],
-                    self.output_dict['current_version_rating_review_count'],
-                    self.output_dict['all_versions_rating_value'],
-                    self.output_dict['all_versions_rating_review_count']
-                )
-            )
+    @staticmethod
+    def parse_price(price):
+        """Takes a price like "$1.99" or "Free" and
+        returns it as a number.
+
+        :param price:
+        :type price: str
+        :return: the price, or None if there isn't one
+        :rtype: float
+        """
+        if price == 'Free':
+            return 0.0
+        price_search = number_regex.search(price or '')
+        if price_search is None:
+            return None
+        return float(price_search.group().replace(',', ''))
 
-            languages_insert_statement = """
-            INSERT INTO app_store_languages VALUES (?,?)
-            """
-            for language in self.output_dict['languages']:
-                cursor.execute(
-                    languages_insert_statement,
-                    (self.output_dict['app_id'], language)
-                )
-
-            purchases_insert_statement = """
-            INSERT INTO app_store_top_in_app_purchases VALUES 
-            (?, ?, ?, ?)
-            """
-            for in_app_purchase in self.output_dict['top_in_app_purchases']:
-                cursor.execute(
-                    purchases_insert_statement,
-                    (
-                        self.output_dict['app_id'],
-                        in_app_purchase['order'],
-                        in_app_purchase['title'],
-                        in_app_purchase['price']
-                    )
-                )
-
-            customer_reviews_insert_statement = """
-            INSERT INTO app_store_customer_reviews VALUES 
-            (?, ?, ?, ?, ?)
-            """
-            for customer_review in self.output_dict['customer_reviews']:
-                cursor.execute(
-                    customer_reviews_insert_statement,
-                    (
-                        self.output_dict['app_id'],
-                        customer_review['title'],
-                        customer_review['rating'],
-                        customer_review['user'],
-                        customer_review['content']
-                    )
-                )
+    @staticmethod
+    def parse_size(size):
+        """Takes a size like "142 MB" and returns
+        the number of bytes.
+
+        :param size:
+        :type size: str
+        :return: the bytes, or None if it couldn't be parsed
+        :rtype: int
+        """
+        size_search = size_regex.search(size or '')
+        if size_search is None:
+            return None
+        number = float(size_search.group(1).replace(',', ''))
+        return int(number * size_multipliers[size_search.group(2)])
 
-            conn.commit()
+    @staticmethod
+    def parse_number(value, cast):
+        """Turns a number like "10,312" or "1 Rating"
+        into cast.
+
+        :param value:
+        :type value: str
+        :param cast: int or float
+        :type cast: type
+        :return: the number, or None if value doesn't have one
+        """
+        number_search = number_regex.search(value or '')
+        if number_search is None:
+            return None
+        try:
+            return cast(number_search.group().replace(',', ''))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def clean_user(user_info):
+        """Takes a review's "by    Name" and returns
+        the name.
+
+        :param user_info:
+        :type user_info: str
+        :rtype: str
+        """
+        user_clean = whitespace_pair_regex.sub(' ', user_info)
+        while '  ' in user_clean:
+            user_clean = whitespace_pair_regex.sub(' ', user_clean)
+        if user_clean.startswith('by '):
+            user_clean = user_clean[3:]
+        return user_clean.strip()
 
     @staticmethod
     def parse_rating(rating):
@@ -292,11 +665,8 @@ class ParseAppStorePage:
         :return: A string of the rating
         :rtype: str
         """
-        # searches for the rating in the string and the word half
-        regex = r'(?P<rating>[0-9]) (?:(?P<half>and a half stars)|(?P<not_half>star[s]?))'
-
         # run the regex search
-        rating_search = re.search(regex, rating)
+        rating_search = rating_regex.search(rating)
 
         # assign the rating value
         rating_value = rating_search.group('rating')
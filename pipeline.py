@@ -0,0 +1,162 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from app_store_crawler import CrawlAppStore
+from parse_app_page import ParseAppStorePage
+
+
+def parse_source(source, backend, profile='full'):
+    """Parses a page in a parse worker process.
+
+    This has to be a module level function so it
+    can be sent to the worker processes.
+
+    :param source:
+    :type source: str
+    :param backend:
+    :type backend: str
+    :param profile:
+    :type profile: str
+    :return: a record, which is much cheaper to send
+        back than the output_dict
+    :rtype: records.AppRecord
+    """
+    parsed = ParseAppStorePage(source, backend, profile)
+    parsed.parse()
+    return parsed.to_record()
+
+
+class PipelineCrawlAppStore(CrawlAppStore):
+    def __init__(self, fetch_workers=10, parse_workers=None,
+                 max_pending=None, parser_backend='html.parser', archive=None,
+                 profile='full', db_shards=None, http_cache=None):
+        """Crawls app pages as a pipeline of three stages:
+        fetch threads download the html as fast as the rate
+        limiter allows, a pool of parse processes parses it,
+        and the parsed records go on to the db writer.
+
+        Parsing happens outside of this process so it isn't
+        held back by the GIL, and throughput grows with the
+        number of cores.
+
+        Each stage hands over through a bounded queue, so a
+        slow stage makes the one before it wait instead of
+        piling pages up in memory.
+
+        :param fetch_workers: number of fetch threads
+        :type fetch_workers: int
+        :param parse_workers: number of parse processes,
+            defaults to the number of cores
+        :type parse_workers: int
+        :param max_pending: most pages waiting on or being
+            parsed at once, defaults to twice parse_workers
+        :type max_pending: int
+        :param parser_backend: see ParseAppStorePage.backends
+        :type parser_backend: str
+        :param archive: keeps the raw html if given
+        :type archive: page_archive.PageArchive
+        :param profile: see ParseAppStorePage.profiles
+        :type profile: str
+        :param db_shards: split the app tables across this
+            many files if the db isn't sharded yet, see
+            db_shards.open_writer
+        :type db_shards: int
+        :param http_cache: pages are read from it before
+            being fetched, if given
+        :type http_cache: http_cache.HTTPCache
+        """
+        super().__init__(
+            pool_size=fetch_workers, parser_backend=parser_backend, archive=archive,
+            profile=profile, db_shards=db_shards, http_cache=http_cache
+        )
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.parse_workers * 2
+
+    def fetch_worker(self, url_queue, parse_pool, pending):
+        """Takes urls off the queue, fetches them and hands
+        the html to the parse pool.
+
+        :param url_queue:
+        :type url_queue: queue.Queue
+        :param parse_pool:
+        :type parse_pool: ProcessPoolExecutor
+        :param pending: limits the pages handed to the pool
+        :type pending: threading.BoundedSemaphore
+        """
+        while 1:
+            url = url_queue.get()
+            if url is None:
+                return
+            try:
+                source = self.get_request(url)
+                self.archive_page(url, source)
+                pending.acquire()
+                try:
+                    future = parse_pool.submit(
+                        parse_source, source, self.parser_backend, self.profile
+                    )
+                except Exception:
+                    # i.e. the pool is broken or shut down, so
+                    # parse_done won't be there to release it
+                    pending.release()
+                    raise
+                future.add_done_callback(
+                    lambda f, url=url: self.parse_done(url, f, pending)
+                )
+            except Exception as e:
+                self.fail_searched_url(url, e)
+
+    def parse_done(self, url, future, pending):
+        """Sends a parsed page on to the db writer.
+
+        :param url:
+        :type url: str
+        :param future:
+        :type future: concurrent.futures.Future
+        :param pending:
+        :type pending: threading.BoundedSemaphore
+        """
+        pending.release()
+        try:
+            ParseAppStorePage.write_record(future.result(), self.writer, self.profile)
+            self.remove_searched_url(url)
+        except Exception as e:
+            self.fail_searched_url(url, e)
+
+    def crawl_app_pages(self, url_list):
+        """Given a list of urls, runs them through the
+        fetch, parse and write stages.
+
+        :param url_list:
+        :type url_list: list
+        """
+        url_queue = queue.Queue(self.fetch_workers * 2)
+        pending = threading.BoundedSemaphore(self.max_pending)
+
+        with ProcessPoolExecutor(self.parse_workers) as parse_pool:
+            threads = [
+                threading.Thread(
+                    target=self.fetch_worker, daemon=1,
+                    args=(url_queue, parse_pool, pending)
+                )
+                for _ in range(self.fetch_workers)
+            ]
+            for thread in threads:
+                thread.start()
+            for url in url_list:
+                url_queue.put(url)
+            for _ in threads:
+                url_queue.put(None)
+            for thread in threads:
+                thread.join()
+        # leaving the with block waits for the last parses
+        self.writer.flush()
+
+
+if __name__ == '__main__':
+
+    c = PipelineCrawlAppStore()
+    c.crawl_app_pages_from_db()
+    c.close()
@@ -0,0 +1,211 @@
+import argparse
+import sqlite3
+from functools import partial
+from db_shards import read_shard_paths
+from migrations import migrate
+from parse_app_page import ParseAppStorePage
+
+p = ParseAppStorePage
+parse_float = partial(p.parse_number, cast=float)
+parse_int = partial(p.parse_number, cast=int)
+
+# typed field, the text field it's parsed from and how
+main_fields = (
+    ('price_value', 'price', p.parse_price),
+    ('size_bytes', 'size', p.parse_size),
+    ('current_version_rating', 'current_version_rating_value', parse_float),
+    ('current_version_review_count', 'current_version_rating_review_count', parse_int),
+    ('all_versions_rating', 'all_versions_rating_value', parse_float),
+    ('all_versions_review_count', 'all_versions_rating_review_count', parse_int),
+)
+
+
+def parse_column(values, parse, cache=None):
+    """Parses a column of text values, each distinct
+    value only once. Prices, sizes and ratings repeat a
+    lot across a batch, i.e. "Free" or "4.5".
+
+    :param values:
+    :type values: list
+    :param parse: i.e. ParseAppStorePage.parse_price
+    :type parse: function
+    :param cache: text mapped to its parsed value, kept
+        between calls if given
+    :type cache: dict
+    :rtype: list
+    """
+    if cache is None:
+        cache = {}
+    column = []
+    for value in values:
+        try:
+            column.append(cache[value])
+        except KeyError:
+            parsed = cache[value] = parse(value)
+            column.append(parsed)
+    return column
+
+
+def normalize_batch(output_dicts):
+    """Fills in the typed fields of a batch of output_dicts,
+    the same as calling ParseAppStorePage.normalize on each,
+    but a column at a time across the whole batch.
+
+    :param output_dicts: parsed with parse(normalize=False)
+    :type output_dicts: list
+    :return: output_dicts
+    :rtype: list
+    """
+    for field, text_field, parse in main_fields:
+        column = parse_column([x[text_field] for x in output_dicts], parse)
+        for output_dict, value in zip(output_dicts, column):
+            output_dict[field] = value
+    purchases = [y for x in output_dicts for y in x['top_in_app_purchases']]
+    column = parse_column([x['price'] for x in purchases], p.parse_price)
+    for purchase, value in zip(purchases, column):
+        purchase['price_value'] = value
+    reviews = [y for x in output_dicts for y in x['customer_reviews']]
+    column = parse_column([x['rating'] for x in reviews], parse_float)
+    for review, value in zip(reviews, column):
+        review['rating_value'] = value
+    return output_dicts
+
+
+def iter_batches(conn, table, columns, batch_size):
+    """Reads a table batch_size rows at a time, in rowid
+    order. Each batch is its own query from where the last
+    one stopped, so the table can be updated in between.
+
+    :param conn:
+    :type conn: sqlite3.Connection
+    :param table:
+    :type table: str
+    :param columns:
+    :type columns: str
+    :param batch_size:
+    :type batch_size: int
+    :return: lists of rows, without the rowid
+    :rtype: collections.Iterable[list]
+    """
+    last_rowid = 0
+    while 1:
+        rows = conn.execute(
+            'SELECT rowid, {} FROM {} WHERE rowid > ? ORDER BY rowid LIMIT ?'.format(
+                columns, table
+            ),
+            (last_rowid, batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1][0]
+        yield [x[1:] for x in rows]
+
+
+def normalize_db(conn, batch_size=500):
+    """Fills in the typed columns again from the text
+    columns of every row, i.e. after the parsing rules
+    change. Only the rows whose values change are
+    updated. The caller commits.
+
+    Rows are read and updated batch_size at a time, the
+    same size as the db writer's batches, so memory use
+    doesn't grow with the db.
+
+    :param conn:
+    :type conn: sqlite3.Connection
+    :param batch_size:
+    :type batch_size: int
+    :return: the number of rows updated in each table
+    :rtype: dict
+    """
+    counts = dict.fromkeys((
+        'app_store_main', 'app_store_top_in_app_purchases', 'app_store_customer_reviews'
+    ), 0)
+    # distinct values parsed so far, shared between batches
+    caches = [{} for _ in main_fields]
+    price_cache = caches[0]
+    rating_cache = {}
+
+    n = len(main_fields)
+    main_update_statement = """
+    UPDATE app_store_main SET {} WHERE app_id = ?
+    """.format(', '.join('{} = ?'.format(x[0]) for x in main_fields))
+    for main_rows in iter_batches(
+            conn, 'app_store_main', 'app_id, {}, {}'.format(
+                ', '.join(x[1] for x in main_fields), ', '.join(x[0] for x in main_fields)
+            ), batch_size):
+        columns = [
+            parse_column([x[i + 1] for x in main_rows], parse, cache)
+            for i, ((_, _, parse), cache) in enumerate(zip(main_fields, caches))
+        ]
+        main_updates = [
+            values + (x[0],) for x, values in zip(main_rows, zip(*columns))
+            if values != x[n + 1:]
+        ]
+        conn.executemany(main_update_statement, main_updates)
+        counts['app_store_main'] += len(main_updates)
+
+    for purchase_rows in iter_batches(
+            conn, 'app_store_top_in_app_purchases', 'app_id, "order", price, price_value',
+            batch_size):
+        column = parse_column([x[2] for x in purchase_rows], p.parse_price, price_cache)
+        purchase_updates = [
+            (value, x[0], x[1]) for x, value in zip(purchase_rows, column) if value != x[3]
+        ]
+        conn.executemany(
+            """
+            UPDATE app_store_top_in_app_purchases SET price_value = ?
+            WHERE app_id = ? AND "order" = ?
+            """,
+            purchase_updates
+        )
+        counts['app_store_top_in_app_purchases'] += len(purchase_updates)
+
+    for review_rows in iter_batches(
+            conn, 'app_store_customer_reviews', 'review_id, rating, rating_value',
+            batch_size):
+        column = parse_column([x[1] for x in review_rows], parse_float, rating_cache)
+        review_updates = [
+            (value, x[0]) for x, value in zip(review_rows, column) if value != x[2]
+        ]
+        conn.executemany(
+            """
+            UPDATE app_store_customer_reviews SET rating_value = ? WHERE review_id = ?
+            """,
+            review_updates
+        )
+        counts['app_store_customer_reviews'] += len(review_updates)
+    return counts
+
+
+def normalize(db='app_store_db', batch_size=500):
+    """Runs normalize_db on the db, or on each of its
+    shards if it's sharded, since the apps are there
+    rather than in the main file.
+
+    :param db:
+    :type db: str
+    :param batch_size:
+    :type batch_size: int
+    :return: the number of rows updated in each table
+    :rtype: dict
+    """
+    migrate(db)
+    counts = {}
+    for path in read_shard_paths(db) or [db]:
+        migrate(path)
+        with sqlite3.connect(path) as conn:
+            for table, count in normalize_db(conn, batch_size).items():
+                counts[table] = counts.get(table, 0) + count
+    return counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Fill in the typed columns of the db again from the text columns.'
+    )
+    parser.add_argument('--db', default='app_store_db')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    print(normalize(args.db, args.batch_size))
@@ -0,0 +1,237 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib import parse
+
+# what happened to a request, as far as the rate limiter cares
+OK = 'ok'
+THROTTLED = 'throttled'
+SERVER_ERROR = 'server_error'
+TIMEOUT = 'timeout'
+CLIENT_ERROR = 'client_error'
+
+# outcomes worth trying the request again for
+RETRYABLE = (THROTTLED, SERVER_ERROR, TIMEOUT)
+
+
+def classify_status(status_code):
+    """
+    :param status_code:
+    :type status_code: int
+    :return: the outcome for a response with the status code
+    :rtype: str
+    """
+    if status_code in (429, 503):
+        return THROTTLED
+    if status_code >= 500:
+        return SERVER_ERROR
+    if status_code >= 400:
+        return CLIENT_ERROR
+    return OK
+
+
+def parse_retry_after(value):
+    """Reads a Retry-After header, which is either a
+    number of seconds or an http date.
+
+    :param value:
+    :type value: str
+    :return: seconds to wait, or None
+    :rtype: float
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostState:
+    def __init__(self, rate, concurrency):
+        """The rate limiter's state for a single host.
+
+        :param rate: requests per second
+        :type rate: float
+        :param concurrency: requests allowed in flight
+        :type concurrency: float
+        """
+        self.rate = rate
+        self.concurrency = concurrency
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.failures = 0
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, initial_rate=0.5, min_rate=0.05, max_rate=20.0,
+                 increase=0.05, decrease=0.5, max_concurrency=16,
+                 base_backoff=5.0, max_backoff=300.0):
+        """Decides when each host can be sent another request.
+
+        Every host gets a token bucket filled at its current
+        rate, and a limit on requests in flight. Both grow a
+        little after every healthy response and are cut by
+        the decrease factor on throttling, server errors and
+        timeouts (additive increase, multiplicative decrease).
+        A throttled host is left alone for its Retry-After, or
+        an exponentially growing backoff if it didn't send one.
+
+        acquire blocks until a request may go out, and release
+        reports how it went.
+
+        :param initial_rate: requests per second to start at
+        :type initial_rate: float
+        :param min_rate:
+        :type min_rate: float
+        :param max_rate:
+        :type max_rate: float
+        :param increase: added to the rate after a healthy response
+        :type increase: float
+        :param decrease: the rate and concurrency are multiplied
+            by this after a bad one
+        :type decrease: float
+        :param max_concurrency:
+        :type max_concurrency: int
+        :param base_backoff: seconds, doubled for each
+            throttle in a row
+        :type base_backoff: float
+        :param max_backoff:
+        :type max_backoff: float
+        """
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_concurrency = max_concurrency
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.hosts = {}
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def host_of(url):
+        return parse.urlparse(url).netloc
+
+    def host_state(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.initial_rate, 1.0)
+        return self.hosts[host]
+
+    def try_acquire(self, url):
+        """Takes a slot for a request to the url if one
+        is free. Must be called holding self.condition.
+
+        :param url:
+        :type url: str
+        :return: 0 if the slot was taken, otherwise the seconds
+            to wait before trying again, or None to wait for
+            a request in flight to finish
+        :rtype: float
+        """
+        state = self.host_state(self.host_of(url))
+        now = time.monotonic()
+        # let through a second's worth of requests at once
+        capacity = max(1.0, state.rate)
+        state.tokens = min(capacity, state.tokens + (now - state.last_refill) * state.rate)
+        state.last_refill = now
+
+        if now < state.blocked_until:
+            return state.blocked_until - now
+        if state.in_flight >= int(state.concurrency):
+            return None
+        if state.tokens < 1:
+            return (1 - state.tokens) / state.rate
+        state.tokens -= 1
+        state.in_flight += 1
+        return 0
+
+    def acquire(self, url):
+        """Blocks until a request can be sent to the url.
+
+        :param url:
+        :type url: str
+        """
+        with self.condition:
+            while 1:
+                wait = self.try_acquire(url)
+                if wait == 0:
+                    return
+                self.condition.wait(wait)
+
+    def release(self, url, outcome, retry_after=None):
+        """Reports how a request acquired for the url went.
+
+        :param url:
+        :type url: str
+        :param outcome: one of the outcomes at the top of this module
+        :type outcome: str
+        :param retry_after: seconds the server asked us to wait
+        :type retry_after: float
+        """
+        with self.condition:
+            state = self.host_state(self.host_of(url))
+            state.in_flight -= 1
+            if outcome == OK:
+                state.failures = 0
+                state.rate = min(self.max_rate, state.rate + self.increase)
+                # roughly one more in flight per full window
+                state.concurrency = min(
+                    self.max_concurrency, state.concurrency + 1 / state.concurrency
+                )
+            elif outcome in RETRYABLE:
+                state.failures += 1
+                state.rate = max(self.min_rate, state.rate * self.decrease)
+                state.concurrency = max(1.0, state.concurrency * self.decrease)
+                if outcome == THROTTLED:
+                    if retry_after is None:
+                        retry_after = self.backoff(state.failures)
+                    state.blocked_until = max(
+                        state.blocked_until, time.monotonic() + retry_after
+                    )
+                    state.tokens = 0.0
+            self.condition.notify_all()
+
+    def backoff(self, attempt):
+        """Exponential backoff, jittered so retries from
+        several threads don't all land at once.
+
+        :param attempt: 1 for the first retry
+        :type attempt: int
+        :return: seconds to wait
+        :rtype: float
+        """
+        ceiling = min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def rate(self, url_or_host):
+        """
+        :param url_or_host:
+        :type url_or_host: str
+        :return: the current requests per second for the host
+        :rtype: float
+        """
+        host = self.host_of(url_or_host) or url_or_host
+        with self.condition:
+            return self.host_state(host).rate
+
+    def rates(self):
+        """
+        :return: every host mapped to its current rate,
+            concurrency and requests in flight
+        :rtype: dict
+        """
+        with self.condition:
+            return {
+                host: dict(rate=x.rate, concurrency=int(x.concurrency),
+                           in_flight=x.in_flight)
+                for host, x in self.hosts.items()
+            }
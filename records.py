@@ -0,0 +1,115 @@
+from collections import namedtuple
+
+# the columns of app_store_main, in order
+main_table_columns = (
+    'app_id', 'app_name', 'description', 'price', 'category',
+    'published_date', 'last_updated_date', 'version', 'size',
+    'seller', 'copyright', 'app_rating', 'compatibility',
+    'current_version_rating_value', 'current_version_rating_review_count',
+    'all_versions_rating_value', 'all_versions_rating_review_count',
+    'price_value', 'size_bytes', 'current_version_rating',
+    'current_version_review_count', 'all_versions_rating',
+    'all_versions_review_count'
+)
+
+
+class PurchaseRecord(namedtuple(
+        'PurchaseRecord', ('app_id', 'order', 'title', 'price', 'price_value'))):
+    """A top in app purchase, in the column order of
+    app_store_top_in_app_purchases, so it can be passed
+    to executemany as it is."""
+    __slots__ = ()
+
+
+class ReviewRecord(namedtuple(
+        'ReviewRecord', ('app_id', 'title', 'rating', 'user', 'content', 'rating_value'))):
+    """A customer review, in the column order of the
+    app_store_customer_reviews insert."""
+    __slots__ = ()
+
+
+class AppRecord(namedtuple(
+        'AppRecord',
+        main_table_columns + ('languages', 'top_in_app_purchases', 'customer_reviews'))):
+    """A parsed app page.
+
+    Records are tuples, so they take a fraction of the memory
+    of the equivalent dicts, pickle to a few hundred bytes
+    plus the text, and can be handed straight to executemany.
+    languages is a tuple of strings, and top_in_app_purchases
+    and customer_reviews are tuples of PurchaseRecord and
+    ReviewRecord.
+    """
+    __slots__ = ()
+
+    def main_row(self):
+        """
+        :return: the app_store_main row
+        :rtype: tuple
+        """
+        return self[:len(main_table_columns)]
+
+    def language_rows(self):
+        """
+        :return: the app_store_languages rows
+        :rtype: list
+        """
+        return [(self.app_id, x) for x in self.languages]
+
+    @classmethod
+    def from_output_dict(cls, output_dict):
+        """
+        :param output_dict: see ParseAppStorePage.output_dict
+        :type output_dict: dict
+        :rtype: AppRecord
+        """
+        app_id = output_dict['app_id']
+        return cls(
+            *(output_dict[x] for x in main_table_columns),
+            languages=tuple(output_dict['languages']),
+            top_in_app_purchases=tuple(
+                PurchaseRecord(app_id, x['order'], x['title'], x['price'], x['price_value'])
+                for x in output_dict['top_in_app_purchases']
+            ),
+            customer_reviews=tuple(
+                ReviewRecord(app_id, x['title'], x['rating'], x['user'], x['content'],
+                             x['rating_value'])
+                for x in output_dict['customer_reviews']
+            )
+        )
+
+    @classmethod
+    def from_list(cls, values):
+        """Rebuilds a record that went through json, which
+        turns it and its purchases and reviews into lists.
+
+        :param values:
+        :type values: list
+        :rtype: AppRecord
+        """
+        n = len(main_table_columns)
+        languages, purchases, reviews = values[n:]
+        return cls(
+            *values[:n],
+            languages=tuple(languages),
+            top_in_app_purchases=tuple(PurchaseRecord(*x) for x in purchases),
+            customer_reviews=tuple(ReviewRecord(*x) for x in reviews)
+        )
+
+    def to_output_dict(self):
+        """
+        :return: the record as a ParseAppStorePage.output_dict
+        :rtype: dict
+        """
+        output_dict = dict(zip(main_table_columns, self))
+        output_dict['languages'] = list(self.languages)
+        output_dict['top_in_app_purchases'] = [
+            dict(order=x.order, title=x.title, price=x.price, price_value=x.price_value)
+            for x in self.top_in_app_purchases
+        ]
+        output_dict['customer_reviews'] = [
+            dict(title=x.title, rating=x.rating, user=x.user, content=x.content,
+                 rating_value=x.rating_value)
+            for x in self.customer_reviews
+        ]
+        return output_dict
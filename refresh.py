@@ -0,0 +1,321 @@
+import hashlib
+import threading
+import time
+from app_store_crawler import CrawlAppStore
+from parse_app_page import ParseAppStorePage
+
+
+# noinspection SqlDialectInspection
+class RefreshAppStore(CrawlAppStore):
+
+    # changes to these fields get a row in app_store_app_history
+    history_fields = (
+        'version', 'price',
+        'current_version_rating_value', 'current_version_rating_review_count',
+        'all_versions_rating_value', 'all_versions_rating_review_count',
+    )
+
+    page_state_statement = """
+    INSERT INTO app_store_page_state
+    (url, app_id, etag, last_modified, content_hash, fetched, changed)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (url) DO UPDATE SET
+        app_id = coalesce(excluded.app_id, app_id),
+        etag = excluded.etag,
+        last_modified = excluded.last_modified,
+        content_hash = excluded.content_hash,
+        fetched = excluded.fetched,
+        changed = coalesce(excluded.changed, changed)
+    """
+    history_statement = """
+    INSERT INTO app_store_app_history (app_id, field, old_value, new_value, changed)
+    VALUES (?, ?, ?, ?, ?)
+    """
+    language_delete_statement = """
+    DELETE FROM app_store_languages WHERE app_id = ? AND language = ?
+    """
+    purchases_delete_statement = """
+    DELETE FROM app_store_top_in_app_purchases WHERE app_id = ? AND "order" > ?
+    """
+
+    def __init__(self, pool_size=10, parser_backend='html.parser', archive=None,
+                 db_shards=None, http_cache=None):
+        """Refreshes apps that have already been crawled.
+
+        Each page is requested with the ETag and Last-Modified
+        it was last served with, so unchanged pages come back
+        as an empty 304. Pages that do come back are hashed, and
+        only parsed if the hash differs from last time. Parsed
+        pages are compared with what's in the db and only the
+        fields that changed are written, with version, price and
+        rating changes recorded in app_store_app_history.
+
+        :param pool_size:
+        :type pool_size: int
+        :param parser_backend: see ParseAppStorePage.backends
+        :type parser_backend: str
+        :param archive: keeps the raw html of changed pages if given
+        :type archive: page_archive.PageArchive
+        :param db_shards: the db's shard count, see
+            db_shards.open_writer. A sharded db is refreshed
+            in its shards either way.
+        :type db_shards: int
+        :param http_cache: refreshes always go to the network,
+            but the pages they get are stored in it, so the
+            other crawlers see them
+        :type http_cache: http_cache.HTTPCache
+        """
+        super().__init__(
+            pool_size=pool_size, parser_backend=parser_backend, archive=archive,
+            db_shards=db_shards, http_cache=http_cache
+        )
+        self.counts = dict(not_modified=0, unchanged=0, changed=0, new=0, failed=0)
+        self.counts_lock = threading.Lock()
+
+    def fetch_page_state(self, url):
+        """
+        :param url:
+        :type url: str
+        :return: the etag, last modified and content hash
+            from the last fetch of the url, or None
+        :rtype: tuple
+        """
+        with self.db_lock:
+            return self.read_conn.execute(
+                """
+                SELECT etag, last_modified, content_hash
+                FROM app_store_page_state WHERE url = ?
+                """,
+                (url,)
+            ).fetchone()
+
+    def fetch_stored_app(self, app_id):
+        """Reads an app as it is in the db.
+
+        :param app_id:
+        :type app_id: str
+        :return: the main table row as a dict plus the
+            languages, purchases and reviews, or None if
+            the app isn't in the db
+        :rtype: dict
+        """
+        columns = ParseAppStorePage.main_table_columns
+        with self.db_lock:
+            cursor = self.app_read_conn(app_id).cursor()
+            cursor.execute(
+                'SELECT {} FROM app_store_main WHERE app_id = ?'.format(', '.join(columns)),
+                (app_id,)
+            )
+            main_row = cursor.fetchone()
+            if main_row is None:
+                return None
+            stored = dict(zip(columns, main_row))
+            cursor.execute(
+                'SELECT language FROM app_store_languages WHERE app_id = ?',
+                (app_id,)
+            )
+            stored['languages'] = {x[0] for x in cursor.fetchall()}
+            cursor.execute(
+                """
+                SELECT "order", title, price, price_value
+                FROM app_store_top_in_app_purchases WHERE app_id = ?
+                ORDER BY "order"
+                """,
+                (app_id,)
+            )
+            stored['top_in_app_purchases'] = cursor.fetchall()
+            cursor.execute(
+                """
+                SELECT title, rating, user, content
+                FROM app_store_customer_reviews WHERE app_id = ?
+                """,
+                (app_id,)
+            )
+            stored['customer_reviews'] = set(cursor.fetchall())
+        return stored
+
+    def changed_rows(self, parsed, stored):
+        """Works out what needs writing to bring the stored
+        app up to date with the parsed page.
+
+        :param parsed:
+        :type parsed: ParseAppStorePage
+        :param stored: see fetch_stored_app
+        :type stored: dict
+        :return: a list of (statement, list of row tuples)
+        :rtype: list
+        """
+        d = parsed.output_dict
+        app_id = d['app_id']
+        now = time.time()
+        rows = []
+
+        changed_columns = [
+            x for x in ParseAppStorePage.main_table_columns[1:]
+            if d[x] != stored[x]
+        ]
+        if changed_columns:
+            update_statement = 'UPDATE app_store_main SET {} WHERE app_id = ?'.format(
+                ', '.join('{} = ?'.format(x) for x in changed_columns)
+            )
+            rows.append((
+                update_statement,
+                [tuple(d[x] for x in changed_columns) + (app_id,)]
+            ))
+            rows.append((self.history_statement, [
+                (app_id, x, stored[x], d[x], now)
+                for x in changed_columns if x in self.history_fields
+            ]))
+
+        languages = set(d['languages'])
+        rows.append((self.language_delete_statement, [
+            (app_id, x) for x in stored['languages'] - languages
+        ]))
+        rows.append((parsed.languages_insert_statement, [
+            (app_id, x) for x in languages - stored['languages']
+        ]))
+
+        purchases = [
+            (x['order'], x['title'], x['price'], x['price_value'])
+            for x in d['top_in_app_purchases']
+        ]
+        if purchases != stored['top_in_app_purchases']:
+            rows.append((parsed.purchases_insert_statement, [
+                (app_id,) + x for x in purchases
+            ]))
+            rows.append((self.purchases_delete_statement, [
+                (app_id, len(purchases))
+            ]))
+
+        rows.append((parsed.customer_reviews_insert_statement, [
+            (app_id, x['title'], x['rating'], x['user'], x['content'], x['rating_value'])
+            for x in d['customer_reviews']
+            if (x['title'], x['rating'], x['user'], x['content'])
+            not in stored['customer_reviews']
+        ]))
+        # apps where only the languages, purchases or reviews
+        # changed get a new updated_at from migration_13's triggers
+        return [x for x in rows if x[1]]
+
+    def count(self, outcome):
+        with self.counts_lock:
+            self.counts[outcome] += 1
+
+    def remove_searched_url(self, url):
+        """Refreshed urls are already done in the frontier,
+        so they're left as they are.
+
+        :param url:
+        :type url: str
+        """
+
+    def fail_searched_url(self, url, error):
+        """Counts a failed refresh. The url stays done in the
+        frontier, with the app as it was last crawled.
+
+        :param url:
+        :type url: str
+        :param error:
+        :type error: Exception
+        """
+        print(url)
+        print(error)
+        self.count('failed')
+
+    def scrape_app_page(self, url):
+        """Refresh a single url.
+
+        :param url:
+        :type url: str
+        """
+        state = self.fetch_page_state(url)
+        etag = last_modified = content_hash = None
+        if state is not None:
+            etag, last_modified, content_hash = state
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        r = self.get_response(url, headers)
+        now = time.time()
+        if r.status_code == 304:
+            # from the state we sent, or from an intermediary
+            # when there wasn't any
+            self.writer.put(self.page_state_statement, [
+                (url, None, etag, last_modified, content_hash, now, None)
+            ])
+            self.count('not_modified')
+            return
+        r.raise_for_status()
+
+        if self.http_cache is not None:
+            self.http_cache.put(url, r.text)
+        etag = r.headers.get('ETag')
+        last_modified = r.headers.get('Last-Modified')
+        new_hash = hashlib.sha256(r.content).hexdigest()
+        if new_hash == content_hash:
+            # the server doesn't do conditional requests
+            # but the page is the same, so skip the parse
+            self.writer.put(self.page_state_statement, [
+                (url, None, etag, last_modified, new_hash, now, None)
+            ])
+            self.count('unchanged')
+            return
+
+        self.archive_page(url, r.text)
+        parsed = self.parse_page(r.text)
+        app_id = parsed.output_dict['app_id']
+        stored = self.fetch_stored_app(app_id)
+        if stored is None:
+            parsed.write_out(self.writer)
+            self.count('new')
+        else:
+            changes = self.changed_rows(parsed, stored)
+            # to the app's shard, all in one transaction
+            self.writer.writer_for(app_id).put_all(changes)
+            self.count('changed' if changes else 'unchanged')
+        # only once the app is, so a crash in between means
+        # the page is parsed again next time
+        self.writer.put_after(app_id, self.page_state_statement, [
+            (url, app_id, etag, last_modified, new_hash, now, now)
+        ])
+
+    def iter_done_urls(self, batch_size=500):
+        """Yields every url the frontier has marked as done,
+        reading them from the db a batch at a time.
+
+        :param batch_size:
+        :type batch_size: int
+        :rtype: collections.Iterable[str]
+        """
+        last_rowid = 0
+        while 1:
+            with self.db_lock:
+                rows = self.read_conn.execute(
+                    """
+                    SELECT rowid, url FROM app_store_app_urls
+                    WHERE state = 'done' AND rowid > ?
+                    ORDER BY rowid LIMIT ?
+                    """,
+                    (last_rowid, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for _, url in rows:
+                yield url
+            last_rowid = rows[-1][0]
+
+    def refresh_from_db(self):
+        """Refresh every app that's already been crawled."""
+        self.writer.flush()
+        self.crawl_app_pages(self.iter_done_urls())
+
+
+if __name__ == '__main__':
+
+    c = RefreshAppStore()
+    c.refresh_from_db()
+    print(c.counts)
+    c.close()
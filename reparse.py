@@ -0,0 +1,118 @@
+import argparse
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from db_shards import open_writer
+from migrations import migrate
+from page_archive import PageArchive, read_pages
+from parse_app_page import ParseAppStorePage
+from postprocess import normalize_batch
+
+
+def parse_batch(segment_path, batch, backend):
+    """Parses a batch of archived pages in a parse worker process.
+
+    This has to be a module level function so it
+    can be sent to the worker processes.
+
+    :param segment_path:
+    :type segment_path: str
+    :param batch: (url, offset, length, codec) for each page
+    :type batch: list
+    :param backend:
+    :type backend: str
+    :return: (url, record or None, error or None) for each page
+    :rtype: list
+    """
+    results = []
+    sources = read_pages(segment_path, [x[1:] for x in batch])
+    for (url, _, _, _), source in zip(batch, sources):
+        try:
+            parsed = ParseAppStorePage(source, backend)
+            parsed.parse(normalize=False)
+            results.append((url, parsed, None))
+        except Exception as e:
+            results.append((url, None, str(e)))
+    # the typed fields are filled in for the whole batch at once
+    normalize_batch([x[1].output_dict for x in results if x[2] is None])
+    return [
+        (url, None if parsed is None else parsed.to_record(), error)
+        for url, parsed, error in results
+    ]
+
+
+def reparse(archive_path='app_store_archive', db='app_store_db', workers=None,
+            parser_backend='html.parser', batch_size=200, db_shards=None):
+    """Parses the latest archived copy of every app again and
+    writes the results to the db, without any network.
+
+    Batches of pages go to a pool of processes, which read them
+    straight out of the memory mapped segment files.
+
+    :param archive_path:
+    :type archive_path: str
+    :param db:
+    :type db: str
+    :param workers: defaults to the number of cores
+    :type workers: int
+    :param parser_backend: see ParseAppStorePage.backends
+    :type parser_backend: str
+    :param batch_size: pages handed to a worker at once
+    :type batch_size: int
+    :param db_shards: split the app tables across this
+        many files if the db isn't sharded yet, see
+        db_shards.open_writer
+    :type db_shards: int
+    :return: the number of pages parsed and failed
+    :rtype: dict
+    """
+    workers = workers or os.cpu_count() or 1
+    migrate(db)
+    writer = open_writer(db, db_shards).start()
+    archive = PageArchive(archive_path)
+    counts = dict(parsed=0, failed=0)
+    # keeps a couple of batches per worker queued up
+    pending = threading.BoundedSemaphore(workers * 2)
+
+    def batch_done(future):
+        try:
+            for url, record, error in future.result():
+                if error is None:
+                    ParseAppStorePage.write_record(record, writer)
+                    counts['parsed'] += 1
+                else:
+                    print(url)
+                    print(error)
+                    counts['failed'] += 1
+        except Exception as e:
+            print(e)
+        finally:
+            pending.release()
+
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            for segment_path, batch in archive.iter_latest(batch_size):
+                pending.acquire()
+                future = pool.submit(parse_batch, segment_path, batch, parser_backend)
+                future.add_done_callback(batch_done)
+    finally:
+        archive.close()
+        writer.close()
+    return counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Parse the archived app pages again and write them to the db.'
+    )
+    parser.add_argument('--archive', default='app_store_archive')
+    parser.add_argument('--db', default='app_store_db')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--backend', default='html.parser',
+                        choices=sorted(ParseAppStorePage.backends))
+    parser.add_argument('--db-shards', type=int,
+                        help='split the app tables across this many files')
+    args = parser.parse_args()
+    print(reparse(args.archive, args.db, args.workers, args.backend,
+                  db_shards=args.db_shards))
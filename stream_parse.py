@@ -0,0 +1,416 @@
+import codecs
+from html import escape
+from html.parser import HTMLParser
+from parse_app_page import InvalidPageException, ParseAppStorePage, language_regex
+
+# elements that never have an end tag
+void_elements = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+))
+# the labels of the two rating divs, mapped to their fields
+rating_labels = {
+    'Current Version:': 'current_version',
+    'All Versions:': 'all_versions',
+}
+
+
+def has_class(attrs, name):
+    """
+    :param attrs:
+    :type attrs: dict
+    :param name:
+    :type name: str
+    :return: whether name is one of the element's classes
+    :rtype: bool
+    """
+    return name in (attrs.get('class') or '').split()
+
+
+def start_tag_html(tag, attrs, void=False):
+    """Writes a start tag back out the way BeautifulSoup
+    does, so the description comes out the same.
+
+    :param tag:
+    :type tag: str
+    :param attrs:
+    :type attrs: list
+    :param void:
+    :type void: bool
+    :rtype: str
+    """
+    parts = [tag] + [
+        '{}="{}"'.format(name, escape(value or '', quote=False).replace('"', '&quot;'))
+        for name, value in attrs
+    ]
+    return '<{}{}>'.format(' '.join(parts), '/' if void else '')
+
+
+class Frame:
+    """An element that's been opened and not closed yet."""
+    __slots__ = ('tag', 'attrs', 'role', 'key', 'text', 'own_text', 'has_children')
+
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = attrs
+        # what the element is to the parser, see start_element
+        self.role = None
+        self.key = None
+        # all the text inside, if it's being captured
+        self.text = None
+        # the text directly inside, if there's no child element,
+        # which is what BeautifulSoup's text= matches against
+        self.own_text = []
+        self.has_children = False
+
+
+class StreamingParseAppStorePage(ParseAppStorePage, HTMLParser):
+
+    def __init__(self, source_page='', profile='full'):
+        """Parses an app page as it downloads. Chunks of html
+        are fed in as they arrive and each field is picked out
+        as soon as its tags have been seen, without ever
+        building a tree.
+
+        feed returns True once every field has been found, so
+        the rest of the page doesn't need to be downloaded.
+        On the app pages that's the end of the left-stack
+        column, a good way before the end of the html.
+
+        The output_dict comes out the same as parse gives.
+        A field that isn't there, like the in app purchases,
+        can't be ruled out until the part of the page it would
+        be in has ended, so pages without reviews are read to
+        the end unless the profile leaves them out.
+
+        :param source_page: to parse it all at once with parse
+        :type source_page: str
+        :param profile: see ParseAppStorePage.profiles
+        :type profile: str
+        """
+        ParseAppStorePage.__init__(self, source_page, profile=profile)
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.reviews = 'customer_reviews' in self.fields
+        self.stack = []
+        self.capturing = []
+        self.found = set()
+        # the description paragraph, written back out as html
+        self.description_frame = None
+        self.description_parts = []
+        # the text after a "Size: " or "Languages: " label
+        self.sibling_key = None
+        self.sibling_parts = []
+        # a rating label was seen, its rating is the next div
+        self.pending_rating = None
+        self.rating = None
+        self.purchases = None
+        self.purchase = None
+        self.review = None
+        self.done = False
+        # the fields still to be found, a field is given up on
+        # once the section it would be in has ended
+        self.needed_fields = set(self.fields)
+
+    def capture(self, frame, role, key=None):
+        frame.role = role
+        frame.key = key
+        frame.text = []
+        self.capturing.append(frame)
+
+    def capture_once(self, frame, key):
+        if key not in self.found and key in self.fields:
+            self.found.add(key)
+            self.capture(frame, 'field', key)
+
+    def found_fields(self, *fields):
+        self.needed_fields.difference_update(fields)
+        if not self.needed_fields:
+            self.done = True
+
+    def end_sibling(self):
+        text = ''.join(self.sibling_parts)
+        if self.sibling_key == 'size':
+            self.output_dict['size'] = text
+        else:
+            self.output_dict['languages'] = text.split(', ')
+        self.found_fields(self.sibling_key)
+        self.sibling_key = None
+        self.sibling_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.sibling_key is not None:
+            self.end_sibling()
+        void = tag in void_elements
+        if self.description_frame is not None:
+            self.description_parts.append(start_tag_html(tag, attrs, void))
+        if self.stack:
+            self.stack[-1].has_children = True
+        attrs = dict(attrs)
+        if void:
+            if (tag == 'meta' and attrs.get('name') == 'apple:content_id'
+                    and 'app_id' not in self.found):
+                self.found.add('app_id')
+                self.output_dict['app_id'] = attrs.get('content') or ''
+                self.found_fields('app_id')
+            return
+        frame = Frame(tag, attrs)
+        self.stack.append(frame)
+        self.start_element(frame)
+
+    # noinspection PyTypeChecker
+    def start_element(self, frame):
+        """Works out what an element that just opened holds."""
+        tag = frame.tag
+        attrs = frame.attrs
+        itemprop = attrs.get('itemprop')
+
+        if tag == 'div':
+            if self.pending_rating is not None:
+                # the rating value is taken from the aria-label
+                # unless there's a ratingValue span in it
+                field = self.pending_rating
+                self.pending_rating = None
+                self.rating = field
+                frame.role = 'rating'
+                self.output_dict[field + '_rating_value'] = self.parse_rating(
+                    attrs.get('aria-label') or '')
+            elif attrs.get('metrics-loc') == 'Titledbox_Description':
+                frame.role = 'description'
+            elif attrs.get('id') == 'left-stack':
+                frame.role = 'left-stack'
+            elif has_class(attrs, 'customer-reviews') and self.reviews:
+                if 'customer_reviews' not in self.found:
+                    self.found.add('customer_reviews')
+                    frame.role = 'customer-reviews'
+            elif has_class(attrs, 'customer-review') and self.reviews:
+                if self.in_role('customer-reviews'):
+                    frame.role = 'review'
+                    self.review = {}
+            elif has_class(attrs, 'rating') and self.review is not None:
+                if 'rating' not in self.review:
+                    self.review['rating'] = self.parse_rating(attrs.get('aria-label') or '')
+            elif itemprop == 'price':
+                self.capture_once(frame, 'price')
+            elif has_class(attrs, 'app-rating'):
+                self.capture_once(frame, 'app_rating')
+            elif attrs.get('metrics-loc') == 'Titledbox_Top In-App Purchases':
+                if ('top_in_app_purchases' not in self.found
+                        and 'top_in_app_purchases' in self.fields):
+                    self.found.add('top_in_app_purchases')
+                    frame.role = 'purchases'
+                    self.purchases = []
+
+        elif tag == 'span':
+            if itemprop == 'applicationCategory':
+                self.capture_once(frame, 'category')
+            elif itemprop == 'datePublished':
+                if 'last_updated_date' not in self.found and 'last_updated_date' in self.fields:
+                    self.output_dict['published_date'] = attrs.get('content') or ''
+                self.capture_once(frame, 'last_updated_date')
+            elif itemprop == 'softwareVersion':
+                self.capture_once(frame, 'version')
+            elif itemprop == 'operatingSystem':
+                self.capture_once(frame, 'compatibility')
+            elif itemprop == 'author':
+                if 'author' not in self.found and 'seller' in self.fields:
+                    self.found.add('author')
+                    frame.role = 'author'
+            elif self.in_role('author'):
+                self.capture_once(frame, 'seller')
+            elif self.rating is not None and itemprop == 'ratingValue':
+                self.capture(frame, 'rating-field', '_rating_value')
+            elif self.rating is not None and has_class(attrs, 'rating-count'):
+                self.capture(frame, 'rating-field', '_rating_review_count')
+            elif self.purchase is not None and has_class(attrs, 'in-app-title'):
+                self.capture(frame, 'purchase-field', 'title')
+            elif self.purchase is not None and has_class(attrs, 'in-app-price'):
+                self.capture(frame, 'purchase-field', 'price')
+            elif self.review is not None and has_class(attrs, 'customerReviewTitle'):
+                self.capture(frame, 'review-field', 'title')
+            elif self.review is not None and has_class(attrs, 'user-info'):
+                self.capture(frame, 'review-field', 'user')
+
+        elif tag == 'h1':
+            if itemprop == 'name':
+                self.capture_once(frame, 'app_name')
+
+        elif tag == 'p':
+            if (self.in_role('description') and 'description' not in self.found
+                    and 'description' in self.fields):
+                self.found.add('description')
+                frame.role = 'description-p'
+                self.description_frame = frame
+            elif self.review is not None and has_class(attrs, 'content'):
+                self.capture(frame, 'review-field', 'content')
+
+        elif tag == 'li':
+            if has_class(attrs, 'copyright'):
+                self.capture_once(frame, 'copyright')
+            elif self.purchases is not None:
+                frame.role = 'purchase'
+                self.purchase = {}
+
+    def in_role(self, role):
+        """
+        :param role:
+        :type role: str
+        :return: whether an element with role is open
+        :rtype: bool
+        """
+        for frame in reversed(self.stack):
+            if frame.role == role:
+                return True
+        return False
+
+    def handle_endtag(self, tag):
+        if tag in void_elements:
+            return
+        if self.sibling_key is not None:
+            self.end_sibling()
+        # close anything left open inside it, like BeautifulSoup
+        # does, and ignore end tags that were never opened
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i].tag == tag:
+                break
+        else:
+            return
+        while len(self.stack) > i:
+            self.end_element(self.stack.pop())
+
+    # noinspection PyTypeChecker
+    def end_element(self, frame):
+        """Stores what an element that just closed held."""
+        if frame is self.description_frame:
+            self.description_frame = None
+            self.output_dict['description'] = ''.join(self.description_parts).replace(
+                '<br/>', '\n')
+            self.found_fields('description')
+        elif self.description_frame is not None:
+            self.description_parts.append('</{}>'.format(frame.tag))
+
+        text = None
+        if frame.text is not None:
+            self.capturing.remove(frame)
+            text = ''.join(frame.text)
+        role = frame.role
+
+        if role is None:
+            if not frame.has_children:
+                own_text = ''.join(frame.own_text)
+                if frame.tag == 'div' and own_text in rating_labels:
+                    if (own_text not in self.found
+                            and rating_labels[own_text] + '_rating_value' in self.fields):
+                        self.found.add(own_text)
+                        self.pending_rating = rating_labels[own_text]
+                elif frame.tag == 'span':
+                    if own_text == 'Size: ' and 'size' not in self.found and 'size' in self.fields:
+                        self.found.add('size')
+                        self.sibling_key = 'size'
+                    elif (language_regex.search(own_text) and 'languages' not in self.found
+                          and 'languages' in self.fields):
+                        self.found.add('languages')
+                        self.sibling_key = 'languages'
+        elif role == 'field':
+            if frame.key == 'compatibility':
+                text = text.replace('\xa0', ' ')
+            self.output_dict[frame.key] = text
+            if frame.key == 'last_updated_date':
+                self.found_fields('published_date')
+            self.found_fields(frame.key)
+        elif role == 'rating-field':
+            if frame.key == '_rating_review_count':
+                text = text.replace(' Ratings', '')
+            self.output_dict[self.rating + frame.key] = text
+        elif role == 'rating':
+            self.found_fields(self.rating + '_rating_value', self.rating + '_rating_review_count')
+            self.rating = None
+        elif role == 'purchase-field':
+            self.purchase[frame.key] = text
+        elif role == 'purchase':
+            if self.purchase:
+                self.purchase['order'] = len(self.purchases) + 1
+                self.purchases.append(self.purchase)
+            self.purchase = None
+        elif role == 'purchases':
+            self.output_dict['top_in_app_purchases'] = self.purchases
+            self.purchases = None
+            self.found_fields('top_in_app_purchases')
+        elif role == 'review-field':
+            if frame.key == 'user':
+                text = self.clean_user(text)
+            self.review.setdefault(frame.key, text)
+        elif role == 'review':
+            review = self.review
+            self.review = None
+            self.output_dict['customer_reviews'].append(dict(
+                title=review.get('title', ''), rating=review.get('rating', ''),
+                user=review.get('user', ''), content=review.get('content', ''),
+            ))
+        elif role == 'description':
+            self.found_fields(*self.sections['Titledbox_Description'])
+        elif role in ('left-stack', 'customer-reviews'):
+            self.found_fields(*self.sections[role])
+
+    def handle_data(self, data):
+        if self.stack:
+            self.stack[-1].own_text.append(data)
+        for frame in self.capturing:
+            frame.text.append(data)
+        if self.description_frame is not None:
+            self.description_parts.append(escape(data, quote=False))
+        if self.sibling_key is not None:
+            self.sibling_parts.append(data)
+
+    def feed(self, data):
+        """Parses the next chunk of the page.
+
+        :param data:
+        :type data: str
+        :return: whether every field has been found
+        :rtype: bool
+        """
+        if not self.done:
+            HTMLParser.feed(self, data)
+        return self.done
+
+    def finish(self):
+        """Wraps up the parse once the page has ended,
+        or enough of it has been read.
+
+        :return: the normalized output_dict
+        :rtype: dict
+        """
+        if not self.done:
+            self.close()
+        if self.sibling_key is not None:
+            self.end_sibling()
+        if not self.output_dict['app_id']:
+            raise InvalidPageException("No App ID found.")
+        self.normalize()
+        return self.output_dict
+
+    def parse(self, chunk_size=16384):
+        # fed in chunks so it can stop before the end
+        for i in range(0, len(self.source_page), chunk_size):
+            if self.feed(self.source_page[i:i + chunk_size]):
+                break
+        return self.finish()
+
+    def parse_stream(self, chunks, encoding='utf-8'):
+        """Parses chunks of bytes as they come in, stopping
+        as soon as every field has been found.
+
+        :param chunks: i.e. requests.Response.iter_content()
+        :type chunks: collections.Iterable[bytes]
+        :param encoding:
+        :type encoding: str
+        :return: the normalized output_dict
+        :rtype: dict
+        """
+        decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+        for chunk in chunks:
+            if self.feed(decoder.decode(chunk)):
+                break
+        else:
+            self.feed(decoder.decode(b'', final=True))
+        return self.finish()
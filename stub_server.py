@@ -0,0 +1,159 @@
+import hashlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # crawlers that stop reading a page part way
+        # through drop the connection, which is fine
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class StubAppStoreServer:
+    def __init__(self, pages=None, default_page='', latency=0.0, port=0,
+                 etags=False, throttle_every=0, retry_after=1, lookup_results=None):
+        """A local HTTP server that stands in for the app store
+        so the crawlers can be run without hitting Apple.
+
+        Requests for a path in pages get that html back, any
+        other path gets default_page. Every response is delayed
+        by latency seconds. With etags on, responses carry an
+        ETag and a matching If-None-Match gets a 304. With
+        throttle_every set, every nth request gets a 429 with
+        a Retry-After of retry_after seconds.
+
+        Requests for /lookup?id=1,2,3 are answered like the
+        iTunes lookup API, with the lookup_results for the ids
+        asked for that are in it.
+
+        Use it as a context manager:
+
+            with StubAppStoreServer(default_page=html) as server:
+                crawler.crawl_app_pages([server.url('/app/id1')])
+
+        :param pages: maps a path (with query string) to html
+        :type pages: dict
+        :param default_page:
+        :type default_page: str
+        :param latency:
+        :type latency: float
+        :param port: 0 picks a free port
+        :type port: int
+        :param etags:
+        :type etags: bool
+        :param throttle_every:
+        :type throttle_every: int
+        :param retry_after:
+        :type retry_after: int
+        :param lookup_results: maps an app id to its lookup
+            result, i.e. from App Store lookup example.json
+        :type lookup_results: dict
+        """
+        self.pages = pages or {}
+        self.default_page = default_page
+        self.latency = latency
+        self.etags = etags
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.lookup_results = lookup_results or {}
+        self.request_count = 0
+        self.count_lock = threading.Lock()
+        self.server = QuietHTTPServer(('127.0.0.1', port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stub.count_lock:
+                    stub.request_count += 1
+                    count = stub.request_count
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub.throttle_every and count % stub.throttle_every == 0:
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(stub.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                url = parse.urlparse(self.path)
+                if url.path == '/lookup':
+                    ids = parse.parse_qs(url.query).get('id', [''])[0].split(',')
+                    results = [stub.lookup_results[x] for x in ids if x in stub.lookup_results]
+                    body = json.dumps(
+                        dict(resultCount=len(results), results=results)
+                    ).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/javascript; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                body = stub.pages.get(self.path, stub.default_page).encode('utf-8')
+                etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+                if stub.etags and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                if stub.etags:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def url(self, path='/'):
+        """Builds an absolute url on this server.
+
+        :param path:
+        :type path: str
+        :rtype: str
+        """
+        return 'http://127.0.0.1:{}{}'.format(self.port, path)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=1)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+
+    with StubAppStoreServer(
+        default_page=open('App Store app example.htm').read(), port=8000
+    ) as s:
+        print('serving the example page on', s.url())
+        s.thread.join()
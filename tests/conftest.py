@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pytest
+import requests
+
+# the modules live in the repo root
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app_store_crawler import CrawlAppStore  # noqa: E402
+from rate_limiter import AdaptiveRateLimiter  # noqa: E402
+
+
+@pytest.fixture
+def example_page():
+    with open(os.path.join(root, 'App Store app example.htm')) as f:
+        return f.read()
+
+
+@pytest.fixture
+def in_tmp(tmp_path, monkeypatch):
+    """Runs the test in a temporary directory, since the
+    crawler keeps its db in the working directory."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def make_response(body='', status_code=200, headers=None):
+    """A requests.Response with its body already read.
+
+    :param body:
+    :type body: str
+    :param status_code:
+    :type status_code: int
+    :param headers:
+    :type headers: dict
+    :rtype: requests.Response
+    """
+    r = requests.Response()
+    r.status_code = status_code
+    r._content = body.encode('utf-8')
+    r._content_consumed = True
+    r.encoding = 'utf-8'
+    r.headers.update(headers or {})
+    return r
+
+
+class FakeSession:
+    def __init__(self, results):
+        """Stands in for the crawler's requests session.
+
+        :param results: what each get returns in turn, an
+            exception instance is raised instead
+        :type results: list
+        """
+        self.results = list(results)
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def crawler(in_tmp):
+    """A crawler with no rate limit or backoff, in a
+    temporary directory."""
+    c = CrawlAppStore(
+        rate_limiter=AdaptiveRateLimiter(
+            initial_rate=1000, max_rate=1000, base_backoff=0.0
+        ),
+        max_retries=2
+    )
+    yield c
+    c.close()
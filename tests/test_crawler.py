@@ -0,0 +1,48 @@
+import sqlite3
+
+import requests
+
+from conftest import FakeSession, make_response
+from app_store_crawler import CrawlAppStore
+from rate_limiter import AdaptiveRateLimiter
+from stub_server import StubAppStoreServer
+
+
+def test_crawls_the_frontier(in_tmp, example_page):
+    paths = ['/us/app/x/id{}?mt=8'.format(x) for x in range(6)]
+    pages = {x: example_page.replace('1121971067', str(i)) for i, x in enumerate(paths)}
+    pages[paths[-1]] = '<html></html>'
+    with StubAppStoreServer(pages=pages) as server:
+        c = CrawlAppStore(pool_size=3)
+        c.rate_limiter = AdaptiveRateLimiter(initial_rate=1000, max_rate=1000, base_backoff=0.0)
+        c.frontier.add([server.url(x) for x in paths])
+        c.crawl_app_pages_from_db()
+        c.close()
+    with sqlite3.connect('app_store_db') as conn:
+        assert conn.execute('SELECT count(*) FROM app_store_main').fetchone()[0] == 5
+        states = dict(conn.execute(
+            'SELECT state, count(*) FROM app_store_app_urls GROUP BY state'
+        ).fetchall())
+    # the broken page isn't done, whether it's back to
+    # pending or was retried until it failed for good
+    assert states['done'] == 5 and sum(states.values()) == 6
+
+
+def test_failed_category_shards_are_recorded(crawler):
+    genre = 'https://itunes.apple.com/us/genre/ios-games/id6014'
+    link = 'https://itunes.apple.com/us/app/x/id1?mt=8'
+    crawler.letters = ['A', 'B']
+    crawler.session = FakeSession(
+        [requests.ConnectionError('refused')] * 3 + [
+            make_response('<a href="{}">x</a>'.format(link)), make_response('')
+        ]
+    )
+    assert crawler.crawl_categories([genre], workers=1, discover_subgenres=False) == 1
+    assert crawler.fetch_failed_shards() == {(genre, 'A'): 'refused'}
+    assert crawler.fetch_shard_progress() == {(genre, 'A'): (1, False), (genre, 'B'): (2, True)}
+
+    # the next run only retries the failed shard, and clears its error
+    crawler.session = FakeSession([make_response('')])
+    assert crawler.crawl_categories([genre], workers=1, discover_subgenres=False) == 0
+    assert crawler.fetch_failed_shards() == {}
+    assert crawler.fetch_shard_progress()[(genre, 'A')] == (1, True)
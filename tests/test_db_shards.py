@@ -0,0 +1,82 @@
+import sqlite3
+
+import pytest
+
+from app_store_crawler import CrawlAppStore
+from db_shards import (
+    ShardedWriter, create_shards, open_writer, read_shard_paths, shard_index, sum_rows
+)
+from frontier import CrawlFrontier
+from parse_app_page import ParseAppStorePage
+from postprocess import normalize
+from refresh import RefreshAppStore
+
+url = 'http://example.com/us/app/x/id1121971067?mt=8'
+insert_app = 'INSERT INTO app_store_main (app_id, app_name) VALUES (?, ?)'
+
+
+def test_shards_are_recorded_in_the_main_db(in_tmp):
+    paths = create_shards('app_store_db', 3)
+    assert read_shard_paths('app_store_db') == paths
+    assert create_shards('app_store_db', 3) == paths
+    with pytest.raises(ValueError):
+        create_shards('app_store_db', 4)
+
+
+def test_urls_are_done_only_after_their_app_commits(in_tmp):
+    writer = ShardedWriter('app_store_db', 2, flush_interval=60).start()
+    frontier = CrawlFrontier(writer=writer, owner='a')
+    frontier.add([url])
+    frontier.claim(1)
+    shard = writer.writer_for('1121971067')
+    shard.put(insert_app, [('1121971067', 'Archery King')])
+    frontier.complete(url)
+    # the main db commits, but the app's shard hasn't yet
+    writer.main.flush()
+    assert frontier.counts()['done'] == 0
+    writer.flush()
+    assert frontier.counts()['done'] == 1
+    path = read_shard_paths('app_store_db')[shard_index('1121971067', 2)]
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('SELECT count(*) FROM app_store_main').fetchone()[0] == 1
+    writer.close()
+    frontier.close()
+
+
+def test_sum_rows():
+    parts = [[('a', 1, None), ('b', 2, 1.5)], [('b', 3, 1.0), ('c', 1, 2.0)]]
+    assert sum_rows(parts) == [('a', 1, None), ('b', 5, 2.5), ('c', 1, 2.0)]
+
+
+def test_writers_follow_the_stored_layout(in_tmp):
+    create_shards('app_store_db', 2)
+    writer = open_writer('app_store_db')
+    assert isinstance(writer, ShardedWriter) and len(writer.shards) == 2
+    assert isinstance(open_writer('app_store_db', 2), ShardedWriter)
+    with pytest.raises(ValueError):
+        open_writer('app_store_db', 3)
+
+
+def test_crawlers_write_and_read_apps_in_their_shard(in_tmp, example_page):
+    create_shards('app_store_db', 2)
+    parsed = ParseAppStorePage(example_page)
+    parsed.parse()
+    app_id = parsed.output_dict['app_id']
+
+    # no db_shards given, the db's own layout is used
+    c = CrawlAppStore()
+    parsed.write_out(c.writer)
+    c.close()
+    path = read_shard_paths('app_store_db')[shard_index(app_id, 2)]
+    for db, count in (('app_store_db', 0), (path, 1)):
+        with sqlite3.connect(db) as conn:
+            assert conn.execute('SELECT count(*) FROM app_store_main').fetchone()[0] == count
+
+    c = RefreshAppStore()
+    stored = c.fetch_stored_app(app_id)
+    c.close()
+    assert stored is not None and stored['app_name'] == parsed.output_dict['app_name']
+
+    with sqlite3.connect(path) as conn:
+        conn.execute('UPDATE app_store_main SET price_value = NULL')
+    assert normalize('app_store_db')['app_store_main'] == 1
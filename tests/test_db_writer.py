@@ -0,0 +1,99 @@
+import sqlite3
+import time
+
+import db_writer
+from db_writer import DBWriter
+from migrations import migrate
+from parse_app_page import ParseAppStorePage
+
+insert_a = 'INSERT INTO log (label) VALUES (?)'
+insert_b = 'INSERT INTO log (label) VALUES (? || \'!\')'
+insert_unique = 'INSERT INTO seen (key) VALUES (?)'
+
+
+def make_db(path='db'):
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE log (id INTEGER PRIMARY KEY, label TEXT)')
+        conn.execute('CREATE TABLE seen (key TEXT PRIMARY KEY)')
+    return path
+
+
+def labels(db='db'):
+    with sqlite3.connect(db) as conn:
+        return [x[0] for x in conn.execute('SELECT label FROM log ORDER BY id')]
+
+
+def test_commits_in_the_order_things_were_put(in_tmp):
+    writer = DBWriter(make_db(), flush_interval=60).start()
+    writer.put_all([(insert_a, [('1',)]), (insert_b, [('1',)])])
+    writer.put_all([(insert_a, [('2',)]), (insert_b, [('2',)])])
+    writer.put(insert_a, [('3',), ('4',)])
+    writer.put(insert_a, [('5',)])
+    writer.flush()
+    assert labels() == ['1', '1!', '2', '2!', '3', '4', '5']
+    writer.close()
+
+
+def test_groups_only_statements_put_one_after_another():
+    pending = [
+        [(insert_a, [(1,)])], [(insert_a, [(2,)])],
+        [(insert_b, [(3,)]), (insert_a, [(4,)])],
+    ]
+    assert DBWriter.group(pending) == [
+        (insert_a, [(1,), (2,)]), (insert_b, [(3,)]), (insert_a, [(4,)]),
+    ]
+    # the items themselves are left as they were
+    assert pending[0] == [(insert_a, [(1,)])]
+
+
+def test_flush_and_close_commit_everything(in_tmp):
+    writer = DBWriter(make_db(), flush_interval=60).start()
+    writer.put(insert_a, [('1',)])
+    writer.flush()
+    assert labels() == ['1']
+    writer.put(insert_a, [('2',)])
+    writer.close()
+    assert writer.thread is None
+    assert labels() == ['1', '2']
+
+
+def test_commits_once_the_batch_is_full(in_tmp):
+    writer = DBWriter(make_db(), batch_rows=3, flush_interval=60).start()
+    writer.put(insert_a, [('1',), ('2',)])
+    writer.put_all([(insert_a, [('3',)]), (insert_b, [('3',)])])
+    deadline = time.monotonic() + 5
+    while not labels() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert labels() == ['1', '2', '3', '3!']
+    writer.close()
+
+
+def test_a_bad_row_only_loses_its_own_item(in_tmp):
+    writer = DBWriter(make_db(), flush_interval=60).start()
+    errors = db_writer.write_errors.value()
+    writer.put(insert_unique, [('a',)])
+    # the second insert fails, so the whole put_all is rolled back
+    writer.put_all([(insert_a, [('lost',)]), (insert_unique, [('a',)])])
+    writer.put(insert_a, [('kept',)])
+    writer.close()
+    assert labels() == ['kept']
+    assert db_writer.write_errors.value() == errors + 1
+
+
+def test_recrawling_an_app_replaces_its_languages_and_purchases(in_tmp, example_page):
+    migrate('app_store_db')
+    writer = DBWriter('app_store_db').start()
+    parsed = ParseAppStorePage(example_page)
+    parsed.parse()
+    parsed.write_out(writer)
+    writer.flush()
+    parsed.output_dict['languages'] = parsed.output_dict['languages'][:1]
+    parsed.output_dict['top_in_app_purchases'] = parsed.output_dict['top_in_app_purchases'][:1]
+    parsed.write_out(writer)
+    writer.close()
+    with sqlite3.connect('app_store_db') as conn:
+        assert conn.execute('SELECT count(*) FROM app_store_languages').fetchone()[0] == 1
+        assert conn.execute(
+            'SELECT count(*) FROM app_store_top_in_app_purchases'
+        ).fetchone()[0] == 1
+        assert conn.execute('SELECT sum(apps) FROM app_store_rollup_languages').fetchone()[0] == 2
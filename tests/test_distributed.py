@@ -0,0 +1,46 @@
+import json
+import sqlite3
+
+from conftest import FakeSession, make_response
+from distributed import CrawlCoordinator, CrawlWorker
+from parse_app_page import ParseAppStorePage
+
+
+def as_sent(record):
+    # the way a record comes back out of the json body
+    return json.loads(json.dumps(record))
+
+
+def test_results_need_the_lease(in_tmp, example_page):
+    coordinator = CrawlCoordinator(port=0, lease_seconds=-1)
+    url = 'http://example.com/us/app/x/id1121971067?mt=8'
+    coordinator.frontier.add([url])
+    parsed = ParseAppStorePage(example_page)
+    parsed.parse()
+    record = as_sent(parsed.to_record())
+    try:
+        assert coordinator.lease('a', 1)['urls'] == [url]
+        # a's lease ran out and b has the url now
+        coordinator.frontier.lease_seconds = 600
+        assert coordinator.lease('b', 1)['urls'] == [url]
+        coordinator.results('a', [(url, record)])
+        coordinator.writer.flush()
+        with sqlite3.connect('app_store_db') as conn:
+            assert conn.execute('SELECT count(*) FROM app_store_main').fetchone()[0] == 0
+        coordinator.results('b', [(url, record)])
+        coordinator.writer.flush()
+        with sqlite3.connect('app_store_db') as conn:
+            assert conn.execute('SELECT count(*) FROM app_store_main').fetchone()[0] == 1
+            assert conn.execute('SELECT state FROM app_store_app_urls').fetchone()[0] == 'done'
+    finally:
+        coordinator.close()
+
+
+def test_worker_fetches_without_a_db(in_tmp, example_page):
+    worker = CrawlWorker('http://127.0.0.1:1')
+    worker.session = FakeSession([make_response(example_page)])
+    url, record, error = worker.fetch_record('http://example.com/us/app/x/id1121971067?mt=8')
+    worker.close()
+    assert error is None
+    assert record.app_id == '1121971067'
+    assert not hasattr(worker, 'writer')
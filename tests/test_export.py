@@ -0,0 +1,71 @@
+import json
+import os
+import sqlite3
+
+from db_shards import create_shards, shard_index
+from export import AppExporter
+from migrations import migrate
+
+
+def add_app(db, app_id, category='Games'):
+    with sqlite3.connect(db) as conn:
+        conn.execute(
+            'INSERT INTO app_store_main (app_id, app_name, category) VALUES (?, ?, ?)',
+            (app_id, 'app {}'.format(app_id), category)
+        )
+
+
+def exported_ids(output='app_store_export'):
+    ids = []
+    for root, _, files in os.walk(output):
+        for name in files:
+            if name.endswith('.ndjson'):
+                with open(os.path.join(root, name)) as f:
+                    ids.extend(json.loads(x)['app_id'] for x in f)
+    return sorted(ids)
+
+
+def test_exports_only_what_changed(in_tmp):
+    migrate('app_store_db')
+    add_app('app_store_db', '1')
+    add_app('app_store_db', '2', 'Music')
+    exporter = AppExporter()
+    assert exporter.export() == {'Games': 1, 'Music': 1}
+    assert exporter.export() == {}
+    add_app('app_store_db', '3')
+    assert exporter.export() == {'Games': 1}
+    assert exported_ids() == ['1', '2', '3']
+
+
+def test_picks_up_writes_that_committed_late(in_tmp):
+    migrate('app_store_db')
+    add_app('app_store_db', '1')
+    exporter = AppExporter()
+    exporter.export()
+    # a write stamped before the last export's latest
+    # updated_at, but committed after it
+    with sqlite3.connect('app_store_db') as conn:
+        latest = conn.execute('SELECT max(updated_at) FROM app_store_main').fetchone()[0]
+        conn.execute(
+            'INSERT INTO app_store_main (app_id, category) VALUES (?, ?)', ('2', 'Games')
+        )
+        conn.execute('UPDATE app_store_main SET updated_at = ? WHERE app_id = ?', (latest - 1, '2'))
+    assert exporter.export() == {'Games': 1}
+    # and neither app is exported again
+    assert exporter.export() == {}
+    assert exported_ids() == ['1', '2']
+
+
+def test_exports_each_shard(in_tmp):
+    paths = create_shards('app_store_db', 2)
+    app_ids = [str(x) for x in range(10)]
+    for app_id in app_ids:
+        add_app(paths[shard_index(app_id, 2)], app_id)
+    exporter = AppExporter()
+    assert exporter.export() == {'Games': 10}
+    with open(exporter.state_path) as f:
+        state = json.load(f)['ndjson']
+    assert sorted(state) == sorted(os.path.basename(x) for x in paths)
+    add_app(paths[shard_index('10', 2)], '10')
+    assert exporter.export() == {'Games': 1}
+    assert exported_ids() == sorted(app_ids + ['10'])
@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from db_writer import DBWriter
+from frontier import CrawlFrontier
+from migrations import migrate
+
+urls = ['http://example.com/app/id{}'.format(x) for x in range(5)]
+
+
+@pytest.fixture
+def frontier(in_tmp):
+    migrate('app_store_db')
+    f = CrawlFrontier(owner='a', max_attempts=2)
+    f.add(urls)
+    yield f
+    f.close()
+
+
+def states(frontier):
+    return dict(frontier.conn.execute(
+        'SELECT url, state FROM app_store_app_urls'
+    ).fetchall())
+
+
+def test_claims_by_priority_and_only_once(frontier):
+    frontier.add(['http://example.com/app/id9'], priority=5)
+    assert frontier.claim(2) == ['http://example.com/app/id9', urls[0]]
+    claimed = frontier.claim(10)
+    assert claimed == urls[1:]
+    assert frontier.claim(10) == []
+    assert frontier.counts()['leased'] == 6
+
+
+def test_adding_a_url_twice_keeps_its_state(frontier):
+    frontier.claim(1)
+    frontier.add(urls[:1])
+    assert states(frontier)[urls[0]] == 'leased'
+
+
+def test_expired_leases_go_back_to_pending(frontier):
+    frontier.lease_seconds = -1
+    assert frontier.claim(5) == urls
+    frontier.lease_seconds = 600
+    assert sorted(frontier.claim(5, owner='b')) == sorted(urls)
+
+
+def test_complete_and_fail(frontier):
+    claimed = frontier.claim(2)
+    frontier.complete(claimed[0])
+    frontier.fail(claimed[1], ValueError('broken'))
+    assert states(frontier)[claimed[0]] == 'done'
+    assert states(frontier)[claimed[1]] == 'pending'
+    # the second failure uses up its attempts
+    assert claimed[1] in frontier.claim(5)
+    frontier.fail(claimed[1], ValueError('broken'))
+    assert states(frontier)[claimed[1]] == 'failed'
+    assert frontier.conn.execute(
+        'SELECT last_error FROM app_store_app_urls WHERE url = ?', (claimed[1],)
+    ).fetchone()[0] == 'broken'
+
+
+def test_only_the_lease_owner_completes_or_fails(frontier):
+    frontier.lease_seconds = -1
+    url = frontier.claim(1)[0]
+    frontier.lease_seconds = 600
+    # the lease ran out and b has the url now
+    assert frontier.claim(1, owner='b') == [url]
+    frontier.complete(url)
+    frontier.fail(url, ValueError('late'))
+    assert states(frontier)[url] == 'leased'
+    frontier.complete(url, owner='b')
+    assert states(frontier)[url] == 'done'
+    # and nobody can undo it
+    frontier.fail(url, ValueError('late'), owner='b')
+    assert states(frontier)[url] == 'done'
+
+
+def test_release(frontier):
+    frontier.claim(2)
+    frontier.claim(1, owner='b')
+    frontier.release()
+    counts = frontier.counts()
+    assert counts['pending'] == 4 and counts['leased'] == 1
+
+
+def test_iter_claims_flushes_failures_before_stopping(in_tmp):
+    migrate('app_store_db')
+    writer = DBWriter('app_store_db', flush_interval=60).start()
+    frontier = CrawlFrontier(writer=writer, owner='a', max_attempts=2)
+    frontier.add(urls[:2])
+    seen = []
+    for url in frontier.iter_claims(5):
+        seen.append(url)
+        if len(seen) <= 2:
+            # queued on the writer, not committed yet
+            frontier.fail(url, ValueError('broken'))
+        else:
+            frontier.complete(url)
+    writer.close()
+    assert seen == urls[:2] * 2
+    assert set(states(frontier).values()) == {'done'}
+    frontier.close()
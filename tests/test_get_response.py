@@ -0,0 +1,53 @@
+import pytest
+import requests
+
+from conftest import FakeSession, make_response
+
+
+def test_retries_a_timeout(crawler):
+    crawler.session = FakeSession([requests.Timeout(), make_response('ok')])
+    r = crawler.get_response('http://example.com/a')
+    assert r.text == 'ok'
+    assert len(crawler.session.calls) == 2
+
+
+def test_retries_a_timeout_when_streaming(crawler):
+    crawler.session = FakeSession([
+        requests.Timeout(), requests.ConnectionError(), make_response('ok')
+    ])
+    r = crawler.get_response('http://example.com/a', stream=True)
+    assert r.status_code == 200
+    assert len(crawler.session.calls) == 3
+    assert all(x[1]['stream'] for x in crawler.session.calls)
+
+
+def test_raises_the_timeout_once_out_of_retries_when_streaming(crawler):
+    crawler.session = FakeSession([requests.Timeout()] * 3)
+    with pytest.raises(requests.Timeout):
+        crawler.get_response('http://example.com/a', stream=True)
+    assert len(crawler.session.calls) == 3
+
+
+def test_retries_server_errors(crawler):
+    crawler.session = FakeSession([
+        make_response('', 503), make_response('', 500), make_response('ok')
+    ])
+    assert crawler.get_response('http://example.com/a').text == 'ok'
+
+
+def test_gives_up_on_server_errors(crawler):
+    crawler.session = FakeSession([make_response('', 503)] * 3)
+    with pytest.raises(requests.HTTPError):
+        crawler.get_response('http://example.com/a')
+
+
+def test_does_not_retry_a_not_found(crawler):
+    crawler.session = FakeSession([make_response('', 404)])
+    assert crawler.get_response('http://example.com/a').status_code == 404
+    assert len(crawler.session.calls) == 1
+
+
+def test_stream_app_page_survives_a_timeout(crawler, example_page):
+    crawler.session = FakeSession([requests.Timeout(), make_response(example_page)])
+    parsed = crawler.stream_app_page('http://example.com/us/app/x/id1121971067?mt=8')
+    assert parsed.output_dict['app_id'] == '1121971067'
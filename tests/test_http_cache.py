@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+import http_cache
+from conftest import FakeSession, make_response
+from http_cache import HTTPCache, OfflineCacheMiss, normalize_url
+
+url = 'https://itunes.apple.com/us/app/x/id1?mt=8'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        # every call is a moment later, so last used times differ
+        self.now += 0.001
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(http_cache.time, 'time', clock)
+    return clock
+
+
+def objects():
+    return sorted(
+        name for _, _, names in os.walk(os.path.join('app_store_http_cache', 'objects'))
+        for name in names
+    )
+
+
+def test_normalize_url():
+    assert normalize_url('HTTPS://iTunes.Apple.com:443/us/app?mt=8&b=1#reviews') == (
+        'https://itunes.apple.com/us/app?b=1&mt=8'
+    )
+    assert normalize_url('http://example.com') == 'http://example.com/'
+
+
+def test_entries_expire_after_the_ttl(in_tmp, clock):
+    cache = HTTPCache(ttl=60, codec='zlib')
+    cache.put(url, 'page')
+    assert cache.get('HTTPS://itunes.apple.com/us/app/x/id1?mt=8#top') == 'page'
+    clock.now += 61
+    expired = http_cache.cache_lookups.value('expired')
+    assert cache.get(url) is None
+    assert http_cache.cache_lookups.value('expired') == expired + 1
+    cache.close()
+
+
+def test_the_least_recently_used_are_evicted(in_tmp, clock):
+    cache = HTTPCache(codec='zlib')
+    size = len(http_cache.compress(b'page a', 'zlib'))
+    cache.max_bytes = size * 2
+    cache.put('http://example.com/a', 'page a')
+    cache.put('http://example.com/b', 'page b')
+    assert cache.get('http://example.com/a') == 'page a'
+    cache.put('http://example.com/c', 'page c')
+    assert cache.get('http://example.com/b') is None
+    assert cache.get('http://example.com/a') == 'page a'
+    assert cache.get('http://example.com/c') == 'page c'
+    assert len(objects()) == 2 and cache.total_bytes == size * 2
+    cache.close()
+    # the size is worked out again on reopening
+    cache = HTTPCache(codec='zlib')
+    assert cache.total_bytes == size * 2
+    cache.close()
+
+
+def test_urls_with_the_same_body_share_it(in_tmp, clock):
+    cache = HTTPCache(codec='zlib')
+    cache.put('http://example.com/a', 'empty')
+    cache.put('http://example.com/b', 'empty')
+    assert len(objects()) == 1
+    cache.put('http://example.com/a', 'full')
+    assert len(objects()) == 2
+    assert cache.get('http://example.com/b') == 'empty'
+    cache.clear()
+    assert objects() == [] and cache.total_bytes == 0
+    cache.close()
+
+
+def test_offline_serves_old_entries_and_raises_on_misses(in_tmp, clock):
+    cache = HTTPCache(ttl=60, codec='zlib')
+    cache.put(url, 'page')
+    cache.close()
+    clock.now += 3600
+    cache = HTTPCache(ttl=60, codec='zlib', offline=True)
+    assert cache.get(url) == 'page'
+    with pytest.raises(OfflineCacheMiss):
+        cache.get('http://example.com/missing')
+    cache.close()
+
+
+def test_crawler_reads_through_the_cache(crawler):
+    crawler.http_cache = HTTPCache(codec='zlib')
+    crawler.session = FakeSession([make_response('page'), make_response('gone', 404)])
+    assert crawler.get_request(url) == 'page'
+    assert crawler.get_request(url) == 'page'
+    assert len(crawler.session.calls) == 1
+    # only 200s are kept
+    assert crawler.get_request('http://example.com/404') == 'gone'
+    assert crawler.http_cache.get('http://example.com/404') is None
+    crawler.http_cache.offline = True
+    with pytest.raises(OfflineCacheMiss):
+        crawler.get_request('http://example.com/other')
+    assert len(crawler.session.calls) == 2
@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+
+from conftest import root
+from lookup_api import LookupCrawlAppStore, compatibility_text, language_list, parse_lookup_result
+from parse_app_page import ParseAppStorePage
+
+
+@pytest.fixture
+def lookup_result():
+    with open(os.path.join(root, 'App Store lookup example.json')) as f:
+        return json.load(f)['results'][0]
+
+
+@pytest.mark.parametrize('backend', ['html.parser', 'lxml'])
+def test_html_fields_match_a_full_parse(in_tmp, example_page, backend):
+    fields = ('customer_reviews', 'copyright', 'top_in_app_purchases')
+    c = LookupCrawlAppStore(parser_backend=backend, html_fields=fields)
+    try:
+        page_dict = c.parse_html_fields(example_page)
+    finally:
+        c.close()
+    full = ParseAppStorePage(example_page, backend).parse(normalize=False)
+    for field in fields:
+        assert page_dict[field] == full[field]
+    # the rest of the page isn't parsed
+    assert page_dict['app_name'] == ''
+    assert page_dict['description'] == ''
+
+
+def test_html_fields_default_to_none(in_tmp):
+    c = LookupCrawlAppStore()
+    c.close()
+    assert c.html_fields == ()
+
+
+def test_unknown_html_fields_are_rejected(in_tmp):
+    with pytest.raises(ValueError):
+        LookupCrawlAppStore(html_fields=('reviews',))
+
+
+def test_lookup_result_matches_the_page(example_page, lookup_result):
+    output_dict = parse_lookup_result(lookup_result)
+    page_dict = ParseAppStorePage(example_page).parse(normalize=False)
+    for field in ('app_id', 'app_name', 'price', 'category', 'version', 'seller',
+                  'published_date', 'last_updated_date', 'size', 'app_rating'):
+        assert output_dict[field] == page_dict[field], field
+
+
+def test_lookup_languages_match_the_page(example_page, lookup_result):
+    output_dict = parse_lookup_result(lookup_result)
+    page_dict = ParseAppStorePage(example_page).parse()
+    assert output_dict['languages'] == page_dict['languages']
+
+
+def test_a_lone_chinese_is_simplified():
+    assert language_list(['EN', 'ZH']) == ['English', 'Simplified Chinese']
+
+
+def test_lookup_compatibility_matches_the_page(example_page, lookup_result):
+    # the recorded response only has a few of its supported devices
+    lookup_result = dict(lookup_result, supportedDevices=[
+        'iPhone5s-iPhone5s', 'iPadAir-iPadAir', 'iPodTouchSixthGen-iPodTouchSixthGen'
+    ])
+    output_dict = parse_lookup_result(lookup_result)
+    page_dict = ParseAppStorePage(example_page).parse()
+    assert output_dict['compatibility'] == page_dict['compatibility']
+
+
+def test_compatibility_with_two_families():
+    assert compatibility_text('9.0', ['iPhone7-iPhone7', 'iPodTouchSixthGen-iPodTouchSixthGen']) == (
+        'Requires iOS 9.0 or later. Compatible with iPhone and iPod touch.'
+    )
+
+
+def test_lookup_results_keep_what_the_page_had(in_tmp, example_page, lookup_result):
+    c = LookupCrawlAppStore()
+    try:
+        parsed = ParseAppStorePage(example_page)
+        parsed.parse()
+        parsed.write_out(c.writer)
+        c.write_lookup_result('http://example.com/us/app/x/id1121971067?mt=8', dict(
+            lookup_result, trackName='New Name', trackContentRating=None
+        ))
+        c.writer.flush()
+        row = c.read_conn.execute(
+            'SELECT app_name, copyright, app_rating FROM app_store_main'
+        ).fetchone()
+        purchases = c.read_conn.execute(
+            'SELECT count(*) FROM app_store_top_in_app_purchases'
+        ).fetchone()[0]
+    finally:
+        c.close()
+    d = parsed.output_dict
+    # the api doesn't have the copyright or purchases, and
+    # this result doesn't have the rating
+    assert row == ('New Name', d['copyright'], d['app_rating'])
+    assert purchases == len(d['top_in_app_purchases'])
@@ -0,0 +1,77 @@
+import pytest
+
+from metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+
+def test_counter_renders_each_label_set():
+    c = Counter('pages_total', 'Pages crawled', ['outcome'])
+    c.inc('done')
+    c.inc('done', amount=2)
+    c.inc('failed')
+    assert c.value('done') == 3
+    assert c.value('skipped') == 0
+    assert c.render() == [
+        '# HELP pages_total Pages crawled',
+        '# TYPE pages_total counter',
+        'pages_total{outcome="done"} 3.0',
+        'pages_total{outcome="failed"} 1.0',
+    ]
+
+
+def test_label_values_are_escaped():
+    c = Counter('errors_total', 'Errors', ['error'])
+    c.inc('bad "quote"\\\n')
+    assert c.render()[-1] == r'errors_total{error="bad \"quote\"\\\n"} 1.0'
+
+
+def test_gauge_reads_its_function():
+    sizes = {('pending',): 3, ('done',): 1}
+    g = Gauge('urls', 'Urls', ['state'], lambda: sizes)
+    assert g.render()[2:] == ['urls{state="done"} 1', 'urls{state="pending"} 3']
+    g = Gauge('depth', 'Depth')
+    g.set(5)
+    assert g.render()[2:] == ['depth 5']
+
+
+def test_a_failing_gauge_renders_no_samples():
+    g = Gauge('broken', 'Broken', function=lambda: 1 / 0)
+    assert g.render() == ['# HELP broken Broken', '# TYPE broken gauge']
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram('fetch_seconds', 'Fetch time', ['status'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        h.observe(value, '200')
+    assert h.count('200') == 4
+    assert h.count('500') == 0
+    assert h.render() == [
+        '# HELP fetch_seconds Fetch time',
+        '# TYPE fetch_seconds histogram',
+        'fetch_seconds_bucket{status="200",le="0.1"} 2',
+        'fetch_seconds_bucket{status="200",le="1.0"} 3',
+        'fetch_seconds_bucket{status="200",le="+Inf"} 4',
+        'fetch_seconds_sum{status="200"} 3.65',
+        'fetch_seconds_count{status="200"} 4',
+    ]
+
+
+def test_histogram_times_the_block_even_when_it_raises():
+    h = Histogram('parse_seconds', 'Parse time')
+    with pytest.raises(ValueError):
+        with h.time():
+            raise ValueError()
+    assert h.count() == 1
+
+
+def test_registry_keeps_the_first_metric_but_replaces_gauges():
+    registry = MetricsRegistry()
+    c = registry.counter('a_total', 'A')
+    assert registry.counter('a_total', 'A') is c
+    registry.gauge('b', 'B', function=lambda: 1)
+    registry.gauge('b', 'B', function=lambda: 2)
+    assert registry.render() == (
+        '# HELP a_total A\n# TYPE a_total counter\n'
+        '# HELP b B\n# TYPE b gauge\nb 2\n'
+    )
+    registry.remove('b')
+    assert 'b 2' not in registry.render()
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import time
+
+from conftest import root
+from migrations import MIGRATIONS, migrate
+
+
+def rollup(conn, dimension, name):
+    return conn.execute(
+        """
+        SELECT apps, rated_apps, rating_sum, paid_apps, price_sum
+        FROM app_store_rollup_summary WHERE dimension = ? AND name = ?
+        """,
+        (dimension, name)
+    ).fetchone()
+
+
+def test_creates_a_new_db_at_the_latest_version(in_tmp):
+    assert migrate('app_store_db') == len(MIGRATIONS)
+    # and migrating again changes nothing
+    assert migrate('app_store_db') == len(MIGRATIONS)
+
+
+def test_migrates_the_original_schema(in_tmp):
+    with open(os.path.join(root, 'create table statements.sql')) as f:
+        script = f.read()
+    with sqlite3.connect('app_store_db') as conn:
+        conn.executescript(script)
+        conn.executemany(
+            'INSERT INTO app_store_app_urls (url) VALUES (?)',
+            [('https://itunes.apple.com/us/app/a/id1',)] * 2
+        )
+        conn.executemany(
+            """
+            INSERT INTO app_store_main (
+                app_id, app_name, price, category, all_versions_rating_value
+            ) VALUES (?, ?, ?, ?, ?)
+            """,
+            [('1', 'old', 'Free', 'Games', '3'), ('1', 'new', '$1.99', 'Games', '4.5')]
+        )
+    assert migrate('app_store_db') == len(MIGRATIONS)
+
+    with sqlite3.connect('app_store_db') as conn:
+        assert conn.execute('SELECT count(*) FROM app_store_app_urls').fetchone()[0] == 1
+        assert conn.execute('SELECT * FROM app_store_url_counts').fetchall() == [
+            ('pending', 1)
+        ]
+        # the duplicate is dropped, keeping the latest one
+        rows = conn.execute(
+            'SELECT app_name, price_value, all_versions_rating, updated_at FROM app_store_main'
+        ).fetchall()
+        assert [x[:3] for x in rows] == [('new', 1.99, 4.5)]
+        assert rows[0][3] is not None
+        # the rollups count what was already there
+        assert rollup(conn, 'category', 'Games') == (1, 1, 4.5, 1, 1.99)
+
+
+def test_triggers_stamp_updated_at(in_tmp):
+    migrate('app_store_db')
+    with sqlite3.connect('app_store_db') as conn:
+        start = time.time()
+        conn.execute("INSERT INTO app_store_main (app_id, app_name) VALUES ('1', 'a')")
+        inserted = conn.execute('SELECT updated_at FROM app_store_main').fetchone()[0]
+        assert start - 1 <= inserted <= time.time() + 1
+
+        conn.execute('UPDATE app_store_main SET updated_at = 0')
+        conn.execute("UPDATE app_store_main SET app_name = 'b'")
+        updated = conn.execute('SELECT updated_at FROM app_store_main').fetchone()[0]
+        assert updated >= start - 1
+
+        # setting updated_at itself is left alone
+        conn.execute('UPDATE app_store_main SET updated_at = 5')
+        assert conn.execute('SELECT updated_at FROM app_store_main').fetchone()[0] == 5
+
+
+def test_triggers_keep_the_rollups_up_to_date(in_tmp):
+    migrate('app_store_db')
+    with sqlite3.connect('app_store_db') as conn:
+        # reviews can commit before their app
+        conn.execute("INSERT INTO app_store_customer_reviews (app_id, rating) VALUES ('1', '5')")
+        conn.execute(
+            """
+            INSERT INTO app_store_main (
+                app_id, category, seller, all_versions_rating, price_value
+            ) VALUES ('1', 'Games', 'Seller', 4.0, 0)
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO app_store_main (
+                app_id, category, seller, all_versions_rating, price_value
+            ) VALUES ('2', 'Games', 'Seller', 3.0, 2.99)
+            """
+        )
+        conn.execute("INSERT INTO app_store_languages (app_id, language) VALUES ('1', 'English')")
+        conn.execute("INSERT INTO app_store_customer_reviews (app_id, rating) VALUES ('1', '4')")
+        assert rollup(conn, 'category', 'Games') == (2, 2, 7.0, 1, 2.99)
+        assert rollup(conn, 'seller', 'Seller') == (2, 2, 7.0, 1, 2.99)
+        assert conn.execute(
+            """
+            SELECT sum(reviews) FROM app_store_rollup_reviews
+            WHERE dimension = 'category' AND name = 'Games'
+            """
+        ).fetchone()[0] == 2
+        assert conn.execute(
+            """
+            SELECT apps FROM app_store_rollup_languages
+            WHERE dimension = 'category' AND name = 'Games' AND language = 'English'
+            """
+        ).fetchone()[0] == 1
+
+        # moving an app takes it and its languages out of the old category
+        conn.execute("UPDATE app_store_main SET category = 'Music' WHERE app_id = '1'")
+        assert rollup(conn, 'category', 'Games') == (1, 1, 3.0, 1, 2.99)
+        assert rollup(conn, 'category', 'Music') == (1, 1, 4.0, 0, 0)
+        assert conn.execute(
+            """
+            SELECT dimension, name, apps FROM app_store_rollup_languages
+            WHERE language = 'English' AND apps != 0 ORDER BY dimension
+            """
+        ).fetchall() == [('category', 'Music', 1), ('seller', 'Seller', 1)]
+
+        conn.execute("DELETE FROM app_store_main WHERE app_id = '2'")
+        assert rollup(conn, 'category', 'Games')[0] == 0
+        assert rollup(conn, 'seller', 'Seller') == (1, 1, 4.0, 0, 0)
+
+
+def search(conn, query):
+    return [x[0] for x in conn.execute(
+        """
+        SELECT app_store_main.app_id FROM app_store_search
+        JOIN app_store_main ON app_store_main.search_id = app_store_search.rowid
+        WHERE app_store_search MATCH ? ORDER BY app_store_main.app_id
+        """,
+        (query,)
+    )]
+
+
+def test_search_index_survives_vacuum(in_tmp):
+    migrate('app_store_db')
+    conn = sqlite3.connect('app_store_db', isolation_level=None)
+    try:
+        conn.executemany(
+            'INSERT INTO app_store_main (app_id, app_name) VALUES (?, ?)',
+            [(str(x), 'app {}'.format('even' if x % 2 else 'odd')) for x in range(10)]
+        )
+        # leaves gaps in the rowids for VACUUM to close up
+        conn.execute("DELETE FROM app_store_main WHERE app_id IN ('0', '2', '4')")
+        conn.execute('VACUUM')
+        conn.execute("INSERT INTO app_store_main (app_id, app_name) VALUES ('10', 'app odd')")
+        conn.execute("UPDATE app_store_main SET app_name = 'app even' WHERE app_id = '6'")
+        assert search(conn, 'odd') == ['10', '8']
+        assert search(conn, 'even') == ['1', '3', '5', '6', '7', '9']
+        # raises if the index doesn't match app_store_main
+        conn.execute("INSERT INTO app_store_search (app_store_search) VALUES ('integrity-check')")
+    finally:
+        conn.close()
+
+
+def test_url_counts_follow_the_frontier(in_tmp):
+    migrate('app_store_db')
+    with sqlite3.connect('app_store_db') as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO app_store_app_urls (url) VALUES (?)',
+            [('a',), ('b',), ('c',), ('a',)]
+        )
+        conn.execute("UPDATE app_store_app_urls SET state = 'leased' WHERE url IN ('a', 'b')")
+        conn.execute("UPDATE app_store_app_urls SET state = 'done' WHERE url = 'a'")
+        conn.execute("UPDATE app_store_app_urls SET attempts = 1 WHERE url = 'b'")
+        conn.execute("DELETE FROM app_store_app_urls WHERE url = 'c'")
+        counts = dict(conn.execute('SELECT state, urls FROM app_store_url_counts'))
+        assert counts == dict(conn.execute(
+            'SELECT state, count(*) FROM app_store_app_urls GROUP BY state'
+        ).fetchall(), pending=0)
+        assert counts == dict(pending=0, leased=1, done=1)
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+import page_archive
+from page_archive import PageArchive, read_pages
+
+codecs = ['zlib', pytest.param('zstd', marks=pytest.mark.skipif(
+    page_archive.zstandard is None, reason='needs zstandard'
+))]
+
+
+def page(app_id, version=1):
+    return '<html>app {} version {} {}</html>'.format(app_id, version, 'x' * app_id)
+
+
+@pytest.mark.parametrize('codec', codecs)
+def test_round_trip(in_tmp, codec):
+    archive = PageArchive(codec=codec)
+    for app_id in range(1, 4):
+        archive.add(app_id, 'url {}'.format(app_id), page(app_id))
+    archive.add(2, 'url 2', page(2, version=2))
+    assert archive.get(1) == page(1)
+    assert archive.get(2) == page(2, version=2)
+    assert archive.get(404) is None
+    assert archive.count() == 3
+    archive.close()
+
+    # the index and segments are all there when it's opened again
+    archive = PageArchive(codec=codec)
+    assert archive.get(3) == page(3)
+    archive.close()
+
+
+def test_unknown_codecs_are_rejected(in_tmp):
+    with pytest.raises(ValueError):
+        PageArchive(codec='gzip')
+
+
+def test_segments_roll_over(in_tmp):
+    archive = PageArchive(codec='zlib', segment_bytes=1)
+    for app_id in range(1, 4):
+        archive.add(app_id, 'url', page(app_id))
+    archive.close()
+    # every page after the first starts a new segment
+    assert sorted(x for x in os.listdir('app_store_archive') if x.startswith('segment')) == [
+        'segment-00000', 'segment-00001', 'segment-00002'
+    ]
+    archive = PageArchive(codec='zlib', segment_bytes=1)
+    archive.add(4, 'url', page(4))
+    assert archive.segment == 3
+    assert [archive.get(x) for x in range(1, 5)] == [page(x) for x in range(1, 5)]
+    archive.close()
+
+
+def test_iter_latest_reads_each_app_once_a_segment_at_a_time(in_tmp):
+    archive = PageArchive(codec='zlib', segment_bytes=200)
+    for app_id in range(1, 6):
+        archive.add(app_id, 'url {}'.format(app_id), page(app_id))
+    archive.add(1, 'url 1', page(1, version=2))
+    batches = list(archive.iter_latest(batch_size=2))
+    archive.close()
+    assert all(len(batch) <= 2 for _, batch in batches)
+    pages = {}
+    for segment_path, batch in batches:
+        offsets = [x[1] for x in batch]
+        assert offsets == sorted(offsets)
+        sources = read_pages(segment_path, [x[1:] for x in batch])
+        for (url, _, _, _), source in zip(batch, sources):
+            assert url not in pages
+            pages[url] = source
+    assert pages == dict(
+        {'url {}'.format(x): page(x) for x in range(2, 6)}, **{'url 1': page(1, version=2)}
+    )
+
+
+def test_read_pages_only_reads_what_is_asked_for(in_tmp):
+    archive = PageArchive(codec='zlib')
+    archive.add(1, 'url 1', page(1))
+    archive.add(2, 'url 2', page(2))
+    archive.close()
+    with open(os.path.join('app_store_archive', 'segment-00000'), 'r+b') as f:
+        # a corrupt first page doesn't stop the second being read
+        f.write(b'\0' * 4)
+    archive = PageArchive(codec='zlib')
+    (segment_path, batch), = archive.iter_latest()
+    archive.close()
+    assert list(read_pages(segment_path, [batch[1][1:]])) == [page(2)]
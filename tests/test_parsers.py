@@ -0,0 +1,78 @@
+import pytest
+
+import benchmark
+from parse_app_page import ParseAppStorePage
+from stream_parse import StreamingParseAppStorePage
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+# the lxml backends are only checked when it's installed
+backends = [
+    x for x, (features, _) in ParseAppStorePage.backends.items()
+    if features != 'lxml' or lxml is not None
+]
+
+
+@pytest.fixture(params=['example', 'reviews', 'purchases'])
+def page(request, example_page):
+    if request.param == 'reviews':
+        return benchmark.synthetic_page(example_page, reviews=50)
+    if request.param == 'purchases':
+        return benchmark.synthetic_page(example_page, purchases=50)
+    return example_page
+
+
+@pytest.mark.parametrize('profile', sorted(ParseAppStorePage.profiles))
+def test_every_backend_parses_the_same(page, profile):
+    expected = ParseAppStorePage(page, 'html.parser', profile).parse()
+    for backend in backends:
+        assert ParseAppStorePage(page, backend, profile).parse() == expected, backend
+
+
+@pytest.mark.parametrize('profile', sorted(ParseAppStorePage.profiles))
+def test_streaming_parses_the_same(page, profile):
+    expected = ParseAppStorePage(page, 'html.parser', profile).parse()
+    assert StreamingParseAppStorePage(page, profile).parse() == expected
+
+    # streamed in small chunks, split anywhere, even mid character
+    data = page.encode('utf-8')
+    chunks = (data[i:i + 1000] for i in range(0, len(data), 1000))
+    assert StreamingParseAppStorePage(profile=profile).parse_stream(chunks) == expected
+
+
+@pytest.mark.parametrize('profile', sorted(ParseAppStorePage.profiles))
+def test_profiles_only_have_their_fields(example_page, profile):
+    full = ParseAppStorePage(example_page).parse()
+    parsed = ParseAppStorePage(example_page, profile=profile).parse()
+    fields = ParseAppStorePage.profiles[profile]
+    assert {x for x in parsed if x in fields} == fields
+    # and they come out the same as in a full parse
+    assert {k: v for k, v in parsed.items() if k in fields} == \
+        {k: v for k, v in full.items() if k in fields}
+
+
+def test_fields_narrow_the_profile(example_page):
+    parsed = ParseAppStorePage(example_page, 'strained', fields=('price', 'languages')).parse()
+    full = ParseAppStorePage(example_page).parse()
+    assert parsed['app_id'] == full['app_id']
+    assert parsed['price'] == full['price']
+    assert parsed['languages'] == full['languages']
+    assert parsed['price_value'] == full['price_value']
+
+
+@pytest.mark.parametrize('user_info, user', [
+    # what the baseline's re.sub loop gave, since user is part
+    # of the reviews' key
+    ('by  Jo\t\t\tAnn', 'Jo \tAnn'),
+    ('by Mary\n \nLou', 'Mary \nLou'),
+    ('by\n            Some  User Name  ', 'Some User Name'),
+    ('by \n\n\n  Q  R\t\tS', 'Q R S'),
+    ('  by  Y', 'by Y'),
+    ('by\tZ', 'by\tZ'),
+    ('by X', 'X'),
+])
+def test_clean_user_matches_the_baseline(user_info, user):
+    assert ParseAppStorePage.clean_user(user_info) == user
@@ -0,0 +1,25 @@
+import queue
+import threading
+
+from conftest import FakeSession, make_response
+from pipeline import PipelineCrawlAppStore
+
+
+class BrokenPool:
+    def submit(self, *args):
+        raise RuntimeError('cannot schedule new futures after shutdown')
+
+
+def test_a_failed_submit_gives_back_its_slot(in_tmp, example_page):
+    c = PipelineCrawlAppStore(fetch_workers=1, parse_workers=1, max_pending=1)
+    c.session = FakeSession([make_response(example_page)] * 2)
+    urls = queue.Queue()
+    for url in ['http://example.com/us/app/x/id1?mt=8', 'http://example.com/us/app/x/id2?mt=8']:
+        urls.put(url)
+    urls.put(None)
+    pending = threading.BoundedSemaphore(1)
+    c.fetch_worker(urls, BrokenPool(), pending)
+    c.close()
+    # both urls got as far as the pool, and the slot is free
+    assert len(c.session.calls) == 2
+    assert pending.acquire(blocking=False)
@@ -0,0 +1,37 @@
+import sqlite3
+
+from migrations import migrate
+from postprocess import normalize_db
+
+
+def test_normalizes_the_db_in_batches(in_tmp):
+    migrate('app_store_db')
+    with sqlite3.connect('app_store_db') as conn:
+        conn.executemany(
+            'INSERT INTO app_store_main (app_id, price, size) VALUES (?, ?, ?)',
+            [(str(i), 'Free' if i % 2 else '$0.99', '1 MB') for i in range(7)]
+        )
+        conn.executemany(
+            'INSERT INTO app_store_top_in_app_purchases (app_id, "order", price) VALUES (?, ?, ?)',
+            [('1', i, '$1.99') for i in range(5)]
+        )
+        conn.executemany(
+            'INSERT INTO app_store_customer_reviews (app_id, rating) VALUES (?, ?)',
+            [('1', '4 out of 5')] * 3
+        )
+        counts = normalize_db(conn, batch_size=2)
+        assert counts == {
+            'app_store_main': 7, 'app_store_top_in_app_purchases': 5,
+            'app_store_customer_reviews': 3,
+        }
+        assert conn.execute(
+            'SELECT count(*) FROM app_store_main WHERE price_value IS NULL OR size_bytes IS NULL'
+        ).fetchone()[0] == 0
+        assert {x[0] for x in conn.execute(
+            'SELECT price_value FROM app_store_top_in_app_purchases'
+        )} == {1.99}
+        assert {x[0] for x in conn.execute(
+            'SELECT rating_value FROM app_store_customer_reviews'
+        )} == {4.0}
+        # nothing left to change
+        assert normalize_db(conn, batch_size=2) == dict.fromkeys(counts, 0)
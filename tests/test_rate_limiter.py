@@ -0,0 +1,97 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from rate_limiter import (
+    CLIENT_ERROR, OK, SERVER_ERROR, THROTTLED, TIMEOUT, AdaptiveRateLimiter,
+    classify_status, parse_retry_after
+)
+
+url = 'https://itunes.apple.com/us/app/x/id1?mt=8'
+
+
+def acquire_now(limiter):
+    """Acquires without waiting for the bucket to refill."""
+    with limiter.condition:
+        limiter.host_state('itunes.apple.com').tokens = 1.0
+    limiter.acquire(url)
+
+
+@pytest.mark.parametrize('status_code, outcome', [
+    (200, OK), (304, OK), (404, CLIENT_ERROR), (429, THROTTLED),
+    (503, THROTTLED), (500, SERVER_ERROR),
+])
+def test_classify_status(status_code, outcome):
+    assert classify_status(status_code) == outcome
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after('-5') == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert 55 < parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+    assert parse_retry_after(formatdate(time.time() - 60, usegmt=True)) == 0.0
+
+
+def test_healthy_responses_raise_the_rate_a_step_at_a_time():
+    limiter = AdaptiveRateLimiter(initial_rate=1.0, increase=0.5, max_rate=2.0)
+    for _ in range(3):
+        acquire_now(limiter)
+        limiter.release(url, OK)
+    assert limiter.rate(url) == 2.0
+    state = limiter.rates()['itunes.apple.com']
+    assert state['in_flight'] == 0 and state['concurrency'] == 2
+
+
+def test_bad_responses_cut_the_rate():
+    limiter = AdaptiveRateLimiter(initial_rate=4.0, decrease=0.5, min_rate=1.5)
+    for outcome, rate in ((SERVER_ERROR, 2.0), (TIMEOUT, 1.5), (CLIENT_ERROR, 1.5)):
+        acquire_now(limiter)
+        limiter.release(url, outcome)
+        assert limiter.rate(url) == rate
+    # the limits are per host
+    assert limiter.rate('example.com') == 4.0
+
+
+def test_concurrency_limits_requests_in_flight():
+    limiter = AdaptiveRateLimiter(initial_rate=100.0, max_rate=100.0)
+    with limiter.condition:
+        assert limiter.try_acquire(url) == 0
+        # one in flight to start with
+        assert limiter.try_acquire(url) is None
+    limiter.release(url, OK)
+    # the slot is free again, so it only waits for a token
+    with limiter.condition:
+        assert 0 < limiter.try_acquire(url) <= 0.01
+
+
+def test_retry_after_blocks_the_host():
+    limiter = AdaptiveRateLimiter(initial_rate=100.0, max_rate=100.0)
+    limiter.acquire(url)
+    limiter.release(url, THROTTLED, retry_after=30.0)
+    with limiter.condition:
+        assert 29 < limiter.try_acquire(url) <= 30
+        assert limiter.try_acquire('https://example.com/') == 0
+
+
+def test_throttles_without_retry_after_back_off_further_each_time(monkeypatch):
+    monkeypatch.setattr('random.uniform', lambda low, high: high)
+    limiter = AdaptiveRateLimiter(base_backoff=2.0, max_backoff=5.0)
+    waits = []
+    for _ in range(3):
+        acquire_now(limiter)
+        limiter.release(url, THROTTLED)
+        with limiter.condition:
+            state = limiter.host_state('itunes.apple.com')
+            waits.append(round(state.blocked_until - time.monotonic()))
+            state.blocked_until = 0.0
+    assert waits == [2, 4, 5]
+
+
+def test_backoff_is_jittered_below_its_ceiling():
+    limiter = AdaptiveRateLimiter(base_backoff=1.0, max_backoff=8.0)
+    for attempt, ceiling in ((1, 1.0), (3, 4.0), (10, 8.0)):
+        for _ in range(20):
+            assert ceiling / 2 <= limiter.backoff(attempt) <= ceiling
@@ -0,0 +1,59 @@
+import json
+import pickle
+import sqlite3
+
+import pytest
+
+from migrations import migrate
+from parse_app_page import ParseAppStorePage
+from records import AppRecord, PurchaseRecord, ReviewRecord, main_table_columns
+
+
+@pytest.fixture
+def parsed(example_page):
+    parsed = ParseAppStorePage(example_page)
+    parsed.parse()
+    return parsed
+
+
+def test_records_hold_everything_the_parser_output(parsed):
+    record = parsed.to_record()
+    assert record.to_output_dict() == parsed.output_dict
+    assert record.main_row() == tuple(parsed.output_dict[x] for x in main_table_columns)
+    assert record.language_rows() == [
+        (record.app_id, x) for x in parsed.output_dict['languages']
+    ]
+    assert all(isinstance(x, PurchaseRecord) for x in record.top_in_app_purchases)
+    assert all(isinstance(x, ReviewRecord) for x in record.customer_reviews)
+    assert record.top_in_app_purchases and record.customer_reviews
+
+
+def test_records_survive_json_and_pickle(parsed):
+    record = parsed.to_record()
+    assert AppRecord.from_list(json.loads(json.dumps(record))) == record
+    assert pickle.loads(pickle.dumps(record)) == record
+    # tuples don't carry their field names around
+    assert len(pickle.dumps(record)) < len(pickle.dumps(parsed.output_dict))
+    assert not hasattr(record, '__dict__')
+
+
+def test_record_rows_line_up_with_the_db_columns(in_tmp, parsed):
+    migrate('app_store_db')
+    parsed.write_out()
+    record = parsed.to_record()
+    with sqlite3.connect('app_store_db') as conn:
+        assert conn.execute(
+            'SELECT {} FROM app_store_main'.format(', '.join(main_table_columns))
+        ).fetchone() == record.main_row()
+        assert conn.execute(
+            """
+            SELECT app_id, "order", title, price, price_value
+            FROM app_store_top_in_app_purchases ORDER BY "order"
+            """
+        ).fetchall() == list(record.top_in_app_purchases)
+        assert set(conn.execute(
+            """
+            SELECT app_id, title, rating, user, content, rating_value
+            FROM app_store_customer_reviews
+            """
+        ).fetchall()) == set(record.customer_reviews)
@@ -0,0 +1,93 @@
+import sqlite3
+import time
+
+import pytest
+
+from conftest import FakeSession, make_response
+from app_store_crawler import CrawlAppStore
+from http_cache import HTTPCache
+from rate_limiter import AdaptiveRateLimiter
+from refresh import RefreshAppStore
+from stub_server import StubAppStoreServer
+
+app_path = '/us/app/archery-king/id1121971067?mt=8'
+
+
+def fast(crawler):
+    crawler.rate_limiter = AdaptiveRateLimiter(
+        initial_rate=1000, max_rate=1000, base_backoff=0.0
+    )
+    return crawler
+
+
+@pytest.fixture
+def crawled(in_tmp, example_page):
+    """The example app crawled from a stub server, which
+    is yielded for the test to change the page on."""
+    with StubAppStoreServer(pages={app_path: example_page}) as server:
+        c = fast(CrawlAppStore())
+        c.frontier.add([server.url(app_path)])
+        c.crawl_app_pages_from_db()
+        c.close()
+        yield server
+
+
+def url_state(url):
+    with sqlite3.connect('app_store_db') as conn:
+        return conn.execute(
+            'SELECT state, attempts FROM app_store_app_urls WHERE url = ?', (url,)
+        ).fetchone()
+
+
+def test_failed_refresh_leaves_the_frontier_alone(crawled):
+    url = crawled.url(app_path)
+    before = url_state(url)
+    assert before[0] == 'done'
+    crawled.pages[app_path] = '<html></html>'
+    c = fast(RefreshAppStore())
+    c.refresh_from_db()
+    c.close()
+    assert c.counts['failed'] == 1
+    assert url_state(url) == before
+
+
+def test_refresh_of_reviews_only_touches_updated_at(crawled, example_page):
+    with sqlite3.connect('app_store_db') as conn:
+        conn.execute('UPDATE app_store_main SET updated_at = 0')
+    crawled.pages[app_path] = example_page.replace(
+        'Almost could be a good game but...', 'Almost a good game'
+    )
+    c = fast(RefreshAppStore())
+    c.refresh_from_db()
+    c.close()
+    assert c.counts['changed'] == 1
+    with sqlite3.connect('app_store_db') as conn:
+        updated_at = conn.execute('SELECT updated_at FROM app_store_main').fetchone()[0]
+    assert abs(updated_at - time.time()) < 60
+
+
+def test_not_modified_without_a_page_state(in_tmp):
+    # a 304 the crawler didn't ask for, e.g. from a proxy
+    c = fast(RefreshAppStore())
+    c.session = FakeSession([make_response(status_code=304)])
+    c.scrape_app_page('http://example.com/us/app/x/id1?mt=8')
+    c.close()
+    assert c.counts['not_modified'] == 1
+    assert c.session.calls[0][1]['headers'] == {}
+    with sqlite3.connect('app_store_db') as conn:
+        assert conn.execute(
+            'SELECT etag, last_modified, content_hash FROM app_store_page_state'
+        ).fetchall() == [(None, None, None)]
+
+
+def test_refreshed_pages_go_in_the_http_cache(crawled, example_page):
+    url = crawled.url(app_path)
+    cache = HTTPCache()
+    crawled.pages[app_path] = example_page.replace('Archery King', 'Archery Queen')
+    c = fast(RefreshAppStore(http_cache=cache))
+    c.refresh_from_db()
+    c.close()
+    assert c.counts['changed'] == 1
+    cache = HTTPCache()
+    assert 'Archery Queen' in cache.get(url)
+    cache.close()
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+
+from migrations import migrate
+from url_dedup import BloomFilter, LinkDeduper, app_id_from_url
+
+
+def link(app_id):
+    return 'https://itunes.apple.com/us/app/x/id{}?mt=8'.format(app_id)
+
+
+def insert_urls(app_ids):
+    with sqlite3.connect('app_store_db') as conn:
+        conn.executemany(
+            'INSERT INTO app_store_app_urls (url, app_id) VALUES (?, ?)',
+            [(link(x), x) for x in app_ids]
+        )
+
+
+def test_app_id_from_url():
+    assert app_id_from_url(link(1121971067)) == 1121971067
+    assert app_id_from_url('https://itunes.apple.com/us/genre/ios-games') is None
+
+
+def test_bloom_filter_has_no_false_negatives(in_tmp):
+    bloom = BloomFilter(10000, 0.01)
+    for x in range(10000):
+        bloom.add(x)
+    assert all(x in bloom for x in range(10000))
+    false_positives = sum(x in bloom for x in range(10000, 20000))
+    assert false_positives < 300
+    bloom.save('bloom')
+    loaded = BloomFilter.load('bloom')
+    assert all(x in loaded for x in range(10000))
+
+
+def test_links_seen_before_are_dropped(in_tmp):
+    migrate('app_store_db')
+    insert_urls([1])
+    deduper = LinkDeduper()
+    assert deduper.filter_new([link(1), link(2), link(2), 'no id']) == [(link(2), 2)]
+
+
+def test_a_saved_filter_catches_up_with_the_db(in_tmp):
+    migrate('app_store_db')
+    insert_urls([1])
+    deduper = LinkDeduper(bloom_capacity=1000, bloom_path='bloom')
+    deduper.filter_new([link(2)])
+    deduper.save()
+    # urls written after the last save, i.e. before a crash
+    insert_urls([2, 3])
+    deduper = LinkDeduper(bloom_capacity=1000, bloom_path='bloom')
+    assert deduper.filter_new([link(x) for x in (1, 2, 3, 4)]) == [(link(4), 4)]
+    assert (deduper.rowid, deduper.rows) == (3, 3)
+
+
+def test_a_filter_whose_rows_changed_is_rebuilt(in_tmp, capsys):
+    migrate('app_store_db')
+    insert_urls([1, 2])
+    deduper = LinkDeduper(bloom_capacity=1000, bloom_path='bloom')
+    deduper.filter_new([])
+    deduper.save()
+    with sqlite3.connect('app_store_db') as conn:
+        conn.execute('DELETE FROM app_store_app_urls WHERE app_id = 1')
+    deduper = LinkDeduper(bloom_capacity=1000, bloom_path='bloom')
+    assert deduper.filter_new([link(1), link(2)]) == [(link(1), 1)]
+    assert 'rebuilding' in capsys.readouterr().out
+
+
+def test_the_filter_is_saved_while_links_come_in(in_tmp):
+    migrate('app_store_db')
+    deduper = LinkDeduper(bloom_capacity=1000, bloom_path='bloom', save_interval=0)
+    deduper.filter_new([link(1)])
+    assert os.path.exists('bloom') and not os.path.exists('bloom.tmp')
+    # nothing else is saved, as if the crawler crashed
+    deduper = LinkDeduper(bloom_capacity=1000, bloom_path='bloom')
+    assert deduper.filter_new([link(1)]) == []
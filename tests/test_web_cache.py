@@ -0,0 +1,176 @@
+import sqlite3
+import time
+
+import pytest
+
+from db_shards import ShardedConnectionPool, create_shards, shard_index
+from migrations import migrate
+from web_cache import ChangeWatcher, ConnectionPool, TTLCache
+
+
+def add_app(app_id):
+    with sqlite3.connect('app_store_db') as conn:
+        conn.execute(
+            'INSERT INTO app_store_main (app_id, app_name) VALUES (?, ?)',
+            (app_id, 'app {}'.format(app_id))
+        )
+
+
+def test_ttl_cache_drops_the_least_recently_used():
+    cache = TTLCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
+def test_ttl_cache_expires():
+    cache = TTLCache(ttl=-1)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_watcher_drops_changed_apps_and_rate_limits_clears(in_tmp):
+    migrate('app_store_db')
+    add_app('1')
+    app_cache = TTLCache()
+    searches = TTLCache()
+    watcher = ChangeWatcher('app_store_db', app_cache, (searches,), clear_interval=60)
+    app_cache.set('1', {'page': 'old'})
+    app_cache.set('2', {'page': 'other'})
+    searches.set('q', 'old results')
+    with sqlite3.connect('app_store_db') as conn:
+        conn.execute("UPDATE app_store_main SET app_name = 'new' WHERE app_id = '1'")
+    watcher.check()
+    assert app_cache.get('1') is None
+    assert app_cache.get('2') is not None
+    assert searches.get('q') is None
+    # another write straight after only drops the apps it changed
+    searches.set('q', 'new results')
+    add_app('2')
+    watcher.check()
+    assert app_cache.get('2') is None
+    assert searches.get('q') == 'new results'
+    # until the interval is up
+    watcher.next_clear = 0
+    watcher.check()
+    assert searches.get('q') is None
+    watcher.close()
+
+
+@pytest.fixture
+def viz(in_tmp, monkeypatch):
+    migrate('app_store_db')
+    import app_store_visualization as v
+    path = str(in_tmp / 'app_store_db')
+    monkeypatch.setattr(v, 'pool', ConnectionPool(path))
+    monkeypatch.setattr(v, 'watcher', ChangeWatcher(path, v.app_cache))
+    monkeypatch.setattr(v, 'app_cache', TTLCache())
+    v.watcher.app_cache = v.app_cache
+    yield v
+    v.pool.close()
+    v.watcher.close()
+
+
+def test_missing_apps_are_not_cached(viz):
+    add_app('1')
+    client = viz.app.test_client()
+    assert client.get('/api/apps?ids=1,404,405').get_json()['apps'][0]['app_id'] == '1'
+    assert client.get('/app_id/406').status_code == 200
+    assert client.get('/app_id/1').status_code == 200
+    assert sorted(viz.app_cache.entries) == ['1']
+
+
+def test_metrics_page_reads_the_counts_the_triggers_keep(viz):
+    add_app('1')
+    add_app('2')
+    with sqlite3.connect('app_store_db') as conn:
+        conn.executemany(
+            'INSERT INTO app_store_app_urls (url) VALUES (?)', [('a',), ('b',)]
+        )
+        conn.execute("UPDATE app_store_app_urls SET state = 'done' WHERE url = 'a'")
+    lines = viz.app.test_client().get('/metrics').get_data(as_text=True).splitlines()
+    assert 'app_store_db_frontier_urls{state="done"} 1' in lines
+    assert 'app_store_db_frontier_urls{state="pending"} 1' in lines
+    assert 'app_store_db_apps 2' in lines
+
+
+def test_watcher_drops_apps_whose_child_rows_changed(in_tmp):
+    migrate('app_store_db')
+    add_app('1')
+    add_app('2')
+    app_cache = TTLCache()
+    watcher = ChangeWatcher('app_store_db', app_cache, slack=0)
+    for statement in (
+        "INSERT INTO app_store_languages (app_id, language) VALUES ('1', 'English')",
+        "UPDATE app_store_languages SET language = 'French'",
+        "DELETE FROM app_store_languages",
+        """
+        INSERT INTO app_store_top_in_app_purchases (app_id, "order", title)
+        VALUES ('1', 1, 'Coins')
+        """,
+        "INSERT INTO app_store_customer_reviews (app_id, title) VALUES ('1', 'Fun')",
+    ):
+        app_cache.set('1', {'page': 'old'})
+        app_cache.set('2', {'page': 'other'})
+        time.sleep(0.01)
+        with sqlite3.connect('app_store_db') as conn:
+            conn.execute(statement)
+        watcher.check()
+        assert app_cache.get('1') is None, statement
+        assert app_cache.get('2') is not None
+    watcher.close()
+
+
+def add_search_app(app_id, name, description='', db='app_store_db'):
+    with sqlite3.connect(db) as conn:
+        conn.execute(
+            'INSERT INTO app_store_main (app_id, app_name, description) VALUES (?, ?, ?)',
+            (app_id, name, description)
+        )
+
+
+def search(viz, string, page=1):
+    return viz.app.test_client().post(
+        '/ajax_apps', data={'string': string, 'page': page}
+    ).get_json()
+
+
+def test_search_ranks_names_above_descriptions(viz, monkeypatch):
+    monkeypatch.setattr(viz, 'search_cache', TTLCache())
+    add_search_app('1', 'Puzzle Land', 'an archery game')
+    add_search_app('2', 'Archery King', 'shoot arrows')
+    add_search_app('3', 'Chess', 'no match here')
+    r = search(viz, 'arch')
+    assert r['results'] == [['2', 'Archery King'], ['1', 'Puzzle Land']]
+    assert r['more'] is False
+    assert search(viz, '"*')['results'] == []
+
+
+def test_search_pages_through_every_match_once(viz, monkeypatch):
+    monkeypatch.setattr(viz, 'search_cache', TTLCache())
+    monkeypatch.setattr(viz, 'results_per_page', 2)
+    for x in range(5):
+        add_search_app(str(x), 'Archery {}'.format(x))
+    pages = [search(viz, 'archery', page) for page in (1, 2, 3)]
+    assert [x['more'] for x in pages] == [True, True, False]
+    ids = [app_id for x in pages for app_id, _ in x['results']]
+    assert sorted(ids) == ['0', '1', '2', '3', '4']
+    # the cached page comes back the same
+    assert search(viz, 'archery', 2) == pages[1]
+
+
+def test_search_merges_the_shards_by_rank(viz, monkeypatch):
+    monkeypatch.setattr(viz, 'search_cache', TTLCache())
+    paths = create_shards('app_store_db', 2)
+    viz.pool.close()
+    monkeypatch.setattr(viz, 'pool', ShardedConnectionPool('app_store_db'))
+    apps = [('1', 'Archery', ''), ('2', 'Puzzle', 'archery'),
+            ('3', 'Archery Pro', ''), ('4', 'Chess', 'archery')]
+    for app_id, name, description in apps:
+        add_search_app(app_id, name, description, paths[shard_index(app_id, 2)])
+    assert {shard_index(x[0], 2) for x in apps} == {0, 1}
+    ids = [x[0] for x in search(viz, 'archery')['results']]
+    assert sorted(ids[:2]) == ['1', '3'] and sorted(ids[2:]) == ['2', '4']
@@ -0,0 +1,239 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+app_id_regex = re.compile(r'/id([0-9]+)')
+
+
+def app_id_from_url(url):
+    """Takes an app url like
+    https://itunes.apple.com/us/app/archery-king/id1121971067?mt=8
+    and returns the app's numeric id, 1121971067.
+
+    :param url:
+    :type url: str
+    :return: the id, or None if the url doesn't have one
+    :rtype: int
+    """
+    app_id_search = app_id_regex.search(url)
+    if app_id_search is None:
+        return None
+    return int(app_id_search.group(1))
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001, bits=None):
+        """A compact set that can say an item is definitely not
+        in it, or probably is. Once capacity items are added,
+        about error_rate of the lookups for new items will wrongly
+        say they're already there.
+
+        :param capacity:
+        :type capacity: int
+        :param error_rate:
+        :type error_rate: float
+        :param bits: the filter's contents, when loading one
+        :type bits: bytearray
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        size = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(8, int(math.ceil(size / 8)) * 8)
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bits if bits is not None else bytearray(self.size // 8)
+
+    def positions(self, item):
+        # two hashes combined make as many as we need
+        digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(item)
+        )
+
+    def write(self, f):
+        """
+        :param f: a file opened for writing bytes
+        :type f: io.BufferedWriter
+        """
+        f.write('{} {}\n'.format(self.capacity, self.error_rate).encode('ascii'))
+        f.write(self.bits)
+
+    @classmethod
+    def read(cls, f):
+        """Reads a filter written out by write.
+
+        :param f: a file opened for reading bytes
+        :type f: io.BufferedReader
+        :rtype: BloomFilter
+        """
+        capacity, error_rate = f.readline().split()
+        return cls(int(capacity), float(error_rate), bytearray(f.read()))
+
+    def save(self, path):
+        """Writes the filter out to a file.
+
+        :param path:
+        :type path: str
+        """
+        with open(path, 'wb') as f:
+            self.write(f)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a filter written out by save.
+
+        :param path:
+        :type path: str
+        :rtype: BloomFilter
+        """
+        with open(path, 'rb') as f:
+            return cls.read(f)
+
+
+# noinspection SqlDialectInspection
+class LinkDeduper:
+    def __init__(self, db='app_store_db', bloom_capacity=None,
+                 bloom_error_rate=0.001, bloom_path=None, save_interval=300.0):
+        """Remembers the ids of every app url already in the
+        frontier, so links found again under another genre or
+        letter never reach the db.
+
+        The ids are kept in a set, or in a Bloom filter when
+        bloom_capacity is given. The filter takes a couple of bytes
+        per app, but drops about bloom_error_rate of the new links.
+        It's filled from the db the first time it's used, or from
+        bloom_path if a filter was saved there.
+
+        A saved filter is only as new as its last save, i.e. after
+        a crash, so the rowid of app_store_app_urls it had got up
+        to is saved with it. Loading it adds the urls inserted
+        since, and rebuilds it from the db if the rows it had
+        covered have changed, i.e. after a VACUUM renumbered them.
+        The filter is saved every save_interval seconds while links
+        are being filtered, and on close.
+
+        :param db:
+        :type db: str
+        :param bloom_capacity: the most apps expected
+        :type bloom_capacity: int
+        :param bloom_error_rate:
+        :type bloom_error_rate: float
+        :param bloom_path:
+        :type bloom_path: str
+        :param save_interval: seconds between saves of the filter
+        :type save_interval: float
+        """
+        self.db = db
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.bloom_path = bloom_path
+        self.save_interval = save_interval
+        self.seen = None
+        # the last app_store_app_urls rowid in seen,
+        # and the number of rows up to it
+        self.rowid = 0
+        self.rows = 0
+        self.next_save = time.monotonic() + save_interval
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Fills the seen ids from a saved filter or the db."""
+        if self.bloom_capacity is None:
+            self.seen = set()
+        elif self.bloom_path and os.path.exists(self.bloom_path):
+            with open(self.bloom_path, 'rb') as f:
+                rowid, rows = f.readline().split()
+                self.seen = BloomFilter.read(f)
+            self.rowid, self.rows = int(rowid), int(rows)
+            if self.count_rows(self.rowid) != self.rows:
+                print('{} is out of date, rebuilding it'.format(self.bloom_path))
+                self.seen = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+                self.rowid = self.rows = 0
+        else:
+            self.seen = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        self.catch_up()
+
+    def count_rows(self, rowid):
+        """
+        :param rowid:
+        :type rowid: int
+        :return: the number of urls up to rowid
+        :rtype: int
+        """
+        with sqlite3.connect(self.db) as conn:
+            return conn.execute(
+                'SELECT count(*) FROM app_store_app_urls WHERE rowid <= ?', (rowid,)
+            ).fetchone()[0]
+
+    def catch_up(self):
+        """Adds the ids of the urls inserted since rowid."""
+        with sqlite3.connect(self.db) as conn:
+            cursor = conn.execute(
+                """
+                SELECT rowid, app_id FROM app_store_app_urls
+                WHERE rowid > ? ORDER BY rowid
+                """,
+                (self.rowid,)
+            )
+            for rowid, app_id in cursor:
+                if app_id is not None:
+                    self.seen.add(app_id)
+                self.rowid = rowid
+                self.rows += 1
+
+    def save_filter(self):
+        """Catches up with the db and writes the Bloom filter
+        out to bloom_path, if there's one. Call it holding lock.
+        """
+        if not isinstance(self.seen, BloomFilter) or not self.bloom_path:
+            return
+        self.catch_up()
+        # a crash part way through leaves the last save in place
+        path = self.bloom_path + '.tmp'
+        with open(path, 'wb') as f:
+            f.write('{} {}\n'.format(self.rowid, self.rows).encode('ascii'))
+            self.seen.write(f)
+        os.replace(path, self.bloom_path)
+
+    def save(self):
+        """Saves the Bloom filter to bloom_path, if there's one."""
+        with self.lock:
+            self.save_filter()
+
+    def filter_new(self, links):
+        """Picks out the links to apps that haven't been seen
+        before, and remembers them as seen.
+
+        :param links:
+        :type links: list
+        :return: (link, app id) for each new link
+        :rtype: list
+        """
+        new_links = []
+        with self.lock:
+            if self.seen is None:
+                self.load()
+            for link in links:
+                app_id = app_id_from_url(link)
+                if app_id is None:
+                    continue
+                if app_id not in self.seen:
+                    self.seen.add(app_id)
+                    new_links.append((link, app_id))
+            if time.monotonic() >= self.next_save:
+                self.save_filter()
+                self.next_save = time.monotonic() + self.save_interval
+        return new_links
@@ -0,0 +1,229 @@
+import collections
+import contextlib
+import queue
+import sqlite3
+import threading
+import time
+
+
+class ConnectionPool:
+    # see db_shards.ShardedConnectionPool
+    shard_count = 1
+
+    def __init__(self, db='app_store_db', size=8):
+        """Keeps up to size sqlite connections open for the
+        web server's threads to share, instead of opening
+        one per request.
+
+        :param db:
+        :type db: str
+        :param size:
+        :type size: int
+        """
+        self.db = db
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db, check_same_thread=False)
+        conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Lends out a connection for the with block, waiting
+        for one to be returned if they're all in use.
+
+        :rtype: sqlite3.Connection
+        """
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.opened < self.size
+                if can_open:
+                    self.opened += 1
+            conn = self.connect() if can_open else self.idle.get()
+        try:
+            yield conn
+        finally:
+            # don't hand a connection out in the
+            # middle of somebody else's transaction
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put(conn)
+
+    def connection_for(self, app_id):
+        """The same as connection, for code that also
+        reads sharded dbs."""
+        return self.connection()
+
+    def map(self, function):
+        """
+        :param function: called with a connection
+        :type function: function
+        :return: what it returned, as the only shard
+        :rtype: list
+        """
+        with self.connection() as conn:
+            return [function(conn)]
+
+    def map_ids(self, function, app_ids):
+        """
+        :param function: called with a connection and app_ids
+        :type function: function
+        :param app_ids:
+        :type app_ids: list
+        :return: what it returned, as the only shard
+        :rtype: list
+        """
+        with self.connection() as conn:
+            return [function(conn, app_ids)]
+
+    def close(self):
+        while 1:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class TTLCache:
+    def __init__(self, max_size=1000, ttl=60.0):
+        """A least recently used cache whose entries also
+        expire ttl seconds after they're set.
+
+        :param max_size:
+        :type max_size: int
+        :param ttl:
+        :type ttl: float
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# noinspection SqlDialectInspection
+class ChangeWatcher:
+    def __init__(self, db='app_store_db', app_cache=None, caches=(), slack=5.0,
+                 clear_interval=10.0):
+        """Notices when something else, i.e. the crawler, has
+        written to the db and drops the cached entries it made
+        stale.
+
+        PRAGMA data_version changes whenever another connection
+        commits, which is cheap enough to check on every request.
+        When it does, the apps with an updated_at since the last
+        check are dropped from app_cache, which is keyed by app id,
+        and the other caches are cleared. Triggers move updated_at
+        when an app's languages, purchases or reviews change too.
+
+        A crawler commits about once a second, which would
+        clear the other caches before they're ever hit, so
+        they're cleared at most once every clear_interval
+        seconds. The first write after a quiet spell clears
+        them straight away.
+
+        :param db:
+        :type db: str
+        :param app_cache:
+        :type app_cache: TTLCache
+        :param caches: caches of anything that any write
+            could change, i.e. search results
+        :type caches: tuple
+        :param slack: seconds to look back past the latest
+            updated_at seen, for transactions that took a
+            while to commit
+        :type slack: float
+        :param clear_interval: the longest the caches can
+            be behind the db
+        :type clear_interval: float
+        """
+        self.app_cache = app_cache
+        self.caches = caches
+        self.slack = slack
+        self.clear_interval = clear_interval
+        self.caches_stale = False
+        self.next_clear = 0.0
+        self.conn = sqlite3.connect(db, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.data_version = self.read_data_version()
+        self.last_updated_at = self.read_last_updated_at()
+
+    def read_data_version(self):
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def read_last_updated_at(self):
+        try:
+            return self.conn.execute(
+                'SELECT max(updated_at) FROM app_store_main'
+            ).fetchone()[0] or 0.0
+        except sqlite3.OperationalError:
+            # the db hasn't been created yet
+            return 0.0
+
+    def check(self):
+        """Drops whatever's gone stale since the last check."""
+        with self.lock:
+            data_version = self.read_data_version()
+            if data_version != self.data_version:
+                self.data_version = data_version
+                self.caches_stale = True
+                self.drop_changed_apps()
+            now = time.monotonic()
+            if self.caches_stale and now >= self.next_clear:
+                for cache in self.caches:
+                    cache.clear()
+                self.caches_stale = False
+                self.next_clear = now + self.clear_interval
+
+    def drop_changed_apps(self):
+        """Drops the apps updated since the last check
+        from app_cache."""
+        if self.app_cache is None:
+            return
+        changed = self.conn.execute(
+            'SELECT app_id, updated_at FROM app_store_main WHERE updated_at > ?',
+            (self.last_updated_at - self.slack,)
+        ).fetchall()
+        for app_id, updated_at in changed:
+            self.app_cache.pop(app_id)
+            self.last_updated_at = max(self.last_updated_at, updated_at)
+
+    def close(self):
+        self.conn.close()